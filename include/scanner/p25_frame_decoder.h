@@ -41,8 +41,14 @@ public:
    /*!
     * \brief Return a shared_ptr to a new instance of
     * gr::scanner::p25_frame_decoder_impl.
+    *
+    * \param debug Debug level (>= 10 logs decoded data units to stderr)
+    * \param binary_pdus Emit PDUs in the compact binary format rather than
+    *        JSON
+    * \param latency_probe Stamp P25 DU PDUs with the time they're emitted
+    *        (a t_ns field), so their latency can be measured downstream
     */
-   static sptr make(int debug);
+   static sptr make(int debug, bool binary_pdus = false, bool latency_probe = false);
 };
 
 } // namespace scanner
@@ -37,9 +37,11 @@ namespace gr
 {
 namespace scanner
 {
-p25_frame_decoder::sptr p25_frame_decoder::make(int debug)
+p25_frame_decoder::sptr
+p25_frame_decoder::make(int debug, bool binary_pdus, bool latency_probe)
 {
-   return gnuradio::get_initial_sptr(new p25_frame_decoder_impl(debug));
+   return gnuradio::get_initial_sptr(
+      new p25_frame_decoder_impl(debug, binary_pdus, latency_probe));
 }
 
 /*
@@ -57,11 +59,13 @@ static const int MAX_IN = 1; // maximum number of input streams
 /*
  * The private constructor
  */
-p25_frame_decoder_impl::p25_frame_decoder_impl(int debug)
+p25_frame_decoder_impl::p25_frame_decoder_impl(int debug,
+   bool binary_pdus,
+   bool latency_probe)
    : gr::sync_block("p25_frame_decoder",
       gr::io_signature::make(MIN_IN, MAX_IN, sizeof(char)),
       gr::io_signature::make(0, 0, 0))
-   , p1fdma(debug, *this)
+   , p1fdma(debug, *this, binary_pdus, latency_probe)
 {
    message_port_register_out(pmt::mp("p25"));
 }
@@ -40,7 +40,7 @@ private:
    p25p1_fdma p1fdma;
 
 public:
-   p25_frame_decoder_impl(int debug);
+   p25_frame_decoder_impl(int debug, bool binary_pdus, bool latency_probe);
    ~p25_frame_decoder_impl();
 
    // Where all the action really happens
@@ -36,6 +36,8 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <chrono>
+#include <map>
 #include <sys/time.h>
 #include <vector>
 
@@ -196,8 +198,13 @@ static int block_deinterleave(bit_vector& bv, unsigned int start, uint8_t* buf)
    return 0;
 }
 
-p25p1_fdma::p25p1_fdma(int debug, gr::block& owning_block)
+p25p1_fdma::p25p1_fdma(int debug,
+   gr::block& owning_block,
+   bool binary_pdus,
+   bool latency_probe)
    : d_debug(debug)
+   , d_binary_pdus(binary_pdus)
+   , d_latency_probe(latency_probe)
    , d_owning_block(owning_block)
    , framer(new p25_framer(debug))
    , ess_algid(0x80)
@@ -729,8 +736,113 @@ void p25p1_fdma::process_voice(const bit_vector& A, std::vector<uint8_t>& pc)
    }
 }
 
+void p25p1_fdma::send_binary_pdu(uint8_t pdu_type,
+   uint32_t nac,
+   uint32_t duid,
+   const p25_du_data& data)
+{
+   // clang-format off
+   static const std::map<std::string, uint8_t> field_ids = {
+      {"tsbk", binary_pdu::TSBK},
+      {"imbe", binary_pdu::IMBE},
+      {"lcw", binary_pdu::LCW},
+      {"pdu", binary_pdu::PDU},
+      {"mi", binary_pdu::MI},
+      {"mfid", binary_pdu::MFID},
+      {"tgid", binary_pdu::TGID},
+      {"algid", binary_pdu::ALGID},
+      {"keyid", binary_pdu::KEYID},
+      {"fmt", binary_pdu::FMT},
+      {"sap", binary_pdu::SAP},
+      {"blks", binary_pdu::BLKS},
+      {"symbols", binary_pdu::SYMBOLS},
+      {"syncs", binary_pdu::SYNCS},
+      {"good_nids", binary_pdu::GOOD_NIDS},
+      {"bad_nids", binary_pdu::BAD_NIDS},
+      {"t_ns", binary_pdu::T_NS}};
+   // clang-format on
+
+   // The ok flag lives in the header rather than in a field
+   uint8_t ok = 1;
+   std::string pdu;
+   pdu.reserve(binary_pdu::HEADER_LEN + 128);
+   pdu += (char) binary_pdu::MAGIC;
+   pdu += (char) pdu_type;
+   pdu += (char)((nac >> 8) & 0xff);
+   pdu += (char)(nac & 0xff);
+   pdu += (char)(duid & 0xff);
+   pdu += (char) 0; // ok flag, filled in below
+   for(const auto& datum : data)
+   {
+      if(datum.first == "ok")
+      {
+         ok = datum.second.m_data ? 1 : 0;
+         continue;
+      }
+      auto field_id = field_ids.find(datum.first);
+      if(field_id == field_ids.end())
+         continue;
+      size_t len = datum.second.binary_size();
+      pdu += (char) field_id->second;
+      pdu += (char)((len >> 8) & 0xff);
+      pdu += (char)(len & 0xff);
+      datum.second.serialize_binary(pdu);
+   }
+   pdu[binary_pdu::HEADER_LEN - 1] = (char) ok;
+
+   pmt::pmt_t pdu_data = pmt::init_u8vector(pdu.size(), (const uint8_t*) pdu.data());
+   d_owning_block.message_port_pub(pmt::intern("p25"), pdu_data);
+}
+
+void p25p1_fdma::send_stats_pdu(const struct framer_stats& stats)
+{
+   if(d_binary_pdus)
+   {
+      // clang-format off
+      send_binary_pdu(binary_pdu::STATS, 0, 0,
+         {{"symbols", U32_DATA(stats.symbols_received)},
+          {"syncs", U32_DATA(stats.syncs_detected)},
+          {"good_nids", U32_DATA(stats.good_nids)},
+          {"bad_nids", U32_DATA(stats.bad_nids)}});
+      // clang-format on
+      return;
+   }
+
+   // clang-format off
+   std::string stats_json = "{\"stats\": {";
+   stats_json += "\"symbols\": " + std::to_string(stats.symbols_received) + ", ";
+   stats_json += "\"syncs\": " + std::to_string(stats.syncs_detected) + ", ";
+   stats_json += "\"good_nids\": " + std::to_string(stats.good_nids) + ", ";
+   stats_json += "\"bad_nids\": " + std::to_string(stats.bad_nids) + "}}";
+   // clang-format on
+
+   pmt::pmt_t pdu_data =
+      pmt::init_u8vector(stats_json.size(), (const uint8_t*) stats_json.data());
+   d_owning_block.message_port_pub(pmt::intern("p25"), pdu_data);
+}
+
 void p25p1_fdma::send_p25_pdu(const p25_du_data& data)
 {
+   // With the latency probe on, the PDU carries the time it was emitted (see
+   // p25p1_fdma.h), appended to a copy of its fields
+   uint64_t t_ns;
+   p25_du_data probed_data;
+   const p25_du_data& fields = d_latency_probe ? probed_data : data;
+   if(d_latency_probe)
+   {
+      t_ns = std::chrono::duration_cast<std::chrono::nanoseconds>(
+         std::chrono::steady_clock::now().time_since_epoch())
+                .count();
+      probed_data = data;
+      probed_data.push_back({"t_ns", U64_DATA(&t_ns)});
+   }
+
+   if(d_binary_pdus)
+   {
+      send_binary_pdu(binary_pdu::P25_DU, framer->nac, framer->duid, fields);
+      return;
+   }
+
    char frame_data[64];
    sprintf(frame_data,
       "{\"p25_du\": {\"nac\": \"0x%03x\", \"duid\": \"0x%01x\", ",
@@ -738,9 +850,9 @@ void p25p1_fdma::send_p25_pdu(const p25_du_data& data)
       framer->duid);
 
    std::string json_string(frame_data);
-   size_t num_datum = data.size();
+   size_t num_datum = fields.size();
    size_t count = 0;
-   for(const auto& datum : data)
+   for(const auto& datum : fields)
    {
       json_string += "\"" + datum.first + "\": ";
       json_string += datum.second.serialize();
@@ -797,18 +909,7 @@ void p25p1_fdma::rx_sym(const uint8_t* syms, int nsyms)
       if(stats.symbols_received > next_symbol_count_for_stats)
       {
          next_symbol_count_for_stats += symbol_count_for_stats;
-
-         // clang-format off
-         std::string stats_json = "{\"stats\": {";
-         stats_json += "\"symbols\": " + std::to_string(stats.symbols_received) + ", ";
-         stats_json += "\"syncs\": " + std::to_string(stats.syncs_detected) + ", ";
-         stats_json += "\"good_nids\": " + std::to_string(stats.good_nids) + ", ";
-         stats_json += "\"bad_nids\": " + std::to_string(stats.bad_nids) + "}}";
-         // clang-format on
-
-         pmt::pmt_t pdu_data =
-            pmt::init_u8vector(stats_json.size(), (const uint8_t*) stats_json.data());
-         d_owning_block.message_port_pub(pmt::intern("p25"), pdu_data);
+         send_stats_pdu(stats);
       }
    }
 }
@@ -29,12 +29,59 @@ namespace gr
 {
 namespace scanner
 {
+/*
+ * Binary PDU format, an alternative to JSON selected by the frame decoder's
+ * binary_pdus parameter. All multi-byte values are big-endian.
+ *
+ *   Header: magic (u8), PDU type (u8), NAC (u16), DUID (u8), ok flag (u8)
+ *   Fields: field ID (u8), value length (u16), value
+ *
+ * Buffers are carried as raw bytes and integers in their natural width.
+ * Keep the field IDs in sync with python/pdu_codec.py.
+ *
+ * With the frame decoder's latency_probe parameter set, P25 DU PDUs carry a
+ * t_ns field: the time they were emitted, in nanoseconds of
+ * std::chrono::steady_clock (CLOCK_MONOTONIC on Linux, the clock behind
+ * Python's time.monotonic_ns()).
+ */
+namespace binary_pdu
+{
+const uint8_t MAGIC = 0xb5;
+const size_t HEADER_LEN = 6;
+
+enum pdu_type : uint8_t
+{
+   P25_DU = 1,
+   STATS = 2,
+};
+
+enum field_id : uint8_t
+{
+   TSBK = 1,
+   IMBE = 2,
+   LCW = 3,
+   PDU = 4,
+   MI = 5,
+   MFID = 6,
+   TGID = 7,
+   ALGID = 8,
+   KEYID = 9,
+   FMT = 10,
+   SAP = 11,
+   BLKS = 12,
+   SYMBOLS = 16,
+   SYNCS = 17,
+   GOOD_NIDS = 18,
+   BAD_NIDS = 19,
+   T_NS = 20,
+};
+} // namespace binary_pdu
 
 struct typed_data
 {
    enum class type
    {
-      U8, U16, U32,
+      U8, U16, U32, U64,
       U8_HEX, U16_HEX, U32_HEX,
       BUFFER,
    };
@@ -53,7 +100,7 @@ struct typed_data
    std::string serialize() const
    {
       std::string result;
-      char buf[16];
+      char buf[24];
       switch(m_type)
       {
          case type::U8:
@@ -62,6 +109,10 @@ struct typed_data
             sprintf(buf, "%d", (uint32_t) m_data);
             result = std::string(buf);
             break;
+         case type::U64:
+            sprintf(buf, "%llu", (unsigned long long) u64_value());
+            result = std::string(buf);
+            break;
          case type::U8_HEX:
             sprintf(buf, "\"0x%02x\"", (uint32_t)(m_data & 0xff));
             result = std::string(buf);
@@ -89,12 +140,55 @@ struct typed_data
       }
       return result;
    }
+
+   size_t binary_size() const
+   {
+      switch(m_type)
+      {
+         case type::U8:
+         case type::U8_HEX:
+            return 1;
+         case type::U16:
+         case type::U16_HEX:
+            return 2;
+         case type::U32:
+         case type::U32_HEX:
+            return 4;
+         case type::U64:
+            return 8;
+         case type::BUFFER:
+            return m_len;
+      }
+      return 0;
+   }
+
+   void serialize_binary(std::string& result) const
+   {
+      if(m_type == type::BUFFER)
+      {
+         result.append(reinterpret_cast<const char*>(m_data), m_len);
+         return;
+      }
+      uint64_t value = (m_type == type::U64) ? u64_value() : (uint64_t) m_data;
+      for(size_t i = binary_size(); i > 0; i--)
+      {
+         result += (char)((value >> (8 * (i - 1))) & 0xff);
+      }
+   }
+
+   // 64-bit values don't fit in m_data on 32-bit platforms, so m_data points
+   // at them instead
+   uint64_t u64_value() const
+   {
+      return *reinterpret_cast<const uint64_t*>(m_data);
+   }
 };
 
 #define U8_DATA(value) {typed_data::type::U8, (uintptr_t)(value), 0}
 #define BOOL_DATA(value) {typed_data::type::U8, (value) ? (uintptr_t) 1 : (uintptr_t) 0, 0}
 #define U16_DATA(value) {typed_data::type::U16, (uintptr_t)(value), 0}
 #define U32_DATA(value) {typed_data::type::U32, (uintptr_t)(value), 0}
+#define U64_DATA(pointer) {typed_data::type::U64, (uintptr_t)(pointer), 0}
 #define U8_HEX_DATA(value) {typed_data::type::U8_HEX, (uintptr_t)(value), 0}
 #define U16_HEX_DATA(value) {typed_data::type::U16_HEX, (uintptr_t)(value), 0}
 #define U32_HEX_DATA(value) {typed_data::type::U32_HEX, (uintptr_t)(value), 0}
@@ -129,9 +223,16 @@ private:
    }
    typedef std::vector<named_value> p25_du_data;
    void send_p25_pdu(const p25_du_data& data);
+   void send_binary_pdu(uint8_t pdu_type,
+      uint32_t nac,
+      uint32_t duid,
+      const p25_du_data& data);
+   void send_stats_pdu(const struct framer_stats& stats);
 
    // internal instance variables and state
    int d_debug;
+   bool d_binary_pdus;
+   bool d_latency_probe;
    p25_framer* framer;
    gr::block& d_owning_block;
 
@@ -148,7 +249,10 @@ private:
    size_t next_symbol_count_for_stats;
 
 public:
-   p25p1_fdma(int debug, gr::block& owning_block);
+   p25p1_fdma(int debug,
+      gr::block& owning_block,
+      bool binary_pdus = false,
+      bool latency_probe = false);
    ~p25p1_fdma();
 
    void rx_sym(const uint8_t* syms, int nsyms);
@@ -20,26 +20,224 @@
 #
 
 
+import collections
 import numpy
 from gnuradio import gr
 import importlib
+import inspect
 import json
 import logging
 import pmt
+from scanner import pdu_codec
+from scanner import pdu_delivery
+from scanner import pdu_log
+from scanner import pdu_stats
+import threading
 import time
 
 
 
+log = pdu_log.pdu_logger('', max_arg_length=30)
+TRACE_RX_PDU = pdu_log.register_trace_event('rx_pdu')
+TRACE_PDU_HANDLED = pdu_log.register_trace_event('pdu_handled')
+
+
+class back_end_connection():
+    # Connects one back end instance to the front end interface, tracking
+    # which PDUs it wants, how they're batched and, optionally, the queue and
+    # worker thread that run it
+    def __init__(self, name, back_end, input_ports, params, use_worker, timing_interval=8):
+        self.name = name
+        self.back_end = back_end
+        self.params = params
+        self.port_indices = dict([(port, index) for (index, port) in enumerate(input_ports)])
+
+        # While the back end is being reloaded, offered PDUs are held here
+        # (see front_end_interface.reload_back_end()). PDUs dropped other
+        # than by the queue (the oldest held ones, once the hold is full) are
+        # counted per port in dropped_pdu_counts.
+        self.held_pdus = None
+        self.held_dropped = 0
+        self.dropped_pdu_counts = dict([(port, 0) for port in input_ports])
+
+        # Parse and handler times per input port, sampled every
+        # timing_interval PDUs (0 turns timing off, as the countdown then
+        # never reaches 1)
+        self.ingest_stats = dict([(port, pdu_stats.port_ingest_stats())
+            for port in input_ports])
+        self.timing_interval = timing_interval
+        self.timing_countdown = timing_interval
+
+        # Back ends may declare which PDUs they want on each input port with a
+        # pdu_interest dictionary (see pdu_codec.pdu_wanted() for the format).
+        # The dictionary is referenced, not copied, so the back end may change
+        # its interests at any time. PDUs not of interest are dropped after a
+        # peek at their header, without being parsed.
+        self.pdu_interest = getattr(back_end, 'pdu_interest', None)
+        self.skipped_pdu_counts = dict([(port, 0) for port in input_ports])
+
+        # Back ends with a true raw_pdus attribute are given the PDU bytes as
+        # received instead of the parsed dictionary, and decode them
+        # themselves (e.g. the out of process proxy with oop_raw_pdus=1)
+        self.raw_pdus = getattr(back_end, 'raw_pdus', False)
+
+        # With latency_probe=1, PDUs stamped with their emission time by the
+        # frame decoder are stamped again as they're picked up and parsed
+        # (see pdu_stats.LATENCY_PROBE_HOPS)
+        self.latency_probe = params.get('latency_probe', '0') not in ['', '0']
+
+        # Back ends that implement receive_pdu_batch(port, pdus) get their
+        # PDUs in batches per port, delivered when pdu_batch_size PDUs have
+        # been gathered or the oldest one has waited pdu_batch_latency_ms
+        # (set pdu_batch_size=1 to deliver PDUs one at a time regardless)
+        self.pdu_batcher = None
+        if hasattr(back_end, 'receive_pdu_batch'):
+            batch_size = int(params.get('pdu_batch_size', 32))
+            batch_latency = float(params.get('pdu_batch_latency_ms', 20)) / 1000.0
+            if batch_size > 1:
+                self.pdu_batcher = pdu_delivery.pdu_batcher(input_ports,
+                    back_end.receive_pdu_batch, batch_size, batch_latency)
+
+        # In worker mode (pdu_worker=1, or always with several back ends), the
+        # GNU Radio message handler only queues incoming PDUs and returns; a
+        # worker thread parses them and runs the back end. Each input port gets
+        # a lane of pdu_queue_depth PDUs, and pdu_overflow (drop_oldest, the
+        # default, drop_newest or block) decides what happens when a lane is
+        # full. Both can be set per port too (e.g. pdu_overflow_cc_pdus=block);
+        # block is opt-in as it stalls the message handler, and so every port
+        # and every other back end behind it, until the back end catches up.
+        # With several back ends, pdu_queue_depth_<class> and
+        # pdu_overflow_<class> set them for the back end of that class name
+        # (e.g. pdu_overflow_call_recorder=drop_newest). Lanes are served in
+        # the order of pdu_port_priority (colon-separated port names,
+        # defaulting to the input port list order, i.e. cc_pdus first in the
+        # shipped flowgraph).
+        self.pdu_queue = None
+        self.pdu_worker = None
+        if use_worker:
+            class_name = name.split('@')[0].rpartition('.')[2]
+            queue_depth = params.get(f'pdu_queue_depth_{class_name}', params.get('pdu_queue_depth', 256))
+            overflow = params.get(f'pdu_overflow_{class_name}',
+                params.get('pdu_overflow', pdu_delivery.OVERFLOW_DROP_OLDEST))
+            port_priority = [port for port in
+                params.get('pdu_port_priority', '').split(':') if port in input_ports]
+            port_priority += [port for port in input_ports if port not in port_priority]
+            lane_depths = dict([(port, int(params[f'pdu_queue_depth_{port}']))
+                for port in input_ports if f'pdu_queue_depth_{port}' in params])
+            lane_overflows = dict([(port, params[f'pdu_overflow_{port}'])
+                for port in input_ports if f'pdu_overflow_{port}' in params])
+            self.pdu_queue = pdu_delivery.pdu_queue(port_priority, int(queue_depth),
+                overflow, lane_depths, lane_overflows)
+            self.pdu_worker = pdu_delivery.pdu_worker(self.pdu_queue,
+                self.process_pdu, f'{name} worker')
+
+    def offer_pdu(self, port_name, pdu_bytes):
+        # Called on the GNU Radio message handler thread
+        if self.held_pdus is not None:
+            if len(self.held_pdus) == self.held_pdus.maxlen:
+                (dropped_port_name, _) = self.held_pdus[0]
+                self.dropped_pdu_counts[dropped_port_name] += 1
+                if self.held_dropped == 0:
+                    logging.warning(f'{self.name}: {self.held_pdus.maxlen} PDUs held, dropping the oldest')
+                self.held_dropped += 1
+            self.held_pdus.append((port_name, pdu_bytes))
+            return
+
+        if self.pdu_interest:
+            interest = self.pdu_interest.get(port_name)
+            if interest is not None and not pdu_codec.pdu_wanted(interest, pdu_bytes):
+                self.skipped_pdu_counts[port_name] += 1
+                return
+
+        if self.pdu_queue:
+            self.pdu_queue.put(port_name, pdu_bytes)
+        else:
+            self.process_pdu(port_name, pdu_bytes)
+
+    def process_pdu(self, port_name, pdu_bytes):
+        # Parse the PDU and hand it to the back end; this runs on the GNU
+        # Radio message handler thread, or on the worker thread in worker mode.
+        # Each back end parses its own copy, so back ends are free to modify
+        # the PDUs they're given.
+        timed = self.timing_countdown == 1
+        self.timing_countdown = self.timing_interval if timed else self.timing_countdown - 1
+        if timed:
+            start_ns = time.perf_counter_ns()
+        if self.latency_probe:
+            received_ns = time.monotonic_ns()
+        pdu_json = pdu_bytes if self.raw_pdus else pdu_codec.decode_pdu(pdu_bytes)
+        if timed:
+            parsed_ns = time.perf_counter_ns()
+        if self.latency_probe and not self.raw_pdus:
+            pdu_stats.stamp_probe(pdu_json, 'dsp', received_ns)
+            pdu_stats.stamp_probe(pdu_json, 'parse')
+
+        log.debug('receive_pdu: %s on port %s', pdu_bytes, port_name)
+        if self.pdu_batcher:
+            self.pdu_batcher.add(port_name, pdu_json)
+        else:
+            self.back_end.receive_pdu(port_name, pdu_json)
+        pdu_log.trace(TRACE_PDU_HANDLED, self.port_indices[port_name], len(pdu_bytes))
+
+        if timed:
+            stats = self.ingest_stats[port_name]
+            stats.parse_time.record(parsed_ns - start_ns)
+            stats.handler_time.record(time.perf_counter_ns() - parsed_ns)
+
+    def get_pdu_queue_stats(self):
+        if self.pdu_queue:
+            return self.pdu_queue.get_stats()
+        return {}
+
+    def get_dropped_pdu_counts(self):
+        # Dropped by the queue or while held
+        counts = dict(self.dropped_pdu_counts)
+        for (port, stats) in self.get_pdu_queue_stats().items():
+            counts[port] += stats['dropped']
+        return counts
+
+    def hold(self, depth):
+        # Hold offered PDUs (at most depth of them, dropping the oldest) until
+        # they're replayed into another connection
+        self.held_dropped = 0
+        self.held_pdus = collections.deque(maxlen=depth)
+
+    def stop(self):
+        # Let the worker drain its queue, then deliver any partially gathered
+        # batches before the flowgraph stops
+        if self.pdu_worker:
+            self.pdu_worker.stop()
+        if self.pdu_batcher:
+            self.pdu_batcher.stop()
+
+    def stop_back_end(self):
+        # Back ends may implement stop() to release their resources (e.g., a
+        # child process or a listening socket)
+        if hasattr(self.back_end, 'stop'):
+            try:
+                self.back_end.stop()
+            except BaseException as e:
+                logging.warning(f'{self.name}: failed to stop back end: {e}')
+
+
 class front_end_interface(gr.basic_block):
     @staticmethod
     def _shorten_json(input_string, length=30):
-        s = input_string.strip()
-        if len(s) <= length:
-            return s
-        start_len = (length - 5) // 2;
-        end_len = (length - 5) - start_len;
-        return s[:start_len] + ' ... ' + s[-end_len:]
+        return pdu_log.shorten(input_string, length)
+
 
+    @staticmethod
+    def _parse_params(params_string):
+        # Parase parameters into a dictionary
+        param_dict = {}
+        for param in params_string.split(','):
+            param = param.strip()
+            (key, *value) = param.split('=')
+            if len(value) > 0:
+                param_dict[key.strip()] = value[0].strip()
+            else:
+                param_dict[key.strip()] = ''
+        return param_dict
 
     """
     docstring for block front_end_interface
@@ -52,15 +250,7 @@ class front_end_interface(gr.basic_block):
             in_sig=None,
             out_sig=None)
 
-        # Parase parameters into a dictionary
-        param_dict = {}
-        for param in back_end_module_parameters.split(','):
-            param = param.strip()
-            (key, *value) = param.split('=')
-            if len(value) > 0:
-                param_dict[key.strip()] = value[0].strip()
-            else:
-                param_dict[key.strip()] = ''
+        param_dict = front_end_interface._parse_params(back_end_module_parameters)
 
         numeric_level = logging.WARNING
         log_format_string = '[gr-scanner %(levelname)s] %(message)s'
@@ -71,34 +261,6 @@ class front_end_interface(gr.basic_block):
                 raise ValueError(f'Invalid log level {loglevel}')
         logging.basicConfig(level=numeric_level, format=log_format_string)
 
-        # Load the back end module and instantiate the class (if possible)
-        self.back_end_module = None
-        self.back_end_class = None
-        if back_end_module_class_name != '':
-            back_end_name_elements = back_end_module_class_name.split('.')
-            if len(back_end_name_elements) >= 2:
-                back_end_module_name = '.'.join(back_end_name_elements[0:-1])
-                back_end_class_name = back_end_name_elements[-1]
-                try:
-                    back_end_module = importlib.import_module(back_end_module_name)
-                    if hasattr(back_end_module, back_end_class_name):
-                        try:
-                            self.back_end_class = getattr(back_end_module, back_end_class_name)(
-                                input_ports=input_port_list,
-                                output_ports=output_port_list,
-                                send_pdu_fn=self.send_pdu,
-                                params=param_dict)
-                        except:
-                            logging.warning(f'Could not instantiate back end class {back_end_class_name} - incoming PDUs will be dropped')
-                    else:
-                        logging.warning(f'No class {back_end_class_name} in {back_end_module_name} - incoming PDUs will be dropped')
-                except:
-                    logging.warning(f'Could not import {back_end_module_name} - incoming PDUs will be dropped')
-            else:
-                logging.warning(f'Invalid format for module and class name - incoming PDUs will be dropped')
-        else:
-            logging.warning(f'No back end module specified - incoming PDUs will be dropped')
-
         # Create the input and output port name maps
         #   Maps user's chosen port name to the actual numbered GR port name
         #   'inx'/'outx'
@@ -108,44 +270,431 @@ class front_end_interface(gr.basic_block):
         self.output_port_name_map = dict(
             [(chan[1], 'out{}'.format(chan[0])) for chan in enumerate(output_port_list)])
 
+        # Resolve the output port symbols once rather than on every send
+        self.output_port_symbols = dict([(user_name, pmt.intern(gr_port_name))
+            for (user_name, gr_port_name) in self.output_port_name_map.items()])
+
         for (user_name, gr_port_name) in self.input_port_name_map.items():
             self.message_port_register_in(pmt.intern(gr_port_name))
             self.set_msg_handler(pmt.intern(gr_port_name),
                 lambda pdu, port_name=user_name:
                     self.receive_pdu(port_name, pdu))
 
-        for (_, gr_port_name) in self.output_port_name_map.items():
-            self.message_port_register_out(pmt.intern(gr_port_name))
+        for (_, port_symbol) in self.output_port_symbols.items():
+            self.message_port_register_out(port_symbol)
+
+        # Ingest counters are always kept per input port. Parse and handler
+        # times are sampled every ingest_timing_interval PDUs (8 by default, 1
+        # to time every PDU, 0 to turn timing off). If the output port list
+        # includes the port named by ingest_stats_port (ingest_stats by
+        # default), the stats are published there as a JSON PDU every
+        # ingest_stats_interval_ms milliseconds.
+        self.ingest_stats = dict([(port, pdu_stats.port_ingest_stats())
+            for port in input_port_list])
+        ingest_timing_interval = int(param_dict.get('ingest_timing_interval', 8))
+        self.ingest_stats_symbol = self.output_port_symbols.get(
+            param_dict.get('ingest_stats_port', 'ingest_stats'))
+        self.ingest_stats_interval = float(param_dict.get('ingest_stats_interval_ms', 5000)) / 1000.0
+        self.next_ingest_stats_time = time.monotonic() + self.ingest_stats_interval
+
+        # A binary trace of the most recent trace_depth hot path events (0, the
+        # default, disables it) can be kept and dumped with dump_trace() or by
+        # sending the process SIGUSR1
+        self.input_port_indices = dict([(port, index)
+            for (index, port) in enumerate(input_port_list)])
+        if int(param_dict.get('trace_depth', 0)) > 0:
+            pdu_log.enable_trace(int(param_dict['trace_depth']))
+
+        # Load the back end module(s) and instantiate the class(es), if
+        # possible. back_end_module_class_name may name several back ends,
+        # separated by commas (or be a list of names); each one receives all
+        # PDUs through its own queue and worker thread, so a slow back end
+        # can't add latency to the others. A name suffixed with '@oop' is run
+        # in a separate process via the out of process proxy.
+        if isinstance(back_end_module_class_name, str):
+            back_end_module_class_name = back_end_module_class_name.split(',')
+        back_end_names = [name.strip() for name in back_end_module_class_name
+            if name.strip() != '']
+        self.input_port_list = input_port_list
+        self.output_port_list = output_port_list
+        self.use_workers = len(back_end_names) > 1 or \
+            param_dict.get('pdu_worker', '0') not in ['', '0']
+        self.ingest_timing_interval = ingest_timing_interval
+
+        # The back end list is only changed, and PDUs only offered to the back
+        # ends, with back_end_lock held, so a reload can swap a back end
+        # without a PDU slipping past it
+        self.back_end_lock = threading.Lock()
+        self.back_ends = []
+        for back_end_name in back_end_names:
+            back_end = self.load_back_end(back_end_name, input_port_list,
+                output_port_list, param_dict)
+            if back_end:
+                self.back_ends.append(self.connect_back_end(back_end_name,
+                    back_end, param_dict))
+        if len(back_end_names) == 0:
+            logging.warning(f'No back end module specified - incoming PDUs will be dropped')
+
+        # For compatibility, back_end_class is the first back end instance
+        self.back_end_class = self.back_ends[0].back_end if len(self.back_ends) > 0 else None
+
+        # Messages on the reload port reload a back end (see
+        # handle_reload_message()); while that happens, up to
+        # reload_hold_depth PDUs (default 1024) are held for it
+        self.reload_lock = threading.Lock()
+        self.reload_hold_depth = int(param_dict.get('reload_hold_depth', 1024))
+        self.message_port_register_in(pmt.intern('reload'))
+        self.set_msg_handler(pmt.intern('reload'), self.handle_reload_message)
+
+    def connect_back_end(self, back_end_name, back_end, params):
+        return back_end_connection(back_end_name, back_end, self.input_port_list,
+            params, self.use_workers, self.ingest_timing_interval)
+
+    def load_back_end(self, back_end_name, input_ports, output_ports, params,
+        reload_module=False):
+        # Import the back end module and instantiate the class (if possible);
+        # if reload_module is set, the module is reloaded to pick up changes
+        # to its code (back ends run out of process always import afresh)
+        if back_end_name.endswith('@oop'):
+            reload_module = False
+            params = dict(params, oop_target=back_end_name[:-len('@oop')])
+            back_end_name = 'scanner.out_of_process_proxy.out_of_process_proxy'
+        back_end_name_elements = back_end_name.split('.')
+        if len(back_end_name_elements) < 2:
+            logging.warning(f'Invalid format for module and class name {back_end_name} - incoming PDUs will be dropped')
+            return None
+        back_end_module_name = '.'.join(back_end_name_elements[0:-1])
+        back_end_class_name = back_end_name_elements[-1]
+        try:
+            back_end_module = importlib.import_module(back_end_module_name)
+            if reload_module:
+                back_end_module = importlib.reload(back_end_module)
+        except:
+            logging.warning(f'Could not import {back_end_module_name} - incoming PDUs will be dropped')
+            return None
+        if not hasattr(back_end_module, back_end_class_name):
+            logging.warning(f'No class {back_end_class_name} in {back_end_module_name} - incoming PDUs will be dropped')
+            return None
+        try:
+            return self.instantiate_back_end(getattr(back_end_module, back_end_class_name),
+                input_ports, output_ports, params)
+        except:
+            logging.warning(f'Could not instantiate back end class {back_end_class_name} - incoming PDUs will be dropped')
+            return None
+
+    def instantiate_back_end(self, back_end_type, input_ports, output_ports, params):
+        # Optional callbacks are only passed to back ends whose constructors
+        # accept them, so that existing back ends keep working unchanged
+        kwargs = {
+            'input_ports': input_ports,
+            'output_ports': output_ports,
+            'send_pdu_fn': self.send_pdu,
+            'params': params
+        }
+        optional_kwargs = {
+            'send_pdus_fn': self.send_pdus,
+            'get_ingest_stats_fn': self.get_ingest_stats
+        }
+        try:
+            signature = inspect.signature(back_end_type)
+            accepts_any = any([param.kind == inspect.Parameter.VAR_KEYWORD
+                for param in signature.parameters.values()])
+            for (name, value) in optional_kwargs.items():
+                if accepts_any or name in signature.parameters:
+                    kwargs[name] = value
+        except (TypeError, ValueError):
+            pass
+        return back_end_type(**kwargs)
 
     def receive_pdu(self, port_name, pdu_data):
         if not pmt.is_u8vector(pdu_data):
             return
 
-        pdu_str = ''.join([chr(x) for x in pmt.u8vector_elements(pdu_data)])
-        pdu_json = json.loads(pdu_str)
+        # Read the u8vector elements once into a contiguous buffer; each back
+        # end decodes it in a single call (rather than building a string byte
+        # by byte)
+        pdu_bytes = bytes(pmt.u8vector_elements(pdu_data))
+        pdu_log.trace(TRACE_RX_PDU, self.input_port_indices[port_name], len(pdu_bytes))
+        stats = self.ingest_stats[port_name]
+        stats.pdus += 1
+        stats.bytes += len(pdu_bytes)
+
+        if self.ingest_stats_symbol and time.monotonic() >= self.next_ingest_stats_time:
+            self.next_ingest_stats_time = time.monotonic() + self.ingest_stats_interval
+            self.publish_ingest_stats()
+
+        if len(self.back_ends) == 0:
+            logging.warning(f'receive_pdu: dropping {front_end_interface._shorten_json(pdu_bytes)} on port {port_name} (no handler)')
+            return
 
-        if self.back_end_class:
-            logging.debug(f'receive_pdu: {front_end_interface._shorten_json(pdu_str)} on port {port_name}')
-            self.back_end_class.receive_pdu(port_name, pdu_json)
-        else:
-            logging.warning(f'receive_pdu: dropping {front_end_interface._shorten_json(pdu_str)} on port {port_name} (no handler)')
+        with self.back_end_lock:
+            for back_end in self.back_ends:
+                back_end.offer_pdu(port_name, pdu_bytes)
+
+    def stop(self):
+        # Drain each connection before stopping its back end, so the PDUs
+        # still queued are delivered and a child process isn't left running
+        with self.back_end_lock:
+            back_ends = list(self.back_ends)
+        for back_end in back_ends:
+            back_end.stop()
+            back_end.stop_back_end()
+        return True
+
+    def handle_reload_message(self, msg):
+        # A symbol names the back end to reload, or if no back end of that
+        # name is loaded, a new back end to replace the first one with. A dict
+        # may give the 'back_end' to reload, the 'new_back_end' to replace it
+        # with and new 'params' (in the usual key=value,... form, overriding
+        # the current ones). Anything else reloads the first back end. The
+        # reload runs on its own thread so PDUs keep flowing (into the hold
+        # buffer) meanwhile.
+        kwargs = {}
+        if pmt.is_symbol(msg):
+            name = pmt.symbol_to_string(msg)
+            if any([back_end.name == name for back_end in self.back_ends]):
+                kwargs['back_end_name'] = name
+            else:
+                kwargs['new_back_end_name'] = name
+        elif pmt.is_dict(msg):
+            for (key, kwarg) in [('back_end', 'back_end_name'),
+                ('new_back_end', 'new_back_end_name'), ('params', 'params')]:
+                value = pmt.dict_ref(msg, pmt.intern(key), pmt.PMT_NIL)
+                if pmt.is_symbol(value):
+                    kwargs[kwarg] = pmt.symbol_to_string(value)
+        threading.Thread(target=self.reload_back_end, kwargs=kwargs,
+            daemon=True).start()
+
+    def reload_back_end(self, back_end_name=None, new_back_end_name=None, params=None):
+        # Replace a back end (the first one, unless named) with a new instance
+        # of new_back_end_name (by default, the same back end, with its module
+        # reloaded), optionally with parameters changed. The old instance's
+        # get_state_snapshot() result, if it has one, is handed to the new
+        # instance's restore_state_snapshot(), if it has one. PDUs arriving in
+        # the meantime are held and replayed to the new instance. If the new
+        # back end can't be loaded, the old one is reloaded instead. Returns
+        # True if the requested back end was loaded.
+        with self.reload_lock:
+            with self.back_end_lock:
+                indices = [index for (index, back_end) in enumerate(self.back_ends)
+                    if back_end_name is None or back_end.name == back_end_name]
+                if len(indices) == 0:
+                    logging.warning(f'reload_back_end: no back end {back_end_name} to reload')
+                    return False
+                old_connection = self.back_ends[indices[0]]
+                old_connection.hold(self.reload_hold_depth)
+
+            # Let the old back end finish with the PDUs already queued for it,
+            # so that its snapshot accounts for everything before the hold
+            start_time = time.monotonic()
+            old_connection.stop()
+            snapshot = None
+            if hasattr(old_connection.back_end, 'get_state_snapshot'):
+                try:
+                    snapshot = old_connection.back_end.get_state_snapshot()
+                except BaseException as e:
+                    logging.warning(f'reload_back_end: failed to get state snapshot from {old_connection.name}: {e}')
+            # The old instance is stopped before the new one is created, as
+            # they may contend for resources (e.g., a listening socket)
+            old_connection.stop_back_end()
+
+            name = new_back_end_name if new_back_end_name else old_connection.name
+            new_params = old_connection.params
+            if params:
+                new_params = dict(new_params, **front_end_interface._parse_params(params))
+            back_end = self.load_back_end(name, self.input_port_list,
+                self.output_port_list, new_params, reload_module=True)
+            loaded = back_end is not None
+            if not loaded:
+                logging.warning(f'reload_back_end: could not load {name}, reloading {old_connection.name}')
+                (name, new_params) = (old_connection.name, old_connection.params)
+                back_end = self.load_back_end(name, self.input_port_list,
+                    self.output_port_list, new_params)
+
+            connection = None
+            if back_end is not None:
+                if snapshot is not None and hasattr(back_end, 'restore_state_snapshot'):
+                    try:
+                        back_end.restore_state_snapshot(snapshot)
+                    except BaseException as e:
+                        logging.warning(f'reload_back_end: failed to restore state snapshot in {name}: {e}')
+                connection = self.connect_back_end(name, back_end, new_params)
+                connection.ingest_stats = old_connection.ingest_stats
+                connection.skipped_pdu_counts = old_connection.skipped_pdu_counts
+                connection.dropped_pdu_counts = old_connection.get_dropped_pdu_counts()
+
+            # Switch over, replaying the held PDUs to the new instance first
+            with self.back_end_lock:
+                index = self.back_ends.index(old_connection)
+                if connection:
+                    for (port_name, pdu_bytes) in old_connection.held_pdus:
+                        connection.offer_pdu(port_name, pdu_bytes)
+                    self.back_ends[index] = connection
+                else:
+                    logging.warning(f'reload_back_end: could not reload {name} - its PDUs will be dropped')
+                    del self.back_ends[index]
+                self.back_end_class = self.back_ends[0].back_end if len(self.back_ends) > 0 else None
+
+            logging.info(f'reload_back_end: {old_connection.name} replaced by {name} in '
+                f'{(time.monotonic() - start_time) * 1000:.0f} ms, '
+                f'{len(old_connection.held_pdus)} PDUs held, {old_connection.held_dropped} dropped')
+            return loaded
+
+    @staticmethod
+    def _python_to_pmt(value):
+        # Convert a plain Python value (e.g., a value in a dict PDU that doesn't
+        # carry its own type) to a PMT
+        if isinstance(value, dict):
+            if all(key in value for key in ['type', 'value']):
+                return front_end_interface._typed_value_to_pmt(value['type'], value['value'])
+            return front_end_interface._typed_value_to_pmt('dict', value)
+        if isinstance(value, bool):
+            return pmt.from_bool(value)
+        if isinstance(value, int):
+            return pmt.from_long(value)
+        if isinstance(value, float):
+            return pmt.from_double(value)
+        if isinstance(value, complex):
+            return pmt.from_complex(value)
+        if isinstance(value, str):
+            return pmt.intern(value)
+        if isinstance(value, (list, tuple)):
+            return front_end_interface._typed_value_to_pmt('vector', value)
+        raise ValueError(f'no PMT conversion for {type(value)}')
+
+    @staticmethod
+    def _typed_value_to_pmt(data_type, value):
+        # Convert a value of the given type, as sent by a back end, to a PMT
+        if data_type == 'float':
+            return pmt.from_double(float(value))
+        if data_type == 'int':
+            return pmt.from_long(int(value))
+        if data_type == 'bool':
+            if isinstance(value, str):
+                return pmt.from_bool(value.strip().lower() in ['1', 'true', 'yes', 'on'])
+            return pmt.from_bool(bool(value))
+        if data_type == 'complex':
+            return pmt.from_complex(complex(value))
+        if data_type == 'vector':
+            # Vectors of numbers become f64vectors, or c64vectors if any of the
+            # elements are complex
+            if any([isinstance(element, complex) for element in value]):
+                elements = [complex(element) for element in value]
+                return pmt.init_c64vector(len(elements), elements)
+            elements = [float(element) for element in value]
+            return pmt.init_f64vector(len(elements), elements)
+        if data_type == 'dict':
+            # Keys become symbols; values may be plain Python values or typed
+            # values in {'type': ..., 'value': ...} form
+            data_as_pmt = pmt.make_dict()
+            for (key, element) in value.items():
+                data_as_pmt = pmt.dict_add(data_as_pmt, pmt.intern(str(key)),
+                    front_end_interface._python_to_pmt(element))
+            return data_as_pmt
+        raise ValueError(f'unsupported type {data_type}')
 
     def send_pdu(self, port_name, json_data):
         # example: port_name = 'radio_freq', json_data = {'type': 'float', 'value': '850000000'}
         # Note that port_name is the user's port_name name, not the GR port_name name
+        # Supported types are float, int, bool, complex, vector (a list of
+        # numbers) and dict (a dict of names to plain or typed values, sent as
+        # a PMT dict so that, e.g., one message can carry several settings)
         if not all(key in json_data for key in ['type', 'value']):
             return
 
-        if self.output_port_name_map.get(port_name, None):
-            data_type = json_data['type']
-            if data_type == 'float':
-                data_as_pmt = pmt.from_double(float(json_data['value']))
-                self.message_port_pub(pmt.intern(self.get_gr_port_name(port_name)), data_as_pmt)
-            else:
-                logging.warning(f'send_pdu: dropping {front_end_interface._shorten_json(str(json_data))} on port {port_name} (bad type)')    
+        port_symbol = self.output_port_symbols.get(port_name, None)
+        if port_symbol:
+            try:
+                data_as_pmt = front_end_interface._typed_value_to_pmt(json_data['type'], json_data['value'])
+            except (TypeError, ValueError) as e:
+                logging.warning(f'send_pdu: dropping {front_end_interface._shorten_json(str(json_data))} on port {port_name} (bad type: {e})')
+                return
+            self.message_port_pub(port_symbol, data_as_pmt)
         else:
             logging.warning(f'send_pdu: dropping {front_end_interface._shorten_json(str(json_data))} on port {port_name} (no mapping)')
 
+    def send_pdus(self, pdus):
+        # Send a batch of (port_name, json_data) PDUs back to back, in order.
+        # Consecutive dict PDUs for the same port are merged into one message
+        # (later keys winning), so that, e.g., a retune split across several
+        # dicts reaches the block as a single update; nothing else is dropped
+        # or reordered.
+        merged = []
+        for (port_name, json_data) in pdus:
+            if merged and merged[-1][0] == port_name and \
+                merged[-1][1].get('type') == 'dict' and json_data.get('type') == 'dict':
+                json_data = {'type': 'dict', 'value': dict(merged[-1][1]['value'], **json_data['value'])}
+                merged[-1] = (port_name, json_data)
+            else:
+                merged.append((port_name, json_data))
+        for (port_name, json_data) in merged:
+            self.send_pdu(port_name, json_data)
+
+    def get_skipped_pdu_counts(self):
+        # Number of PDUs dropped on each input port because the back end(s)
+        # declared no interest in them, totalled across back ends
+        counts = dict()
+        for back_end in self.back_ends:
+            for (port, count) in back_end.skipped_pdu_counts.items():
+                counts[port] = counts.get(port, 0) + count
+        return counts
+
+    def get_pdu_queue_stats(self):
+        # Per input port counts of PDUs queued and dropped, and the current and
+        # maximum queue depths (worker mode only), totalled across back ends
+        # (depths are the maximum across back ends)
+        totals = dict()
+        for back_end in self.back_ends:
+            for (port, stats) in back_end.get_pdu_queue_stats().items():
+                total = totals.setdefault(port, {'queued': 0, 'dropped': 0, 'max_depth': 0, 'depth': 0})
+                total['queued'] += stats['queued']
+                total['dropped'] += stats['dropped']
+                total['max_depth'] = max(total['max_depth'], stats['max_depth'])
+                total['depth'] = max(total['depth'], stats['depth'])
+        return totals
+
+    def get_dropped_pdu_counts(self):
+        # Dropped by the queues or while held during a reload, totalled
+        # across back ends
+        counts = dict()
+        for back_end in self.back_ends:
+            for (port, count) in back_end.get_dropped_pdu_counts().items():
+                counts[port] = counts.get(port, 0) + count
+        return counts
+
+    def get_ingest_stats(self):
+        # Per input port PDU and byte counts, PDUs skipped (no interest) and
+        # dropped (queue overflow, or too many held during a reload), and
+        # parse and handler time summaries (merged across back ends; the time
+        # summary counts are the number of PDUs sampled)
+        skipped_counts = self.get_skipped_pdu_counts()
+        dropped_counts = self.get_dropped_pdu_counts()
+        result = dict()
+        for (port, stats) in self.ingest_stats.items():
+            parse_time = pdu_stats.latency_histogram()
+            handler_time = pdu_stats.latency_histogram()
+            for back_end in self.back_ends:
+                parse_time.merge(back_end.ingest_stats[port].parse_time)
+                handler_time.merge(back_end.ingest_stats[port].handler_time)
+            result[port] = {
+                'pdus': stats.pdus,
+                'bytes': stats.bytes,
+                'skipped': skipped_counts.get(port, 0),
+                'dropped': dropped_counts.get(port, 0),
+                'parse': parse_time.summary(),
+                'handler': handler_time.summary()
+            }
+        return result
+
+    def publish_ingest_stats(self):
+        stats_json = json.dumps({'ingest_stats': self.get_ingest_stats()}).encode()
+        self.message_port_pub(self.ingest_stats_symbol,
+            pmt.init_u8vector(len(stats_json), list(stats_json)))
+
+    def dump_trace(self, file_name=None):
+        # Write the trace (if enabled) to the given file, or to the log
+        pdu_log.dump_trace(file_name)
+
     def get_gr_port_name(self, user_name):
         if user_name in self.input_port_name_map:
             return self.input_port_name_map[user_name]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import argparse
+import importlib
+import logging
+from multiprocessing import AuthenticationError, Process
+import os
+from scanner import oop_transport
+from scanner import out_of_process_proxy
+
+# Hosts out of process targets for an out_of_process_proxy running elsewhere
+# (e.g. on a workstation, to take the back end off a radio whose cores are
+# busy with DSP). The proxy is given oop_transport=socket, an oop_address
+# this runner listens on and the runner's key as oop_authkey, e.g.
+#
+#   OOP_AUTHKEY=<secret> python3 -m scanner.oop_runner --listen tcp:192.168.1.10:7001 \
+#       --target scanner.p25_scanner.scanner_oop_ws.scanner_oop_ws \
+#       --params site_file=/home/me/site.csv,tg_file=/home/me/tg.csv
+#
+# Each connection gets a process of its own, running the target class named
+# by the proxy (which must be one of those given with --target) with the
+# ports and parameters sent by the proxy; parameters given with --params
+# take precedence (e.g. file names on this machine). The process ends when
+# the connection does, and the proxy reconnects and restores the target's
+# state if it's lost. The runner listens on the loopback interface unless
+# told otherwise, and a proxy must prove that it knows the key (given with
+# --authkey or in the OOP_AUTHKEY environment variable, which keeps it out of
+# the process list) before anything it sends is unpickled. The key isn't
+# used to encrypt the connection, so still only listen on networks whose
+# hosts are trusted.
+
+
+def parse_params(params_string):
+    # Same 'key=value,key=value' format as the front end interface's
+    # parameters
+    params = dict()
+    for param in params_string.split(','):
+        (key, _, value) = param.strip().partition('=')
+        if key:
+            params[key.strip()] = value.strip()
+    return params
+
+
+def serve_connection(connection, targets, params, authkey):
+    # Runs in a process for each connection
+    try:
+        oop_transport.authenticate(connection, authkey, True)
+    except (EOFError, OSError, AuthenticationError) as e:
+        logging.warning(f'oop_runner: proxy failed to authenticate ({e})')
+        return
+    try:
+        (port, (command, hello)) = connection.recv()
+    except (EOFError, OSError, ValueError) as e:
+        logging.warning(f'oop_runner: no greeting from proxy ({e})')
+        return
+    if port != out_of_process_proxy.OOP_CONTROL or command != out_of_process_proxy.OOP_HELLO:
+        logging.warning(f'oop_runner: unexpected greeting {port} {command}')
+        return
+    oop_target = hello['oop_target'] if len(targets) > 1 else targets[0]
+    if oop_target not in targets:
+        logging.warning(f'oop_runner: target {oop_target} not allowed')
+        return
+    logging.info(f'oop_runner: starting {oop_target}')
+    out_of_process_proxy.oop_loader(oop_target.split('.'), {
+            'input_ports': hello['input_ports'],
+            'output_ports': hello['output_ports'],
+            'input_pdu_pipe': connection,
+            'output_pdu_pipe': connection,
+            'params': dict(hello['params'], **params)
+        }, {})
+    logging.info(f'oop_runner: {oop_target} finished')
+
+
+def serve(address, targets, params={}, authkey=None):
+    # The targets' modules are imported up front, so the processes forked for
+    # connections start with them loaded
+    if not authkey:
+        raise ValueError('oop_runner: an authentication key is required')
+    for target in targets:
+        try:
+            importlib.import_module(target.rpartition('.')[0])
+        except BaseException as e:
+            logging.warning(f'oop_runner: could not preload {target} ({e})')
+    listener = oop_transport.listen(address)
+    logging.info(f'oop_runner: listening on {address}')
+    children = []
+    while True:
+        (sock, peer) = listener.accept()
+        logging.info(f'oop_runner: connection from {peer}')
+        connection = oop_transport.socket_connection(sock)
+        child = Process(target=serve_connection, args=(connection, targets, params, authkey))
+        child.start()
+        connection.close()
+        children = [old_child for old_child in children if old_child.is_alive()] + [child]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Host out of process targets for an out_of_process_proxy')
+    parser.add_argument('--listen', default='tcp:127.0.0.1:7001',
+        help='address to listen on (tcp:<host>:<port> or unix:<path>)')
+    parser.add_argument('--target', action='append', required=True,
+        help='module.class of a target the proxy may start (may be given more than once)')
+    parser.add_argument('--params', default='',
+        help='parameters overriding those sent by the proxy (key=value,...)')
+    parser.add_argument('--authkey', default=os.environ.get('OOP_AUTHKEY', ''),
+        help='key the proxy must know (its oop_authkey; defaults to $OOP_AUTHKEY)')
+    parser.add_argument('--loglevel', default='info')
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error('an authentication key is required (--authkey or $OOP_AUTHKEY)')
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper(), logging.INFO))
+    serve(args.listen, args.target, parse_params(args.params), args.authkey.encode())
@@ -0,0 +1,583 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import os
+import pickle
+import select
+import socket
+import struct
+import time
+from multiprocessing import AuthenticationError, Pipe, Process, shared_memory
+from multiprocessing.connection import answer_challenge, deliver_challenge
+
+# Transports for the out of process proxy. Each provides a function returning
+# a pair of connected endpoints that behave like multiprocessing.Pipe()
+# connections (send(), recv(), send_bytes(), recv_bytes(), poll(), fileno()
+# and close()), so they can be handed to out of process targets in place of
+# pipes. Note that fileno() only signals that data has arrived; as several
+# messages may arrive per signal, readers should drain the connection with
+# poll() and recv() until poll() returns False.
+
+
+class shm_ring():
+    # Single producer, single consumer ring buffer of length-prefixed records
+    # in shared memory. The first 4 bytes hold the consumer's read index; the
+    # producer's write index is private to it. Both indices count bytes
+    # written/read since the start, so the ring is empty when they're equal.
+    # The shared index wraps at 2**32, so that it's written and read in one
+    # aligned 32-bit access, which can't tear even on 32-bit CPUs (such as
+    # the E310's ARM); the producer works out the space in use modulo 2**32,
+    # which is exact as the ring holds less than that.
+    #
+    # Every record written is followed by one byte on a wakeup pipe. The
+    # consumer only reads as many records as it has collected wakeup bytes,
+    # so the pipe (a system call on both sides) also guarantees that a
+    # record's contents are visible before it is read, even on CPUs with
+    # weakly ordered memory. The consumer collects all pending wakeup bytes in
+    # a single read, so bursts cost it one system call.
+    READ_INDEX = struct.Struct('<I')
+    INDEX_MASK = 0xffffffff
+    RECORD_HEADER = struct.Struct('<I')
+    FULL_RING_SLEEP = 0.0005
+
+    def __init__(self, capacity):
+        if capacity > self.INDEX_MASK:
+            raise ValueError('shm_ring: capacity must be less than 4 GiB')
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True,
+            size=self.READ_INDEX.size + capacity)
+        self.owner_pid = os.getpid()
+        self.buf = self.shm.buf
+        self.READ_INDEX.pack_into(self.buf, 0, 0)
+        (self.wakeup_read_fd, self.wakeup_write_fd) = os.pipe()
+        os.set_blocking(self.wakeup_read_fd, False)
+        self.write_index = 0
+        self.free_space = capacity
+        self.read_index = 0
+        self.available = 0
+        self.aborted = False
+
+    def put(self, offset, data):
+        # Copy data into the ring at the given index, wrapping as needed
+        position = offset % self.capacity
+        first = min(len(data), self.capacity - position)
+        base = self.READ_INDEX.size
+        self.buf[base + position:base + position + first] = data[:first]
+        if first < len(data):
+            self.buf[base:base + len(data) - first] = data[first:]
+
+    def get(self, offset, length):
+        position = offset % self.capacity
+        first = min(length, self.capacity - position)
+        base = self.READ_INDEX.size
+        data = bytes(self.buf[base + position:base + position + first])
+        if first < length:
+            data += bytes(self.buf[base:base + length - first])
+        return data
+
+    def write(self, data, timeout=None):
+        # Producer side; waits for room if the ring is full. Returns False if
+        # the timeout expires first, and raises BrokenPipeError if abort() is
+        # called meanwhile. The consumer's read index is only looked at when
+        # the space known to be free runs out.
+        needed = self.RECORD_HEADER.size + len(data)
+        if needed > self.capacity:
+            raise ValueError(f'shm_ring: {len(data)} byte record exceeds ring capacity')
+        if self.free_space < needed:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while True:
+                self.free_space = self.capacity - ((self.write_index -
+                    self.READ_INDEX.unpack_from(self.buf, 0)[0]) & self.INDEX_MASK)
+                if self.free_space >= needed:
+                    break
+                if self.aborted:
+                    raise BrokenPipeError('shm_ring: aborted')
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(self.FULL_RING_SLEEP)
+        position = self.write_index % self.capacity
+        if position + needed <= self.capacity:
+            start = self.READ_INDEX.size + position
+            self.RECORD_HEADER.pack_into(self.buf, start, len(data))
+            self.buf[start + self.RECORD_HEADER.size:start + needed] = data
+        else:
+            self.put(self.write_index, self.RECORD_HEADER.pack(len(data)))
+            self.put(self.write_index + self.RECORD_HEADER.size, data)
+        self.write_index += needed
+        self.free_space -= needed
+        os.write(self.wakeup_write_fd, b'\x00')
+        return True
+
+    def collect_wakeups(self):
+        try:
+            self.available += len(os.read(self.wakeup_read_fd, 65536))
+        except BlockingIOError:
+            pass
+
+    def poll(self, timeout=0.0):
+        # Consumer side; timeout None waits indefinitely
+        if self.available > 0:
+            return True
+        (readable, _, _) = select.select([self.wakeup_read_fd], [], [], timeout)
+        if readable:
+            self.collect_wakeups()
+        return self.available > 0
+
+    def read(self):
+        while not self.poll(None):
+            pass
+        position = self.read_index % self.capacity
+        if position + self.RECORD_HEADER.size <= self.capacity:
+            (length,) = self.RECORD_HEADER.unpack_from(self.buf,
+                self.READ_INDEX.size + position)
+        else:
+            (length,) = self.RECORD_HEADER.unpack(
+                self.get(self.read_index, self.RECORD_HEADER.size))
+        data = self.get(self.read_index + self.RECORD_HEADER.size, length)
+        self.read_index += self.RECORD_HEADER.size + length
+        self.READ_INDEX.pack_into(self.buf, 0, self.read_index & self.INDEX_MASK)
+        self.available -= 1
+        return data
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        # Only the creating process removes the shared memory block
+        if os.getpid() == self.owner_pid:
+            self.shm.unlink()
+        for fd in [self.wakeup_read_fd, self.wakeup_write_fd]:
+            os.close(fd)
+
+
+class shm_connection():
+    # One end of a shared memory pipe (see shm_pipe())
+    def __init__(self, send_ring, recv_ring):
+        self.send_ring = send_ring
+        self.recv_ring = recv_ring
+
+    def send_bytes(self, data):
+        self.send_ring.write(data)
+
+    def recv_bytes(self):
+        return self.recv_ring.read()
+
+    def send(self, obj):
+        self.send_ring.write(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def recv(self):
+        return pickle.loads(self.recv_ring.read())
+
+    def poll(self, timeout=0.0):
+        return self.recv_ring.poll(timeout)
+
+    def fileno(self):
+        return self.recv_ring.wakeup_read_fd
+
+    def abort(self):
+        # Unblocks a send waiting for a consumer that has gone away (unlike a
+        # pipe, the ring can't tell)
+        self.send_ring.aborted = True
+
+    def close(self):
+        for ring in [self.send_ring, self.recv_ring]:
+            if ring.buf is not None:
+                ring.close()
+
+
+class oob_connection():
+    # multiprocessing.Pipe() connection that sends bytes, bytearray and
+    # memoryview fields of messages (in tuples, lists and dict values) of at
+    # least threshold bytes out of band, using pickle protocol 5: the pickle
+    # stream only refers to them, and they're written after it in the same
+    # message with a single writev() call, rather than being copied into it.
+    # Messages are framed like Connection.send_bytes() ones (so they're read
+    # with a single recv_bytes()), and start with the number of out of band
+    # buffers and the lengths of the pickle stream and buffers. Out of band
+    # fields are received as bytes (whatever they were sent as), as the
+    # targets' PDU handlers and the IMBE decoder expect, at the cost of one
+    # copy out of the received message.
+    FRAME_HEADER = struct.Struct('!i')
+    MESSAGE_HEADER = struct.Struct('<BI')
+    BUFFER_HEADER = struct.Struct('<I')
+    MAX_BUFFERS = 255
+
+    def __init__(self, connection, threshold):
+        self.connection = connection
+        self.threshold = threshold
+
+    def wrap(self, obj):
+        # Wrap the bytes-like fields in PickleBuffers; buffer_callback in
+        # send() decides which of them are sent out of band
+        obj_type = type(obj)
+        if obj_type is bytes or obj_type is bytearray or obj_type is memoryview:
+            return pickle.PickleBuffer(obj)
+        if obj_type is tuple:
+            return tuple([self.wrap(item) for item in obj])
+        if obj_type is list:
+            return [self.wrap(item) for item in obj]
+        if obj_type is dict:
+            return dict([(key, self.wrap(value)) for (key, value) in obj.items()])
+        return obj
+
+    def send(self, obj):
+        buffers = []
+
+        def buffer_callback(buffer):
+            # Returning True serializes the buffer in band
+            view = buffer.raw()
+            if view.nbytes < self.threshold or len(buffers) == self.MAX_BUFFERS:
+                return True
+            buffers.append(view)
+            return False
+
+        data = pickle.dumps(self.wrap(obj), protocol=5, buffer_callback=buffer_callback)
+        header = self.MESSAGE_HEADER.pack(len(buffers), len(data)) + \
+            b''.join([self.BUFFER_HEADER.pack(view.nbytes) for view in buffers])
+        length = len(header) + len(data) + sum([view.nbytes for view in buffers])
+        pieces = [self.FRAME_HEADER.pack(length), header, data] + buffers
+        self.writev(pieces, self.FRAME_HEADER.size + length)
+
+    def writev(self, pieces, remaining):
+        fd = self.connection.fileno()
+        while True:
+            written = os.writev(fd, pieces)
+            remaining -= written
+            if remaining <= 0:
+                return
+            # Drop what was written from the front of the list after a
+            # partial write
+            while written > 0:
+                piece = memoryview(pieces[0]).cast('B')
+                if written >= piece.nbytes:
+                    written -= piece.nbytes
+                    pieces.pop(0)
+                else:
+                    pieces[0] = piece[written:]
+                    written = 0
+
+    def recv(self):
+        message = memoryview(self.connection.recv_bytes())
+        (count, length) = self.MESSAGE_HEADER.unpack_from(message)
+        offset = self.MESSAGE_HEADER.size + count * self.BUFFER_HEADER.size
+        data = message[offset:offset + length]
+        offset += length
+        buffers = []
+        for index in range(count):
+            (buffer_length,) = self.BUFFER_HEADER.unpack_from(message,
+                self.MESSAGE_HEADER.size + index * self.BUFFER_HEADER.size)
+            buffers.append(message[offset:offset + buffer_length].tobytes())
+            offset += buffer_length
+        return pickle.loads(data, buffers=buffers)
+
+    def send_bytes(self, data):
+        # The receiving end's recv() expects the message header first
+        self.send(bytes(data))
+
+    def recv_bytes(self):
+        return bytes(self.recv())
+
+    def poll(self, timeout=0.0):
+        return self.connection.poll(timeout)
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def close(self):
+        self.connection.close()
+
+
+class socket_connection():
+    # Connection over a stream socket (TCP or Unix domain) to a target hosted
+    # by oop_runner, possibly on another machine. Unlike the pipes, one
+    # connection carries both directions. Each message is framed with a
+    # 4-byte length prefix; received data is read in large chunks and split
+    # into messages here, and send_many() sends several messages in one
+    # system call.
+    FRAME_HEADER = struct.Struct('<I')
+    RECV_SIZE = 65536
+
+    def __init__(self, sock):
+        self.sock = sock
+        if sock.family in [socket.AF_INET, socket.AF_INET6]:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.recv_buffer = bytearray()
+        self.recv_offset = 0
+        self.eof = False
+
+    def frame(self, data):
+        return self.FRAME_HEADER.pack(len(data)) + data
+
+    def send_bytes(self, data):
+        self.sock.sendall(self.frame(data))
+
+    def send(self, obj):
+        self.send_bytes(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def send_many(self, objs):
+        self.sock.sendall(b''.join([self.frame(pickle.dumps(obj,
+            protocol=pickle.HIGHEST_PROTOCOL)) for obj in objs]))
+
+    def frame_ready(self):
+        available = len(self.recv_buffer) - self.recv_offset
+        if available < self.FRAME_HEADER.size:
+            return False
+        (length,) = self.FRAME_HEADER.unpack_from(self.recv_buffer, self.recv_offset)
+        return available >= self.FRAME_HEADER.size + length
+
+    def fill(self):
+        # Read whatever has arrived, dropping the messages already consumed
+        # from the buffer first
+        if self.recv_offset > 0:
+            del self.recv_buffer[:self.recv_offset]
+            self.recv_offset = 0
+        data = self.sock.recv(self.RECV_SIZE)
+        if not data:
+            self.eof = True
+        self.recv_buffer += data
+
+    def recv_bytes(self, maxlength=None):
+        # Like Connection.recv_bytes(), a message longer than maxlength is
+        # refused (before it's read)
+        while not self.frame_ready():
+            if maxlength is not None and len(self.recv_buffer) - self.recv_offset >= self.FRAME_HEADER.size:
+                (length,) = self.FRAME_HEADER.unpack_from(self.recv_buffer, self.recv_offset)
+                if length > maxlength:
+                    raise OSError(f'socket_connection: message of {length} bytes too long')
+            if self.eof:
+                raise EOFError('socket_connection: connection closed')
+            self.fill()
+        (length,) = self.FRAME_HEADER.unpack_from(self.recv_buffer, self.recv_offset)
+        if maxlength is not None and length > maxlength:
+            raise OSError(f'socket_connection: message of {length} bytes too long')
+        start = self.recv_offset + self.FRAME_HEADER.size
+        self.recv_offset = start + length
+        return bytes(self.recv_buffer[start:self.recv_offset])
+
+    def recv(self):
+        return pickle.loads(self.recv_bytes())
+
+    def poll(self, timeout=0.0):
+        # Like Connection.poll(), returns True at the end of the stream so
+        # that the next recv() raises EOFError
+        if self.frame_ready() or self.eof:
+            return True
+        (readable, _, _) = select.select([self.sock], [], [], timeout)
+        if readable:
+            self.fill()
+        return self.frame_ready() or self.eof
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def abort(self):
+        # Unblocks a send waiting for a peer that has stopped reading
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+def parse_address(address):
+    # Addresses are 'unix:<path>' for Unix domain sockets, or '<host>:<port>'
+    # (optionally prefixed with 'tcp:') for TCP
+    if address.startswith('unix:'):
+        return (socket.AF_UNIX, address[len('unix:'):])
+    if address.startswith('tcp:'):
+        address = address[len('tcp:'):]
+    (host, _, port) = address.rpartition(':')
+    return (socket.AF_INET, (host, int(port)))
+
+
+def connect(address, timeout=None):
+    (family, sock_address) = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(sock_address)
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return socket_connection(sock)
+
+
+def listen(address):
+    (family, sock_address) = parse_address(address)
+    if family == socket.AF_UNIX and os.path.exists(sock_address):
+        os.unlink(sock_address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(sock_address)
+    sock.listen()
+    return sock
+
+
+def authenticate(connection, authkey, accepting, timeout=5.0):
+    # Mutual challenge and response on a new socket_connection, as done by
+    # multiprocessing's Listener and Client: each end proves it knows authkey
+    # without sending it, and the accepting end challenges first, so nothing
+    # is unpickled from a peer that doesn't know it. Raises
+    # AuthenticationError if either end gets it wrong, or OSError/EOFError if
+    # the peer goes away or takes more than timeout seconds to answer.
+    connection.sock.settimeout(timeout)
+    try:
+        if accepting:
+            deliver_challenge(connection, authkey)
+            answer_challenge(connection, authkey)
+        else:
+            answer_challenge(connection, authkey)
+            deliver_challenge(connection, authkey)
+    except AssertionError:
+        # answer_challenge() asserts that it was sent a challenge
+        raise AuthenticationError('oop_transport: peer did not send a challenge')
+    finally:
+        connection.sock.settimeout(None)
+
+
+def socket_pipe(address):
+    # Pair of connected socket connections over the given address (which is
+    # listened on just long enough to connect), for local use and testing
+    listener = listen(address)
+    try:
+        client_sock = socket.socket(listener.family, socket.SOCK_STREAM)
+        client_sock.connect(listener.getsockname())
+        (server_sock, _) = listener.accept()
+    finally:
+        listener.close()
+    return (socket_connection(client_sock), socket_connection(server_sock))
+
+
+def shm_pipe(capacity=262144):
+    # Returns a pair of connected shm_connection endpoints, like Pipe(), each
+    # direction having a ring of the given capacity in bytes
+    rings = (shm_ring(capacity), shm_ring(capacity))
+    return (shm_connection(rings[0], rings[1]), shm_connection(rings[1], rings[0]))
+
+
+def oob_pipe(threshold):
+    # Returns a pair of connected oob_connection endpoints, like Pipe()
+    (end_a, end_b) = Pipe()
+    return (oob_connection(end_a, threshold), oob_connection(end_b, threshold))
+
+
+def make_pipe(transport, params):
+    # Create a pair of endpoints for the given transport name ('pipe', 'shm'
+    # or 'socket'); options come from the proxy's parameters. Pipes send
+    # bytes-like fields of at least oop_oob_threshold bytes out of band
+    # (default 0, off): this only pays for fields of tens of kilobytes and
+    # up, as every message then costs a little more to send (see the
+    # benchmark below).
+    if transport == 'pipe':
+        threshold = int(params.get('oop_oob_threshold', 0))
+        if threshold > 0 and hasattr(os, 'writev'):
+            return oob_pipe(threshold)
+        return Pipe()
+    if transport == 'shm':
+        return shm_pipe(int(params.get('oop_shm_size', 262144)))
+    if transport == 'socket':
+        return socket_pipe(params.get('oop_address', 'tcp:127.0.0.1:0'))
+    raise ValueError(f'oop_transport: unknown transport {transport}')
+
+
+if __name__ == "__main__":
+    # Throughput benchmark: a child process receives PDUs (as parsed dicts
+    # and as raw bytes) from the parent over each transport, and acknowledges
+    # the last one. The socket transport is run over TCP on the loopback
+    # interface, sending one PDU per system call and then batches of
+    # BATCH_SIZE with send_many().
+    COUNT = 100000
+    BATCH_SIZE = 32
+    TSBK_PDU = b'{"p25_du": {"nac": "0x293", "duid": "0x7", ' \
+        b'"tsbk": "3d00150640320a18a2e04e7b", "ok": 1}}\n'
+    TSBK_DICT = {'p25_du': {'nac': '0x293', 'duid': '0x7',
+        'tsbk': '3d00150640320a18a2e04e7b', 'ok': 1}}
+
+    def consume(connection, count, raw):
+        for _ in range(count):
+            if raw:
+                connection.recv_bytes()
+            else:
+                connection.recv()
+        connection.send('done')
+
+    for raw in [False, True]:
+        for (transport, batched) in [('pipe', False), ('shm', False),
+            ('socket', False), ('socket', True)]:
+            if raw and batched:
+                continue
+            (parent_end, child_end) = make_pipe(transport, {})
+            child = Process(target=consume, args=(child_end, COUNT, raw))
+            child.start()
+            start = time.perf_counter()
+            if batched:
+                batch = [('cc_pdus', TSBK_DICT)] * BATCH_SIZE
+                for _ in range(COUNT // BATCH_SIZE):
+                    parent_end.send_many(batch)
+            else:
+                for _ in range(COUNT):
+                    if raw:
+                        parent_end.send_bytes(TSBK_PDU)
+                    else:
+                        parent_end.send(('cc_pdus', TSBK_DICT))
+            parent_end.recv()
+            elapsed = time.perf_counter() - start
+            child.join()
+            if transport != 'pipe':
+                parent_end.close()
+            name = transport + (' (batched)' if batched else '')
+            print(f'{name:<16s} {"bytes" if raw else "dicts":<5s}: '
+                f'{COUNT / elapsed:9.0f} PDUs/s')
+
+    # Messages carrying voice payloads over pipes, with the payload pickled
+    # in band (copied into the pickle stream, and out of it again when
+    # unpickled) and sent out of band (only copied when received): the 99 bytes of IMBE frames in an LDU
+    # going to the target, and 2880 bytes of PCM (an LDU's worth) coming
+    # back from it, and for comparison a 256 KiB block (about 8 seconds of
+    # PCM). The pickle stream size shows how much of each message is copied.
+    PAYLOAD_COUNT = 20000
+    LDU_DICT = {'p25_du': {'nac': '0x293', 'duid': '0x5', 'ok': 1, 'imbe': bytes(99)}}
+    for (name, message) in [('IMBE 99 B', ('tc_pdus', LDU_DICT)),
+        ('PCM 2880 B', ('__oop_peer__', (None, ('pcm', (851012500, bytes(2880)))))),
+        ('PCM 256 KiB', ('__oop_peer__', (None, ('pcm', (851012500, bytes(262144))))))]:
+        for (band, threshold) in [('in band', 0), ('out of band', 64)]:
+            (parent_end, child_end) = make_pipe('pipe', {'oop_oob_threshold': threshold})
+            if threshold > 0:
+                out_of_band = []
+                stream = pickle.dumps(parent_end.wrap(message), protocol=5,
+                    buffer_callback=lambda buffer: out_of_band.append(buffer) and False)
+                copied = len(stream)
+            else:
+                copied = len(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+            count = min(PAYLOAD_COUNT, 2 ** 30 // len(pickle.dumps(message, protocol=5)))
+            child = Process(target=consume, args=(child_end, count, False))
+            child.start()
+            start = time.perf_counter()
+            for _ in range(count):
+                parent_end.send(message)
+            parent_end.recv()
+            elapsed = time.perf_counter() - start
+            child.join()
+            print(f'{name:<11s} {band:<12s}: {count / elapsed:9.0f} messages/s, '
+                f'{copied} byte pickle stream')
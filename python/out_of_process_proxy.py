@@ -19,83 +19,886 @@
 # Boston, MA 02110-1301, USA.
 #
 
-
+import functools
 import importlib
+import inspect
 import logging
-from multiprocessing import Process, Pipe
+import multiprocessing
+from multiprocessing import Process
+from scanner import oop_transport
+from scanner import pdu_delivery
+from scanner import pdu_stats
+import queue
+import threading
+import time
 
+# Control messages share the pipes with PDUs, and are sent as
+# (OOP_CONTROL, (command, argument)) tuples. The target answers OOP_SNAPSHOT
+# with an (OOP_CONTROL, (OOP_SNAPSHOT, snapshot)) message on its output pipe,
+# handles OOP_RESTORE by restoring the snapshot given as the argument,
+# exits its main loop on OOP_STOP, and should answer OOP_HEARTBEAT with an
+# (OOP_CONTROL, (OOP_HEARTBEAT, argument)) message so that the proxy can
+# tell if it hangs (see oop_shard). OOP_HELLO is only sent to oop_runner, as
+# the first message on a new connection. The loader (see oop_loader()) sends
+# (OOP_CONTROL, (OOP_READY, seconds taken to load the target)) once the
+# target has been instantiated and is about to start its main loop.
+OOP_CONTROL = '__oop_control__'
+OOP_SNAPSHOT = 'snapshot'
+OOP_RESTORE = 'restore'
+OOP_STOP = 'stop'
+OOP_HEARTBEAT = 'heartbeat'
+OOP_HELLO = 'hello'
+OOP_READY = 'ready'
 
-class out_of_process_proxy():
+# Messages between shards (see out_of_process_proxy.__init__()) are sent by a
+# target as (OOP_PEER, (shard name, message)) on its output pipe, with a shard
+# name of None for all other shards, and arrive at the other shards as
+# (OOP_PEER, (sending shard name, message)) on their input pipes
+OOP_PEER = '__oop_peer__'
 
-    # NOTE: oop_loader code runs in a separate process
-    def oop_loader(self, oop_target, input_ports, output_ports, input_pdu_pipe, output_pdu_pipe, params):
-        # Load the target OOP module and class; if successful, invoke its
-        # main loop function
-        try:
-            oop_target_module_name = '.'.join(oop_target[0:-1])
-            oop_target_module = importlib.import_module(oop_target_module_name)
-            oop_target_class = oop_target[-1]
-            if hasattr(oop_target_module, oop_target_class):
-                try:
-                    self.oop_class = getattr(oop_target_module, oop_target_class)(
-                        input_ports=input_ports,
-                        output_ports=output_ports,
-                        input_pdu_pipe=input_pdu_pipe,
-                        output_pdu_pipe=output_pdu_pipe,
-                        params=params)
-                    self.oop_class.main_loop()
-                except:
-                    logging.warning(f'Could not instantiate target class {oop_target_class} - incoming PDUs will be dropped')
-            else:
-                logging.warning(f'No class {oop_target_class} in {oop_target_module_name} - incoming PDUs will be dropped')
-        except:
-            logging.warning(f'Could not import {oop_target_module_name} - incoming PDUs will be dropped')
+# Per input port lane statistics shared with the target (see
+# read_lane_stats())
+LANE_STATS_FIELDS = ['queued', 'dropped', 'max_depth', 'depth']
+
+# Lane the supervisor's heartbeats are queued in, ahead of everything else
+HEARTBEAT_LANE = '__oop_heartbeat__'
+
+# Supervision counters per shard (see oop_shard.get_supervision_stats())
+SUPERVISION_STATS_FIELDS = ['heartbeats', 'exits', 'hangs', 'restarts',
+    'snapshots_restored', 'send_failures']
+
+# Seconds to wait for a target process to exit before terminating it
+SHARD_JOIN_TIMEOUT = 2.0
+
+
+def read_lane_stats(lane_stats_array, ports):
+    # Returns a dictionary of lane statistics per port from the shared array
+    # the proxy keeps them in
+    width = len(LANE_STATS_FIELDS)
+    return dict([(port, dict(zip(LANE_STATS_FIELDS,
+        lane_stats_array[index * width:(index + 1) * width])))
+        for (index, port) in enumerate(ports)])
+
+
+def load_target(oop_target, kwargs, optional_kwargs):
+    # Load the target OOP module (oop_target is the module.class name split
+    # at the dots) and instantiate the class with the given arguments, plus
+    # those optional arguments its constructor accepts. Returns None if the
+    # target can't be loaded.
+    oop_target_module_name = '.'.join(oop_target[0:-1])
+    oop_target_class = oop_target[-1]
+    try:
+        oop_target_module = importlib.import_module(oop_target_module_name)
+    except BaseException as e:
+        logging.warning(f'Could not import {oop_target_module_name} ({e}) - incoming PDUs will be dropped')
+        return None
+    if not hasattr(oop_target_module, oop_target_class):
+        logging.warning(f'No class {oop_target_class} in {oop_target_module_name} - incoming PDUs will be dropped')
+        return None
+    try:
+        target_type = getattr(oop_target_module, oop_target_class)
+        kwargs = dict(kwargs)
+        signature = inspect.signature(target_type)
+        accepts_any = any([param.kind == inspect.Parameter.VAR_KEYWORD
+            for param in signature.parameters.values()])
+        for (name, value) in optional_kwargs.items():
+            if accepts_any or name in signature.parameters:
+                kwargs[name] = value
+        return target_type(**kwargs)
+    except BaseException as e:
+        logging.warning(f'Could not instantiate target class {oop_target_class} ({e}) - incoming PDUs will be dropped')
+        return None
+
+
+# NOTE: oop_loader code runs in a separate process
+def oop_loader(oop_target, kwargs, optional_kwargs):
+    # Load the target (see load_target()), tell the proxy it's ready and
+    # invoke its main loop function. An exception raised by the main loop
+    # ends the process, and the proxy's supervisor starts a new one.
+    start = time.monotonic()
+    target = load_target(oop_target, kwargs, optional_kwargs)
+    if target:
+        kwargs['output_pdu_pipe'].send((OOP_CONTROL, (OOP_READY, time.monotonic() - start)))
+        target.main_loop()
+
+
+class remote_target():
+    # Stands in for the target process when the target is hosted by
+    # oop_runner (oop_transport=socket), so that the supervisor treats a
+    # lost connection like a process that has exited
+    exitcode = None
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = threading.Event()
+        if connection is None:
+            self.exit_reason = 'could not connect'
+            self.closed.set()
+        else:
+            self.exit_reason = 'lost its connection'
+
+    def connection_lost(self):
+        self.closed.set()
+
+    def is_alive(self):
+        return not self.closed.is_set()
+
+    def join(self, timeout=None):
+        self.closed.wait(timeout)
+
+    def terminate(self):
+        if self.connection:
+            self.connection.abort()
+        self.closed.set()
+
+    kill = terminate
 
-    def __init__(self, input_ports, output_ports, send_pdu_fn, params):
-        logging.info('out_of_process_proxy: instantiating')
 
-        # Validate parameters
-        for required_param in ['oop_target']:
-            if required_param not in params:
-                raise KeyError(f'out_of_process_proxy: Required parameter \'{required_param}\' not specified')
-        oop_target = params['oop_target'].split('.')
-        if len(oop_target) < 2:
-            raise ValueError(f'out_of_process_proxy: oop_target must be in module.class format')
+class oop_shard():
+    # One target process behind the proxy, with its own pipes, input lanes
+    # and sender and reader threads, and a supervisor thread that restarts
+    # the target process if it exits or hangs
 
+    def __init__(self, proxy, name, oop_target, input_ports, output_ports, lane_ports, params):
+        self.proxy = proxy
+        self.name = name
         self.child_process = None
+        self.oop_target = oop_target
+        self.input_ports = input_ports
+        self.output_ports = output_ports
+        self.lane_ports = lane_ports
+        self.params = params
+        self.transport = params.get('oop_transport', 'pipe')
 
-        # Create pipes 
-        self.send_pdu_fn = send_pdu_fn
-        self.proxy_input_pdu_pipe_end, self.oop_input_pdu_pipe_end = Pipe()
-        self.proxy_output_pdu_pipe_end, self.oop_output_pdu_pipe_end = Pipe()
+        # Target processes are started with oop_start_method: fork (the
+        # default) copies this process, so nothing needs to be imported again
+        # but the flowgraph's memory and threads come along; forkserver forks
+        # them from a small server process started once, and spawn starts a
+        # fresh interpreter each time. oop_preload lists modules
+        # (colon-separated, e.g. the target's) to import ahead of time: here
+        # before forking, or in the server with forkserver (which is started
+        # once, by the first proxy to use it). The shared memory transport
+        # needs fork, as its wakeup pipes can't be passed to a new process.
+        start_method = params.get('oop_start_method', 'fork')
+        if start_method not in multiprocessing.get_all_start_methods():
+            raise ValueError(f'out_of_process_proxy: oop_start_method must be one of '
+                f'{multiprocessing.get_all_start_methods()}')
+        if self.transport == 'shm' and start_method != 'fork':
+            raise ValueError('out_of_process_proxy: oop_transport=shm requires oop_start_method=fork')
+        self.context = multiprocessing.get_context(start_method)
+        preload = [module for module in params.get('oop_preload', '').split(':') if module]
+        if start_method == 'forkserver':
+            self.context.set_forkserver_preload(preload)
+        elif start_method == 'fork':
+            for module in preload:
+                try:
+                    importlib.import_module(module)
+                except BaseException as e:
+                    logging.warning(f'out_of_process_proxy: could not preload {module} ({e})')
+        if self.transport == 'socket' and f'oop_address_{name}' not in params and 'oop_address' not in params:
+            raise KeyError('out_of_process_proxy: Required parameter \'oop_address\' not specified')
+        if self.transport == 'socket' and 'oop_authkey' not in params:
+            raise KeyError('out_of_process_proxy: Required parameter \'oop_authkey\' not specified')
+
+        # PDUs for the target are queued in a bounded lane per input port and
+        # sent by a sender thread, so a target that falls behind can't block
+        # the caller. Lanes hold oop_queue_depth PDUs (or batches; default
+        # 256) and drop the oldest when full, unless oop_overflow says
+        # otherwise (block or drop_newest); both can be set per port too
+        # (e.g. oop_overflow_cc_pdus=block). Lanes are served in the order of
+        # oop_port_priority (colon-separated port names), defaulting to the
+        # input port order, so control channel PDUs (cc_pdus, first in the
+        # shipped flowgraph) go ahead of voice PDUs and are never dropped
+        # to make room for them. Heartbeats and messages from other shards
+        # have lanes of their own, served first, and control messages have
+        # one whose messages are sent once the PDUs queued before them have
+        # been, so that snapshot and stop requests follow those PDUs, but
+        # ahead of any queued after them. The lanes outlive restarts of the
+        # target process.
+        port_priority = [port for port in
+            params.get('oop_port_priority', '').split(':') if port in lane_ports]
+        port_priority += [port for port in lane_ports if port not in port_priority]
+        lane_depths = dict([(port, int(params[f'oop_queue_depth_{port}']))
+            for port in lane_ports if f'oop_queue_depth_{port}' in params])
+        lane_overflows = dict([(port, params[f'oop_overflow_{port}'])
+            for port in lane_ports if f'oop_overflow_{port}' in params])
+        lane_depths[HEARTBEAT_LANE] = 1
+        lane_overflows[HEARTBEAT_LANE] = pdu_delivery.OVERFLOW_DROP_NEWEST
+        lane_overflows[OOP_PEER] = pdu_delivery.OVERFLOW_BLOCK
+        lane_overflows[OOP_CONTROL] = pdu_delivery.OVERFLOW_BLOCK
+        self.input_queue = pdu_delivery.pdu_queue(
+            [HEARTBEAT_LANE, OOP_PEER] + port_priority + [OOP_CONTROL],
+            int(params.get('oop_queue_depth', 256)),
+            params.get('oop_overflow', pdu_delivery.OVERFLOW_DROP_OLDEST),
+            lane_depths, lane_overflows, [OOP_CONTROL])
+
+        # The lane statistics are mirrored into shared memory, where the
+        # target can read them through the get_lane_stats_fn() callback given
+        # to its constructor (if it accepts one)
+        self.lane_indices = dict([(port, index) for (index, port) in enumerate(lane_ports)])
+        self.lane_stats_array = self.context.Array('q', len(lane_ports) * len(LANE_STATS_FIELDS), lock=False)
+
+        # A reader thread issues PDUs from the target as soon as they arrive,
+        # so tuning commands aren't held up waiting for the next input PDU
+        # (oop_output_thread=0 instead checks for one output PDU whenever a
+        # PDU is sent to the target). Replies to control messages someone is
+        # waiting for are passed on through control_replies.
+        self.use_output_thread = params.get('oop_output_thread', '1') not in ['', '0']
+        self.control_replies = queue.Queue()
+        self.awaiting_reply = False
+        self.control_sent = threading.Event()
+
+        # The supervisor thread checks on the target every oop_heartbeat_ms
+        # milliseconds (default 1000; 0 turns supervision off), sending it an
+        # OOP_HEARTBEAT control message which it should answer in kind. A
+        # target process that exits, or that has answered heartbeats before
+        # but then doesn't for oop_heartbeat_timeout_ms (default 5000), is
+        # restarted (unless oop_restart=0) after a backoff that starts at
+        # oop_restart_backoff_ms (default 500) and doubles with each restart
+        # up to oop_restart_backoff_max_ms (default 30000). Every
+        # oop_snapshot_interval_ms (default 10000; 0 turns it off), the
+        # target is asked for its state snapshot, and the latest one is
+        # restored in the new target process before it's sent any PDUs.
+        # Without the reader thread, heartbeat answers are only read when
+        # PDUs arrive, so only exits are detected.
+        #
+        # A new target process tells the proxy when it has loaded its target
+        # and is about to accept PDUs (OOP_READY, see oop_loader()); until
+        # then PDUs stay in the lanes, subject to their overflow policies. The
+        # time it took is logged, and one that isn't ready within
+        # oop_ready_timeout_ms (default 30000) is treated as hung.
+        self.heartbeat_interval = float(params.get('oop_heartbeat_ms', 1000)) / 1000.0
+        self.heartbeat_timeout = float(params.get('oop_heartbeat_timeout_ms', 5000)) / 1000.0
+        self.restart_enabled = params.get('oop_restart', '1') not in ['', '0']
+        self.restart_backoff = float(params.get('oop_restart_backoff_ms', 500)) / 1000.0
+        self.restart_backoff_max = float(params.get('oop_restart_backoff_max_ms', 30000)) / 1000.0
+        self.snapshot_interval = float(params.get('oop_snapshot_interval_ms', 10000)) / 1000.0
+        self.ready_timeout = float(params.get('oop_ready_timeout_ms', 30000)) / 1000.0
+        self.target_ready = threading.Event()
+        self.startup_time = None
+        self.send_batch_size = int(params.get('oop_send_batch', 32))
+
+        # With latency_probe=1, probed PDUs are stamped as they're sent to
+        # the target (see pdu_stats.LATENCY_PROBE_HOPS). Note that the
+        # timestamps are only comparable if the target runs on this machine.
+        self.latency_probe = params.get('latency_probe', '0') not in ['', '0']
+        self.supervision_stats = dict([(field, 0) for field in SUPERVISION_STATS_FIELDS])
+        self.consecutive_restarts = 0
+        self.last_snapshot = None
+        self.stopping = False
+
+        self.start_target()
+
+        # A remote target's connection is retried even with supervision off
+        # (see supervise_loop())
+        self.supervisor_thread = None
+        self.supervisor_stop_event = threading.Event()
+        if self.heartbeat_interval > 0 or self.transport == 'socket':
+            self.supervisor_thread = threading.Thread(target=self.supervise_loop,
+                name=f'out_of_process_proxy {self.name} supervisor', daemon=True)
+            self.supervisor_thread.start()
+
+    def start_target(self, snapshot=None):
+        self.child_start_time = time.monotonic()
+        self.target_ready.clear()
+        self.last_heartbeat_time = None
+        self.next_snapshot_time = self.child_start_time + self.snapshot_interval
+        self.input_thread = None
+        self.output_thread = None
+        self.proxy_output_pdu_pipe_end = None
+        if self.transport == 'socket':
+            if not self.connect_remote_target():
+                return
+        else:
+            self.start_local_target()
+
+        # A restarted target gets its predecessor's state before any PDUs
+        if snapshot is not None:
+            self.proxy_input_pdu_pipe_end.send((OOP_CONTROL, (OOP_RESTORE, snapshot)))
+
+        self.input_stop_event = threading.Event()
+        self.input_thread = threading.Thread(target=self.input_loop,
+            name=f'out_of_process_proxy {self.name} input', daemon=True)
+        self.input_thread.start()
+
+        if self.use_output_thread:
+            self.output_stop_event = threading.Event()
+            self.output_thread = threading.Thread(target=self.output_loop,
+                name=f'out_of_process_proxy {self.name} output', daemon=True)
+            self.output_thread.start()
+
+    def start_local_target(self):
+        # Create pipes; oop_transport=shm replaces them with shared memory
+        # ring buffers (of oop_shm_size bytes each way), which behave the
+        # same way but need fewer system calls
+        self.proxy_input_pdu_pipe_end, self.oop_input_pdu_pipe_end = \
+            oop_transport.make_pipe(self.transport, self.params)
+        self.proxy_output_pdu_pipe_end, self.oop_output_pdu_pipe_end = \
+            oop_transport.make_pipe(self.transport, self.params)
 
         # Create loader process and send it on its way
-        self.child_process = Process(target=self.oop_loader,
-            args=(oop_target, input_ports, output_ports, 
-                self.oop_input_pdu_pipe_end, self.oop_output_pdu_pipe_end,
-                params))
+        self.child_process = self.context.Process(target=oop_loader,
+            args=(self.oop_target, {
+                    'input_ports': self.input_ports,
+                    'output_ports': self.output_ports,
+                    'input_pdu_pipe': self.oop_input_pdu_pipe_end,
+                    'output_pdu_pipe': self.oop_output_pdu_pipe_end,
+                    'params': self.params
+                }, {
+                    'get_lane_stats_fn': functools.partial(read_lane_stats,
+                        self.lane_stats_array, self.lane_ports)
+                }),
+            name=f'oop {self.name}')
         self.child_process.start()
 
-    def __del__(self):
+        # Our copies of the target's pipe ends are closed, so that the pipes
+        # break when the target process goes away (the shared memory rings
+        # must stay open here, as this process owns them)
+        if self.transport == 'pipe':
+            self.oop_input_pdu_pipe_end.close()
+            self.oop_output_pdu_pipe_end.close()
+
+    def connect_remote_target(self):
+        # With oop_transport=socket, the target is hosted by oop_runner,
+        # possibly on another machine, listening on oop_address (or
+        # oop_address_<shard> if sharded; see oop_transport.parse_address()
+        # for the format). One connection carries both directions, and the
+        # runner is told the target, ports and parameters when it connects,
+        # once each end has proven to the other that it knows oop_authkey
+        # (the runner's --authkey). If the connection can't be made or is
+        # lost, the supervisor tries again after the restart backoff.
+        address = self.params.get(f'oop_address_{self.name}', self.params.get('oop_address'))
+        try:
+            connection = oop_transport.connect(address, SHARD_JOIN_TIMEOUT)
+            oop_transport.authenticate(connection, self.params['oop_authkey'].encode(), False)
+            connection.send((OOP_CONTROL, (OOP_HELLO, {
+                'oop_target': '.'.join(self.oop_target),
+                'input_ports': self.input_ports,
+                'output_ports': self.output_ports,
+                'params': dict([(key, value) for (key, value) in self.params.items()
+                    if key != 'oop_authkey'])
+            })))
+        except (OSError, EOFError, ValueError, TypeError, multiprocessing.AuthenticationError) as e:
+            logging.warning(f'out_of_process_proxy: {self.name} could not connect to {address} ({e})')
+            self.child_process = remote_target(None)
+            return False
+        logging.info(f'out_of_process_proxy: {self.name} connected to {address}')
+        self.proxy_input_pdu_pipe_end = self.proxy_output_pdu_pipe_end = connection
+        self.oop_input_pdu_pipe_end = self.oop_output_pdu_pipe_end = None
+        self.child_process = remote_target(connection)
+        return True
+
+    def stop_target(self, timeout):
+        # Wait for the target process to exit, terminating it if it doesn't,
+        # then stop the threads serving it and close the pipes
+        self.child_process.join(timeout)
+        if self.child_process.is_alive():
+            logging.warning(f'out_of_process_proxy: terminating {self.name}')
+            self.child_process.terminate()
+            self.child_process.join(timeout)
+            if self.child_process.is_alive():
+                self.child_process.kill()
+                self.child_process.join()
+        self.child_process = None
+        if self.input_thread is None:
+            # Never connected (see connect_remote_target())
+            return
+        self.input_stop_event.set()
+        if hasattr(self.proxy_input_pdu_pipe_end, 'abort'):
+            self.proxy_input_pdu_pipe_end.abort()
+        self.input_thread.join()
+        if self.output_thread:
+            self.output_stop_event.set()
+            self.output_thread.join()
+        pipe_ends = [self.proxy_input_pdu_pipe_end, self.proxy_output_pdu_pipe_end,
+            self.oop_input_pdu_pipe_end, self.oop_output_pdu_pipe_end]
+        for (index, pipe_end) in enumerate(pipe_ends):
+            if pipe_end is not None and pipe_end not in pipe_ends[:index]:
+                pipe_end.close()
+
+    def supervise_loop(self):
+        # Runs on the supervisor thread until the shard is stopped. With
+        # oop_heartbeat_ms=0, it only runs for a remote target, checking
+        # every oop_restart_backoff_ms that the connection is up so that one
+        # that couldn't be made (or was lost) is tried again, and sends no
+        # heartbeats or snapshot requests.
+        supervising = self.heartbeat_interval > 0
+        while not self.supervisor_stop_event.wait(self.heartbeat_interval or self.restart_backoff):
+            now = time.monotonic()
+            if not self.child_process.is_alive():
+                self.supervision_stats['exits'] += 1
+                reason = getattr(self.child_process, 'exit_reason',
+                    f'exited with code {self.child_process.exitcode}')
+            elif supervising and self.output_thread and self.last_heartbeat_time is not None and \
+                now - self.last_heartbeat_time > self.heartbeat_timeout:
+                self.supervision_stats['hangs'] += 1
+                reason = f'has not answered heartbeats for {now - self.last_heartbeat_time:.1f} s'
+            elif supervising and self.output_thread and not self.target_ready.is_set() and \
+                now - self.child_start_time > self.ready_timeout:
+                self.supervision_stats['hangs'] += 1
+                reason = f'has not become ready in {now - self.child_start_time:.1f} s'
+            elif not supervising:
+                continue
+            else:
+                self.input_queue.put(HEARTBEAT_LANE, None)
+                self.supervision_stats['heartbeats'] += 1
+                if self.snapshot_interval > 0 and now >= self.next_snapshot_time:
+                    self.next_snapshot_time = now + self.snapshot_interval
+                    self.send_control(OOP_SNAPSHOT)
+                continue
+            if not self.restart_enabled:
+                logging.error(f'out_of_process_proxy: {self.name} {reason}, not restarting it')
+                break
+            self.restart_target(reason)
+
+    def restart_target(self, reason):
+        # The backoff starts over once a target process has stayed up for
+        # longer than the longest backoff
+        if time.monotonic() - self.child_start_time > self.restart_backoff_max:
+            self.consecutive_restarts = 0
+        backoff = min(self.restart_backoff * (2 ** self.consecutive_restarts), self.restart_backoff_max)
+        logging.warning(f'out_of_process_proxy: {self.name} {reason}, restarting it in {backoff:.1f} s')
+        self.stop_target(0)
+        if self.supervisor_stop_event.wait(backoff):
+            return
+        self.consecutive_restarts += 1
+        self.supervision_stats['restarts'] += 1
+        if self.last_snapshot is not None:
+            self.supervision_stats['snapshots_restored'] += 1
+        self.start_target(self.last_snapshot)
+
+    def get_supervision_stats(self):
+        return dict(self.supervision_stats, alive=self.child_process is not None and
+            self.child_process.is_alive(), startup_s=self.startup_time)
+
+    def wait_until_ready(self, timeout=None):
+        # Returns whether the target is ready to accept PDUs
+        return self.target_ready.wait(timeout)
+
+    def put(self, port_name, data):
+        # Queue a PDU (or batch) to be sent to the target via the pipe
+        self.input_queue.put(port_name, data)
+        self.publish_lane_stats(port_name)
+        if not self.output_thread:
+            self.poll_output_pdus()
+
+    def send_control(self, command, argument=None):
+        self.input_queue.put(OOP_CONTROL, (command, argument))
+
+    def send_peer_message(self, source_name, message):
+        self.input_queue.put(OOP_PEER, (source_name, message))
+
+    def input_loop(self):
+        # Runs on the sender thread until the input queue is closed and empty,
+        # or the target process is being restarted. Connections that can send
+        # several messages at once (see oop_transport.socket_connection) are
+        # given whatever is queued, up to oop_send_batch messages, in one go.
+        INPUT_POLL_INTERVAL = 0.1
+        send_many = getattr(self.proxy_input_pdu_pipe_end, 'send_many', None)
+        while self.use_output_thread and not self.target_ready.wait(INPUT_POLL_INTERVAL):
+            if self.input_stop_event.is_set():
+                return
+        while not self.input_stop_event.is_set():
+            entry = self.input_queue.get(INPUT_POLL_INTERVAL)
+            if entry is None:
+                if self.input_queue.closed:
+                    break
+                continue
+            entries = [entry]
+            while send_many and len(entries) < self.send_batch_size:
+                entry = self.input_queue.get(0)
+                if entry is None:
+                    break
+                entries.append(entry)
+            messages = [(OOP_CONTROL, (OOP_HEARTBEAT, data)) if port_name == HEARTBEAT_LANE
+                else (port_name, data) for (port_name, data) in entries]
+            if self.latency_probe:
+                for (_, data) in entries:
+                    for pdu in (data if type(data) is list else [data]):
+                        pdu_stats.stamp_probe(pdu, 'queue')
+            try:
+                if send_many:
+                    send_many(messages)
+                else:
+                    self.proxy_input_pdu_pipe_end.send(messages[0])
+            except (OSError, ValueError) as e:
+                logging.warning(f'out_of_process_proxy: {self.name} input pipe closed ({e})')
+                self.supervision_stats['send_failures'] += 1
+                break
+            for port_name in set([port_name for (port_name, _) in entries]):
+                if port_name == OOP_CONTROL:
+                    self.control_sent.set()
+                elif port_name in self.lane_indices:
+                    self.publish_lane_stats(port_name)
+
+    def publish_lane_stats(self, port_name):
+        width = len(LANE_STATS_FIELDS)
+        index = self.lane_indices[port_name] * width
+        self.lane_stats_array[index:index + width] = self.input_queue.get_lane_stats(port_name)
+
+    def get_lane_stats(self):
+        return read_lane_stats(self.lane_stats_array, list(self.lane_indices))
+
+    def poll_output_pdus(self):
+        # See if there are any PDUs from the target end we need to issue
+        if self.proxy_output_pdu_pipe_end is None:
+            return
+        try:
+            if self.proxy_output_pdu_pipe_end.poll():
+                (send_port_name, send_pdu) = self.proxy_output_pdu_pipe_end.recv()
+                self.handle_output(send_port_name, send_pdu)
+        except (EOFError, OSError):
+            # The target process has gone; the supervisor restarts it
+            if hasattr(self.child_process, 'connection_lost'):
+                self.child_process.connection_lost()
+
+    def output_loop(self):
+        # Runs on the reader thread, waking up every so often to check
+        # whether the proxy is being stopped
+        OUTPUT_POLL_INTERVAL = 0.1
+        while not self.output_stop_event.is_set():
+            try:
+                if not self.proxy_output_pdu_pipe_end.poll(OUTPUT_POLL_INTERVAL):
+                    continue
+                (send_port_name, send_pdu) = self.proxy_output_pdu_pipe_end.recv()
+            except EOFError:
+                # The target process has exited (see supervise_loop())
+                if hasattr(self.child_process, 'connection_lost'):
+                    self.child_process.connection_lost()
+                break
+            except OSError as e:
+                logging.warning(f'out_of_process_proxy: {self.name} output pipe closed ({e})')
+                break
+            try:
+                self.handle_output(send_port_name, send_pdu)
+            except BaseException as e:
+                logging.warning(f'out_of_process_proxy: failed to issue PDU on port {send_port_name}: {e}')
+
+    def handle_output(self, port_name, pdu):
+        if port_name == OOP_CONTROL:
+            (command, argument) = pdu
+            if command == OOP_HEARTBEAT:
+                self.last_heartbeat_time = time.monotonic()
+                return
+            if command == OOP_READY:
+                self.startup_time = time.monotonic() - self.child_start_time
+                logging.info(f'out_of_process_proxy: {self.name} ready in {self.startup_time * 1000:.0f} ms '
+                    f'({argument * 1000:.0f} ms loading {".".join(self.oop_target)})')
+                self.target_ready.set()
+                return
+            if command == OOP_SNAPSHOT:
+                self.last_snapshot = argument
+            if self.awaiting_reply:
+                self.control_replies.put(pdu)
+        elif port_name == OOP_PEER:
+            self.proxy.route_peer_message(self.name, *pdu)
+        else:
+            self.proxy.issue_output_pdu(port_name, pdu)
+
+    def send_control_request(self, command):
+        # Replies that arrived while nobody was waiting are discarded before
+        # sending a request whose reply is to be waited for
+        while not self.control_replies.empty():
+            self.control_replies.get()
+        self.awaiting_reply = True
+        self.send_control(command)
+
+    def wait_for_control_reply(self, command, timeout):
+        # Wait for the target's reply to a control message, returning its
+        # argument, or None if there's no reply in time. Without the reader
+        # thread, output PDUs are issued while waiting.
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if self.output_thread:
+                    try:
+                        (reply_command, argument) = self.control_replies.get(timeout=remaining)
+                    except queue.Empty:
+                        return None
+                    if reply_command == command:
+                        return argument
+                elif self.proxy_output_pdu_pipe_end.poll(remaining):
+                    (send_port_name, send_pdu) = self.proxy_output_pdu_pipe_end.recv()
+                    if send_port_name == OOP_CONTROL and send_pdu[0] == command:
+                        self.handle_output(send_port_name, send_pdu)
+                        return send_pdu[1]
+                    self.handle_output(send_port_name, send_pdu)
+        finally:
+            self.awaiting_reply = False
+
+    def get_state_snapshot(self, timeout=2.0):
+        # Ask the target for its state snapshot; returns None if the target
+        # doesn't answer in time
+        self.send_control_request(OOP_SNAPSHOT)
+        snapshot = self.wait_for_control_reply(OOP_SNAPSHOT, timeout)
+        if snapshot is None:
+            logging.warning(f'out_of_process_proxy: no state snapshot from {self.name}')
+        return snapshot
+
+    def restore_state_snapshot(self, snapshot, timeout=2.0):
+        # Wait for the sender thread to pass this on, so that the target
+        # handles it before any PDU queued after it returns. It's also kept
+        # for a restarted target, until the target takes a newer snapshot.
+        self.last_snapshot = snapshot
+        self.control_sent.clear()
+        self.send_control(OOP_RESTORE, snapshot)
+        if not self.control_sent.wait(timeout):
+            logging.warning(f'out_of_process_proxy: timed out sending state snapshot to {self.name}')
+
+    def request_stop(self):
+        # The stop message follows any PDUs still queued
+        if not self.stopping:
+            self.stopping = True
+            if self.supervisor_thread:
+                self.supervisor_stop_event.set()
+            self.send_control(OOP_STOP)
+            self.input_queue.close()
+
+    def stop(self, timeout=2.0):
+        # Ask the target to exit its main loop, and terminate it if it doesn't
+        self.request_stop()
+        if self.supervisor_thread:
+            self.supervisor_thread.join()
+            self.supervisor_thread = None
         if self.child_process:
-            self.child_process.join()
+            if self.input_thread:
+                self.input_thread.join(timeout)
+            self.stop_target(timeout)
+
+
+class out_of_process_proxy():
+
+    def __init__(self, input_ports, output_ports, send_pdu_fn, params, send_pdus_fn=None):
+        logging.info('out_of_process_proxy: instantiating')
+
+        self.send_pdu_fn = send_pdu_fn
+        self.send_pdus_fn = send_pdus_fn
+
+        # With oop_raw_pdus=1, the front end interface hands us the PDU bytes
+        # as received rather than parsing them (see back_end_connection), and
+        # they're forwarded as is, so the target's receive_pdu() must accept
+        # bytes and decode them itself (see pdu_codec.decode_pdu()). This
+        # moves the parsing off the flowgraph process and saves pickling the
+        # parsed dictionary.
+        self.raw_pdus = params.get('oop_raw_pdus', '0') == '1'
+
+        # The targets can be split into shards, each running in its own
+        # process, so that a back end can use more than one core. oop_shards
+        # lists the shard names (colon-separated); each shard runs the class
+        # given by oop_target_<shard> and is sent the PDUs arriving on the
+        # input ports given by oop_ports_<shard> (colon-separated; a port may
+        # go to more than one shard, and ports not given for any shard go to
+        # the first). For example, to decode voice apart from the control
+        # channel and UI:
+        #   oop_shards=cc:voice,
+        #   oop_target_cc=scanner.p25_scanner.scanner_oop_ws.scanner_oop_ws,
+        #   oop_ports_cc=cc_pdus,
+        #   oop_target_voice=scanner.p25_scanner.scanner_oop_voice.scanner_oop_voice,
+        #   oop_ports_voice=tc_pdus
+        # Each target is told its shard name in the oop_shard parameter, and
+        # shards can send each other messages (see OOP_PEER). Without
+        # oop_shards, a single shard named 'main' runs oop_target and gets
+        # every port.
+        self.sharded = 'oop_shards' in params
+        if self.sharded:
+            shard_names = [name for name in params['oop_shards'].split(':') if name]
+            if len(shard_names) == 0:
+                raise ValueError('out_of_process_proxy: oop_shards must name at least one shard')
+        else:
+            shard_names = ['main']
+        shard_targets = dict()
+        shard_ports = dict()
+        for name in shard_names:
+            target_param = f'oop_target_{name}' if self.sharded else 'oop_target'
+            if target_param not in params:
+                raise KeyError(f'out_of_process_proxy: Required parameter \'{target_param}\' not specified')
+            shard_targets[name] = params[target_param].split('.')
+            if len(shard_targets[name]) < 2:
+                raise ValueError(f'out_of_process_proxy: {target_param} must be in module.class format')
+            shard_ports[name] = [port for port in
+                params.get(f'oop_ports_{name}', '').split(':') if port in input_ports]
+        for port in input_ports:
+            if not any([port in ports for ports in shard_ports.values()]):
+                shard_ports[shard_names[0]].append(port)
+
+        self.shards = dict()
+        self.port_shards = dict([(port, []) for port in input_ports])
+        for name in shard_names:
+            shard_params = dict(params, oop_shard=name)
+            self.shards[name] = oop_shard(self, name, shard_targets[name],
+                input_ports, output_ports, shard_ports[name], shard_params)
+            for port in shard_ports[name]:
+                self.port_shards[port].append(self.shards[name])
 
     def receive_pdu(self, port_name, data):
-        # Send the PDU to the target via the pipe
-        self.proxy_input_pdu_pipe_end.send((port_name, data))
-        # See if there are any PDUs from the target end we need to issue
-        if self.proxy_output_pdu_pipe_end.poll():
-            # TODO: this'll need some exception handling
-            (send_port_name, send_pdu) = self.proxy_output_pdu_pipe_end.recv()
-            self.send_pdu_fn(send_port_name, send_pdu)
+        for shard in self.port_shards[port_name]:
+            shard.put(port_name, data)
+
+    def receive_pdu_batch(self, port_name, pdus):
+        # Send the whole batch of PDUs (a list) to the target in one message
+        for shard in self.port_shards[port_name]:
+            shard.put(port_name, pdus)
+
+    def route_peer_message(self, source_name, destination_name, message):
+        # Called on a shard's reader thread for a message from its target
+        # to another shard (or all of them, if destination_name is None)
+        if destination_name is None:
+            destinations = [shard for (name, shard) in self.shards.items() if name != source_name]
+        elif destination_name in self.shards:
+            destinations = [self.shards[destination_name]]
+        else:
+            logging.warning(f'out_of_process_proxy: {source_name} sent a message to unknown shard {destination_name}')
+            return
+        for shard in destinations:
+            shard.send_peer_message(source_name, message)
+
+    def get_lane_stats(self):
+        # Lane statistics per port, or per shard and port if sharded
+        if not self.sharded:
+            return self.shards['main'].get_lane_stats()
+        return dict([(name, shard.get_lane_stats()) for (name, shard) in self.shards.items()])
+
+    def get_supervision_stats(self):
+        # Supervision counters, per shard if sharded
+        if not self.sharded:
+            return self.shards['main'].get_supervision_stats()
+        return dict([(name, shard.get_supervision_stats()) for (name, shard) in self.shards.items()])
+
+    def wait_until_ready(self, timeout=None):
+        # Returns whether all the targets are ready to accept PDUs
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return all([shard.wait_until_ready(None if deadline is None else
+            max(0, deadline - time.monotonic())) for shard in self.shards.values()])
+
+    def get_state_snapshot(self, timeout=2.0):
+        # Snapshots are kept per shard if sharded, and the requests are all
+        # sent before waiting for any of the replies
+        if not self.sharded:
+            return self.shards['main'].get_state_snapshot(timeout)
+        for shard in self.shards.values():
+            shard.send_control_request(OOP_SNAPSHOT)
+        deadline = time.monotonic() + timeout
+        snapshot = dict()
+        for (name, shard) in self.shards.items():
+            snapshot[name] = shard.wait_for_control_reply(OOP_SNAPSHOT,
+                max(0, deadline - time.monotonic()))
+            if snapshot[name] is None:
+                logging.warning(f'out_of_process_proxy: no state snapshot from {name}')
+        return snapshot
+
+    def restore_state_snapshot(self, snapshot, timeout=2.0):
+        if not self.sharded:
+            self.shards['main'].restore_state_snapshot(snapshot, timeout)
+            return
+        for (name, shard) in self.shards.items():
+            if snapshot.get(name) is not None:
+                shard.restore_state_snapshot(snapshot[name], timeout)
+
+    def stop(self, timeout=2.0):
+        # Ask all the targets to stop before waiting for any of them
+        for shard in self.shards.values():
+            shard.request_stop()
+        for shard in self.shards.values():
+            shard.stop(timeout)
+
+    def issue_output_pdu(self, port_name, pdu):
+        # A port name of None means pdu is a list of (port name, PDU) tuples to
+        # be sent back to back
+        if port_name is not None:
+            self.send_pdu_fn(port_name, pdu)
+        elif self.send_pdus_fn:
+            self.send_pdus_fn(pdu)
+        else:
+            for (batch_port_name, batch_pdu) in pdu:
+                self.send_pdu_fn(batch_port_name, batch_pdu)
+
+
+class latency_probe_target():
+    # Out of process target for the latency measurement below: it takes a
+    # couple of milliseconds to handle each PDU (as the scanner does to
+    # decode it and update its UI), and answers every PDU marked as a grant
+    # with a burst of a radio_gain PDU and a tc_offset PDU carrying the same
+    # sequence number
+    def __init__(self, input_ports, output_ports, input_pdu_pipe, output_pdu_pipe, params):
+        self.input_pdu_pipe = input_pdu_pipe
+        self.output_pdu_pipe = output_pdu_pipe
+
+    def main_loop(self):
+        while True:
+            (port, data) = self.input_pdu_pipe.recv()
+            if port == OOP_CONTROL:
+                if data[0] == OOP_STOP:
+                    break
+                continue
+            time.sleep(0.002)
+            if data.get('grant'):
+                self.output_pdu_pipe.send(('radio_gain', {'type': 'float', 'value': 0}))
+                self.output_pdu_pipe.send(('tc_offset',
+                    {'type': 'float', 'value': data['sequence']}))
 
 
 if __name__ == "__main__":
+    # Measure the time from a grant TSBK reaching the proxy to the resulting
+    # tc_offset PDU being handed to the front end (and from there to the
+    # DDC), with and without the output reader thread, and with the target
+    # hosted by oop_runner over TCP on the loopback interface. PDUs arrive at
+    # about the rate of TSBKs on a P25 control channel, and one in ten is a
+    # grant.
+    from scanner import oop_runner
     logging.basicConfig(level=logging.INFO)
     INPUT_PORTS = ['tc_pdus', 'cc_pdus']
     OUTPUT_PORTS = ['radio_freq', 'radio_gain', 'cc_offset', 'tc_offset']
-    tui = out_of_process_proxy(INPUT_PORTS, OUTPUT_PORTS, None,
-        {'site_file': '/tmp/trs_site_2_2022.csv',
-         'tg_file': '/tmp/trs_tg_2_enhanced_2022.csv',
-         'site_id': '1.7',
-         'oop_target': 'scanner.p25_scanner.ccmon_oop_ws.ccmon_oop_ws'})
\ No newline at end of file
+    PDU_INTERVAL = 0.04
+    GRANTS = 25
+
+    RUNNER_ADDRESS = 'tcp:127.0.0.1:7001'
+    RUNNER_AUTHKEY = 'benchmark'
+    runner = Process(target=oop_runner.serve,
+        args=(RUNNER_ADDRESS, ['__main__.latency_probe_target'], {}, RUNNER_AUTHKEY.encode()))
+    runner.start()
+    time.sleep(0.5)
+
+    for (transport, output_thread) in [('pipe', '0'), ('pipe', '1'), ('socket', '1')]:
+        grant_times = dict()
+        latencies = []
+
+        def send_pdu(port_name, pdu):
+            if port_name == 'tc_offset':
+                latencies.append(time.perf_counter() - grant_times[pdu['value']])
+
+        proxy = out_of_process_proxy(INPUT_PORTS, OUTPUT_PORTS, send_pdu,
+            {'oop_target': '__main__.latency_probe_target',
+             'oop_output_thread': output_thread,
+             'oop_transport': transport,
+             'oop_address': RUNNER_ADDRESS,
+             'oop_authkey': RUNNER_AUTHKEY})
+        for sequence in range(GRANTS * 10):
+            grant = (sequence % 10 == 0)
+            if grant:
+                grant_times[sequence] = time.perf_counter()
+            proxy.receive_pdu('cc_pdus', {'grant': grant, 'sequence': sequence})
+            time.sleep(PDU_INTERVAL)
+        proxy.stop()
+        latencies.sort()
+        print(f'{transport}, output thread {output_thread}: grant to tc_offset median '
+            f'{latencies[len(latencies) // 2] * 1000:.2f} ms, '
+            f'max {latencies[-1] * 1000:.2f} ms ({len(latencies)} of {GRANTS})')
+    runner.terminate()
+
+    # Measure the time from creating the proxy to its target being ready
+    # for PDUs with each start method, with and without preloading
+    PROBE_TARGET = 'scanner.out_of_process_proxy.latency_probe_target'
+    for start_method in multiprocessing.get_all_start_methods():
+        for preload in ['', 'scanner.out_of_process_proxy']:
+            start = time.perf_counter()
+            proxy = out_of_process_proxy(INPUT_PORTS, OUTPUT_PORTS, lambda port_name, pdu: None,
+                {'oop_target': PROBE_TARGET,
+                 'oop_start_method': start_method,
+                 'oop_preload': preload})
+            ready = proxy.wait_until_ready(10.0)
+            elapsed = time.perf_counter() - start
+            proxy.stop()
+            print(f'{start_method}, preload {preload or "none"}: ready {ready} after {elapsed * 1000:.1f} ms')
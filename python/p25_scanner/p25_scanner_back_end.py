@@ -22,7 +22,20 @@
 from enum import Enum
 import ctypes
 import logging
+import time
 from multiprocessing import Process, Pipe
+from scanner import pdu_codec
+from scanner import pdu_log
+from scanner import pdu_stats
+
+# numpy is only needed to decode TSBKs in batches (see decode_tsbk_batch())
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TRACE_TSBK = pdu_log.register_trace_event('tsbk')
+TRACE_MBT = pdu_log.register_trace_event('mbt')
 
 # Master list of TSBK OSPs
 class tsbk_osps(Enum):
@@ -106,6 +119,7 @@ class tsbk_osps(Enum):
 #   Key is the tsbk_osps enumeration name (string)
 #   Value is a dictionary with key being the parameter name and the value
 #   being how to calculate the value for the parameter
+# Reserved opcodes have no parameters and so no entry.
 tsbk_osp_decoders = {
     'OSP_GRP_V_CHANNEL_GRANT': {
         'service_opts': [(2, 0xff, 0)],
@@ -127,6 +141,285 @@ tsbk_osp_decoders = {
             self.system.channel_to_freq((data[6] << 8) | data[7]),
         'group1': [(8, 0xff, 0), (9, 0xff, 0)],
     },
+    'OSP_GRP_V_CHANNEL_GRANT_UPDATE_EXPLICIT': {
+        'service_opts': [(2, 0xff, 0)],
+        'freq_tx': lambda self, data:
+            self.system.channel_to_freq((data[4] << 8) | data[5]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[6] << 8) | data[7]),
+        'group': [(8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_UU_V_CHANNEL_GRANT': {
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[2] << 8) | data[3]),
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_UU_ANSWER_REQUEST': {
+        'service_opts': [(2, 0xff, 0)],
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_UU_V_CHANNEL_GRANT_UPDATE': {
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[2] << 8) | data[3]),
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_TEL_V_CHANNEL_GRANT': {
+        'service_opts': [(2, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[3] << 8) | data[4]),
+        # In units of 100 ms
+        'call_timer': [(5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_TEL_V_CHANNEL_GRANT_UPDATE': {
+        'service_opts': [(2, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[3] << 8) | data[4]),
+        'call_timer': [(5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_TEL_ANSWER_REQUEST': {
+        # Ten BCD digits
+        'digits': [(2, 0xff, 0), (3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_INDIVIDUAL_DATA_CHANNEL_GRANT': {
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[2] << 8) | data[3]),
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_GRP_DATA_CHANNEL_GRANT': {
+        'service_opts': [(2, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[3] << 8) | data[4]),
+        'group': [(5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_GRP_DATA_CHANNEL_ANN': {
+        'freq0': lambda self, data:
+            self.system.channel_to_freq((data[2] << 8) | data[3]),
+        'group0': [(4, 0xff, 0), (5, 0xff, 0)],
+        'freq1': lambda self, data:
+            self.system.channel_to_freq((data[6] << 8) | data[7]),
+        'group1': [(8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_GRP_DATA_CHANNEL_ANN_EXPLICIT': {
+        'service_opts': [(2, 0xff, 0)],
+        'freq_tx': lambda self, data:
+            self.system.channel_to_freq((data[4] << 8) | data[5]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[6] << 8) | data[7]),
+        'group': [(8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_SNDCP_DATA_CHANNEL_GRANT': {
+        'service_opts': [(2, 0xff, 0)],
+        'freq_tx': lambda self, data:
+            self.system.channel_to_freq((data[3] << 8) | data[4]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[5] << 8) | data[6]),
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_SNDCP_DATA_PAGE_REQUEST': {
+        'service_opts': [(2, 0xff, 0)],
+        'access_control': [(3, 0xff, 0), (4, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_SNDCP_DATA_CHANNEL_ANN_EXPLICIT': {
+        'service_opts': [(2, 0xff, 0)],
+        'autonomous_access': [(3, 0x80, 7)],
+        'requested_access': [(3, 0x40, 6)],
+        'freq_tx': lambda self, data:
+            self.system.channel_to_freq((data[4] << 8) | data[5]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[6] << 8) | data[7]),
+        'access_control': [(8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_STS_UPDATE': {
+        'unit_status': [(2, 0xff, 0)],
+        'user_status': [(3, 0xff, 0)],
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_STS_QUERY': {
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_MESSAGE_UPDATE': {
+        'message': [(2, 0xff, 0), (3, 0xff, 0)],
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_RADIO_UNIT_MONITOR_COMMAND': {
+        'tx_time': [(2, 0xff, 0)],
+        'silent_mode': [(3, 0x80, 7)],
+        'tx_multiplier': [(3, 0x03, 0)],
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_CALL_ALERT': {
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_ACKNOWLEDGE_RESPONSE': {
+        'aiv': [(2, 0x80, 7)],
+        'ex': [(2, 0x40, 6)],
+        'service_type': [(2, 0x3f, 0)],
+        # Source address, or WACN and system ID if ex is set
+        'additional_info': [(3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_QUEUED_RESPONSE': {
+        'aiv': [(2, 0x80, 7)],
+        'service_type': [(2, 0x3f, 0)],
+        'reason': [(3, 0xff, 0)],
+        'additional_info': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_EXTENDED_FUNCTION_COMMAND': {
+        'function': [(2, 0xff, 0), (3, 0xff, 0)],
+        'arguments': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_DENY_RESPONSE': {
+        'aiv': [(2, 0x80, 7)],
+        'service_type': [(2, 0x3f, 0)],
+        'reason': [(3, 0xff, 0)],
+        'additional_info': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_GRP_AFFILIATION_RESPONSE': {
+        'local_global': [(2, 0x80, 7)],
+        'affiliation_value': [(2, 0x03, 0)],
+        'announcement_group': [(3, 0xff, 0), (4, 0xff, 0)],
+        'group': [(5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_SECONDARY_CONTROL_CHANNEL_BROADCAST_EXPLICIT': {
+        'rfss_id': [(2, 0xff, 0)],
+        'site_id': [(3, 0xff, 0)],
+        'freq_tx': lambda self, data:
+            self.system.channel_to_freq((data[4] << 8) | data[5]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[7] << 8) | data[8]),
+        'service_class': [(9, 0xff, 0)]
+    },
+    'OSP_GRP_AFFILIATION_QUERY': {
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_LOCATION_REG_RESPONSE': {
+        'registration_value': [(2, 0x03, 0)],
+        'group': [(3, 0xff, 0), (4, 0xff, 0)],
+        'rfss_id': [(5, 0xff, 0)],
+        'site_id': [(6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_UNIT_REG_RESPONSE': {
+        'registration_value': [(2, 0x30, 4)],
+        'system_id': [(2, 0x0f, 0), (3, 0xff, 0)],
+        'source_id': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_UNIT_REG_COMMAND': {
+        'target': [(4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_AUTH_COMMAND': {
+        # If the key is a tuple, it is the offset of the first bit (counting
+        # from the most significant bit of byte 0) and the number of bits,
+        # for parameters that don't start or end on a byte boundary
+        'wacn': (16, 20),
+        'system_id': [(4, 0x0f, 0), (5, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_UNIT_DEREG_ACKNOWLEDGE': {
+        'wacn': (24, 20),
+        'system_id': [(5, 0x0f, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_TDMA_SYNC_BROADCAST': {
+        'us': (28, 1),
+        'ist': (29, 1),
+        'mm': (30, 1),
+        'mc': (31, 2),
+        'vl': (33, 1),
+        'local_time_offset': (34, 6),
+        'year': (40, 7),
+        'month': (47, 4),
+        'day': (51, 5),
+        'hours': (56, 5),
+        'minutes': (61, 6),
+        'micro_slots': (67, 13)
+    },
+    'OSP_AUTH_DEMAND': {
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_AUTH_FNE_RESPONSE': {
+        'result': [(3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_IDENT_UPDATE_TDMA': {
+        'identifier': [(2, 0xf0, 4)],
+        'channel_type': [(2, 0x0f, 0)],
+        'tx_offset': (24, 14),
+        # In units of 125 Hz
+        'spacing': [(4, 0x03, 0), (5, 0xff, 0)],
+        # In units of 5 Hz
+        'base': [(6, 0xff, 0), (7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_IDENT_UPDATE_VHF_UHF_BANDS': {
+        'identifier': [(2, 0xf0, 4)],
+        'bandwidth': [(2, 0x0f, 0)],
+        'tx_offset': (24, 14),
+        'spacing': [(4, 0x03, 0), (5, 0xff, 0)],
+        'base': [(6, 0xff, 0), (7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_TIME_DATE_ANN': {
+        'vd': (16, 1),
+        'vt': (17, 1),
+        'vl': (18, 1),
+        'local_time_offset': (19, 13),
+        'month': (32, 4),
+        'day': (36, 5),
+        'year': (41, 13),
+        # The date ends with 2 reserved bits
+        'hours': (56, 5),
+        'minutes': (61, 6),
+        'seconds': (67, 6)
+    },
+    'OSP_ROAMING_ADDRESS_COMMAND': {
+        'stack_operation': [(2, 0xff, 0)],
+        'wacn': (24, 20),
+        'system_id': [(5, 0x0f, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_ROAMING_ADDRESS_UPDATE': {
+        'last_message': [(2, 0x80, 7)],
+        'message_sequence': [(2, 0x0f, 0)],
+        'wacn': (24, 20),
+        'system_id': [(5, 0x0f, 0), (6, 0xff, 0)],
+        'source': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_SYSTEM_SERVICE_BROADCAST': {
+        'twuid_validity': [(2, 0xff, 0)],
+        'services_available': [(3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0)],
+        'services_supported': [(6, 0xff, 0), (7, 0xff, 0), (8, 0xff, 0)],
+        'request_priority': [(9, 0xff, 0)]
+    },
+    'OSP_SECONDARY_CONTROL_CHANNEL_BROADCAST': {
+        'rfss_id': [(2, 0xff, 0)],
+        'site_id': [(3, 0xff, 0)],
+        'freq0': lambda self, data:
+            self.system.channel_to_freq((data[4] << 8) | data[5]),
+        'service_class0': [(6, 0xff, 0)],
+        'freq1': lambda self, data:
+            self.system.channel_to_freq((data[7] << 8) | data[8]),
+        'service_class1': [(9, 0xff, 0)],
+    },
     'OSP_RFSS_STS_BROADCAST': {
         'lra': [(2, 0xff, 0)],
         'active_network_connection': [(3, 0x10, 4)],
@@ -137,6 +430,14 @@ tsbk_osp_decoders = {
             self.system.channel_to_freq((data[7] << 8) | data[8]),
         'service_class': [(9, 0xff, 0)]
     },
+    'OSP_NETWORK_STS_BROADCAST': {
+        'lra': [(2, 0xff, 0)],
+        'wacn': (24, 20),
+        'system_id': [(5, 0x0f, 0), (6, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[7] << 8) | data[8]),
+        'service_class': [(9, 0xff, 0)]
+    },
     'OSP_ADJACENT_STS_BROADCAST': {
         'lra': [(2, 0xff, 0)],
         'cfva': [(3, 0xf0, 4)],
@@ -147,15 +448,33 @@ tsbk_osp_decoders = {
             self.system.channel_to_freq((data[7] << 8) | data[8]),
         'service_class': [(9, 0xff, 0)]
     },
-    'OSP_SECONDARY_CONTROL_CHANNEL_BROADCAST': {
-        'rfss_id': [(2, 0xff, 0)],
-        'site_id': [(3, 0xff, 0)],
-        'freq0': lambda self, data:
-            self.system.channel_to_freq((data[4] << 8) | data[5]),
-        'service_class0': [(6, 0xff, 0)],
-        'freq1': lambda self, data:
-            self.system.channel_to_freq((data[7] << 8) | data[8]),
-        'service_class1': [(9, 0xff, 0)],
+    'OSP_IDENT_UPDATE': {
+        'identifier': [(2, 0xf0, 4)],
+        'bandwidth': (20, 9),
+        'tx_offset': (29, 9),
+        'spacing': [(4, 0x03, 0), (5, 0xff, 0)],
+        'base': [(6, 0xff, 0), (7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_PROT_PARAMETER_BROADCAST': {
+        'algorithm_id': [(7, 0xff, 0)],
+        'key_id': [(8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_PROT_PARAMETER_UPDATE': {
+        'algorithm_id': [(4, 0xff, 0)],
+        'key_id': [(5, 0xff, 0), (6, 0xff, 0)],
+        'target': [(7, 0xff, 0), (8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_MOTOROLA_PATCH_GRP_ADD': {
+        'supergroup': [(2, 0xff, 0), (3, 0xff, 0)],
+        'group0': [(4, 0xff, 0), (5, 0xff, 0)],
+        'group1': [(6, 0xff, 0), (7, 0xff, 0)],
+        'group2': [(8, 0xff, 0), (9, 0xff, 0)]
+    },
+    'OSP_MOTOROLA_PATCH_GRP_DELETE': {
+        'supergroup': [(2, 0xff, 0), (3, 0xff, 0)],
+        'group0': [(4, 0xff, 0), (5, 0xff, 0)],
+        'group1': [(6, 0xff, 0), (7, 0xff, 0)],
+        'group2': [(8, 0xff, 0), (9, 0xff, 0)]
     },
     'OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT': {
         'service_opts': [(2, 0xff, 0)],
@@ -171,10 +490,252 @@ tsbk_osp_decoders = {
         'freq1': lambda self, data:
             self.system.channel_to_freq((data[6] << 8) | data[7]),
         'group1': [(8, 0xff, 0), (9, 0xff, 0)],
+    },
+    'OSP_MOTOROLA_TRAFFIC_CHANNEL_ID': {
+        # Eight 6-bit characters
+        'callsign': [(2, 0xff, 0), (3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0), (7, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[8] << 8) | data[9])
+    },
+    # The layouts of these Motorola OSPs aren't known, so their messages
+    # have no parameters; handlers can still read the bytes (message.data)
+    'OSP_MOTOROLA_DENY_RESPONSE': {},
+    'OSP_MOTOROLA_SYSTEM_LOADING': {},
+    'OSP_MOTOROLA_BASE_STATION_ID': {
+        'callsign': [(2, 0xff, 0), (3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0), (6, 0xff, 0), (7, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[8] << 8) | data[9])
+    },
+    'OSP_MOTOROLA_CONTROL_CHANNEL_PLANNED_SHUTDOWN': {}
+}
+
+
+def compile_osp_param(param_value):
+    # Source of an expression working out a parameter from data, given its
+    # entry in tsbk_osp_decoders; for a lambda, this is None
+    if callable(param_value):
+        return None
+    if isinstance(param_value, tuple):
+        # The bytes the bits span, as one big-endian value, shifted right to
+        # drop the bits after them and masked to drop the bits before them
+        (first_bit, bit_count) = param_value
+        first_byte = first_bit // 8
+        last_byte = (first_bit + bit_count - 1) // 8
+        parts = [f'(data[{offset}] << {8 * (last_byte - offset)})' if offset < last_byte else f'data[{offset}]'
+            for offset in range(first_byte, last_byte + 1)]
+        value = f'({" | ".join(parts)})' if len(parts) > 1 else parts[0]
+        shift = 8 * (last_byte + 1) - (first_bit + bit_count)
+        if shift > 0:
+            value = f'({value} >> {shift})'
+        if first_bit % 8:
+            value = f'({value} & {(1 << bit_count) - 1:#x})'
+        return value
+    # Each byte's value is shifted as given, then left by 8 bits for every
+    # byte that follows it, and the results ORed together
+    parts = []
+    for (index, (offset, mask, shift)) in enumerate(param_value):
+        part = f'data[{offset}]' if mask == 0xff else f'(data[{offset}] & {mask:#04x})'
+        if shift > 0:
+            part = f'({part} >> {shift})'
+        elif shift < 0:
+            part = f'({part} << {-shift})'
+        following_bits = 8 * (len(param_value) - 1 - index)
+        if following_bits > 0:
+            part = f'({part} << {following_bits})'
+        parts.append(part)
+    return ' | '.join(parts) if parts else '0'
+
+
+def compile_osp_decoder(osp_name, decoder, table_name='tsbk_osp_decoders'):
+    # Compile an OSP's entry in tsbk_osp_decoders into a function taking
+    # (self, data) and returning a dictionary of its parameters, so the table
+    # isn't interpreted for every TSBK. Byte offset lists become a single
+    # expression, e.g. [(5, 0xff, 0), (6, 0xff, 0)] becomes
+    # (data[5] << 8) | data[6], and lambdas are called as they are.
+    namespace = dict()
+    params = []
+    for (param_name, param_value) in decoder.items():
+        value = compile_osp_param(param_value)
+        if value is None:
+            function_name = f'param_{len(namespace)}'
+            namespace[function_name] = param_value
+            value = f'{function_name}(self, data)'
+        params.append(f'{param_name!r}: {value}')
+    source = f'def decode_{osp_name}(self, data):\n    return {{{", ".join(params)}}}\n'
+    exec(compile(source, f'<{table_name}[{osp_name!r}]>', 'exec'), namespace)
+    return namespace[f'decode_{osp_name}']
+
+
+# Compiled decoders for the OSPs in tsbk_osp_decoders, keyed by OSP name
+tsbk_osp_compiled_decoders = dict([(osp_name, compile_osp_decoder(osp_name, decoder))
+    for (osp_name, decoder) in tsbk_osp_decoders.items()])
+
+
+class osp_message():
+    # What OSP handlers are given: the TSBK (or MBT PDU) bytes and the
+    # p25_scanner that dispatched them, with each parameter a property of
+    # the OSP's message class (see compile_osp_message()) that is decoded
+    # when it is read, so parameters a handler doesn't look at cost nothing. Parameters worked
+    # out by a lambda (e.g. frequencies) are decoded once and kept; the
+    # others are cheap enough to decode on every read. Messages are only
+    # meant to be read by the handler: a frequency read later on uses the
+    # identifier table as it is then.
+    __slots__ = ['scanner', 'data']
+    name = None
+    fields = ()
+
+    def __init__(self, scanner, data):
+        self.scanner = scanner
+        self.data = data
+
+    def decode(self):
+        return dict([(field, getattr(self, field)) for field in self.fields])
+
+    def __repr__(self):
+        return f'{self.name}({", ".join([f"{field}={value}" for (field, value) in self.decode().items()])})'
+
+
+def compile_osp_message(osp_name, decoder, table_name='tsbk_osp_decoders'):
+    # Compile an OSP's entry in tsbk_osp_decoders into an osp_message
+    # subclass with a property per parameter, using the same expressions as
+    # compile_osp_decoder()
+    namespace = {'osp_message': osp_message}
+    cached = [param_name for (param_name, param_value) in decoder.items() if callable(param_value)]
+    lines = [
+        f'class {osp_name}(osp_message):',
+        f'    __slots__ = {[f"_{param_name}" for param_name in cached]!r}',
+        f'    name = {osp_name!r}',
+        f'    fields = {tuple(decoder)!r}'
+    ]
+    if cached:
+        lines += ['    def __init__(self, scanner, data):',
+            '        self.scanner = scanner',
+            '        self.data = data']
+        lines += [f'        self._{param_name} = None' for param_name in cached]
+    for (param_name, param_value) in decoder.items():
+        lines += ['    @property', f'    def {param_name}(self):']
+        value = compile_osp_param(param_value)
+        if value is None:
+            function_name = f'param_{len(namespace)}'
+            namespace[function_name] = param_value
+            lines += [f'        value = self._{param_name}',
+                '        if value is None:',
+                f'            value = self._{param_name} = {function_name}(self.scanner, self.data)',
+                '        return value']
+        else:
+            lines += ['        data = self.data', f'        return {value}']
+    exec(compile('\n'.join(lines) + '\n', f'<{table_name}[{osp_name!r}]>', 'exec'), namespace)
+    return namespace[osp_name]
+
+
+# Message classes for the OSPs in tsbk_osp_decoders, keyed by OSP name
+tsbk_osp_messages = dict([(osp_name, compile_osp_message(osp_name, decoder))
+    for (osp_name, decoder) in tsbk_osp_decoders.items()])
+
+
+class osp_descriptor():
+    # What handle_tsbk() needs to know about an (opcode, vendor) pair: the
+    # tsbk_osps member (None if unknown) and its name, the compiled decoder
+    # and message class (None if it isn't in tsbk_osp_decoders), and the
+    # handler it's dispatched to, which is bound per p25_scanner instance
+    # (see p25_scanner.bind_osp_handlers()). Handlers are given an
+    # osp_message.
+    __slots__ = ['osp', 'name', 'decoder', 'message', 'handler']
+
+    def __init__(self, osp, decoder, message=None, handler=None):
+        self.osp = osp
+        self.name = osp.name if osp else None
+        self.decoder = decoder
+        self.message = message
+        self.handler = handler
+
+
+def osp_index(opcode, vendor):
+    return (opcode << 8) | vendor
+
+
+# Descriptors indexed by osp_index(opcode, vendor), so that a TSBK's OSP is
+# found with one list lookup; every unknown pair shares UNKNOWN_OSP
+UNKNOWN_OSP = osp_descriptor(None, None)
+
+
+def make_osp_table(compiled_decoders, messages):
+    table = [UNKNOWN_OSP] * osp_index(64, 0)
+    for osp in tsbk_osps:
+        table[osp_index(*osp.value)] = osp_descriptor(osp, compiled_decoders.get(osp.name),
+            messages.get(osp.name))
+    return table
+
+
+tsbk_osp_table = make_osp_table(tsbk_osp_compiled_decoders, tsbk_osp_messages)
+
+
+# Describe decoding details for OSPs sent as alternate format multi-block
+# trunking (MBT) PDUs, in the same way as tsbk_osp_decoders; offsets are into
+# the whole PDU, i.e. the header block (bytes 0-11, with the source or
+# system address in bytes 3-5, the opcode in byte 7, and two bytes of
+# arguments in bytes 8-9) followed by the data blocks (from byte 12, the
+# last ending with a CRC). Parameters have the same names as in the TSBK
+# form of the OSP so that the same handlers work for both; freq is the
+# transmit (i.e. downlink) channel, and freq_rx the receive channel.
+# Only the OSPs that systems commonly send as MBTs rather than TSBKs are
+# described.
+mbt_osp_decoders = {
+    'OSP_GRP_V_CHANNEL_GRANT': {
+        'service_opts': [(8, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[14] << 8) | data[15]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[16] << 8) | data[17]),
+        'group': [(18, 0xff, 0), (19, 0xff, 0)],
+        'source': [(3, 0xff, 0), (4, 0xff, 0), (5, 0xff, 0)]
+    },
+    'OSP_RFSS_STS_BROADCAST': {
+        'lra': [(3, 0xff, 0)],
+        'active_network_connection': [(4, 0x10, 4)],
+        'system_id': [(4, 0x0f, 0), (5, 0xff, 0)],
+        'rfss_id': [(12, 0xff, 0)],
+        'site_id': [(13, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[14] << 8) | data[15]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[16] << 8) | data[17]),
+        'service_class': [(18, 0xff, 0)]
+    },
+    'OSP_NETWORK_STS_BROADCAST': {
+        'lra': [(3, 0xff, 0)],
+        'wacn': (96, 20),
+        'system_id': [(14, 0x0f, 0), (15, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[16] << 8) | data[17]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[18] << 8) | data[19]),
+        # Octet 8 of the first data block (data[12:24])
+        'service_class': [(20, 0xff, 0)]
+    },
+    'OSP_ADJACENT_STS_BROADCAST': {
+        'lra': [(3, 0xff, 0)],
+        'cfva': [(4, 0xf0, 4)],
+        'system_id': [(4, 0x0f, 0), (5, 0xff, 0)],
+        'rfss_id': [(8, 0xff, 0)],
+        'site_id': [(9, 0xff, 0)],
+        'freq': lambda self, data:
+            self.system.channel_to_freq((data[12] << 8) | data[13]),
+        'freq_rx': lambda self, data:
+            self.system.channel_to_freq((data[14] << 8) | data[15]),
+        'service_class': [(16, 0xff, 0)]
     }
 }
 
 
+# Compiled decoders, message classes and descriptors for MBTs, as for TSBKs
+mbt_osp_compiled_decoders = dict([(osp_name, compile_osp_decoder(osp_name, decoder, 'mbt_osp_decoders'))
+    for (osp_name, decoder) in mbt_osp_decoders.items()])
+mbt_osp_messages = dict([(osp_name, compile_osp_message(osp_name, decoder, 'mbt_osp_decoders'))
+    for (osp_name, decoder) in mbt_osp_decoders.items()])
+mbt_osp_table = make_osp_table(mbt_osp_compiled_decoders, mbt_osp_messages)
+
+
 class trunked_system():
     @staticmethod
     def parse_csv_line(line):
@@ -252,6 +813,101 @@ class trunked_system():
         self.idents = dict()
 
 
+class batch_trunked_system():
+    # trunked_system.channel_to_freq() on a column of channel numbers, so the
+    # lambdas in tsbk_osp_decoders work on a whole batch of TSBKs at once
+    def __init__(self, system):
+        self.known = numpy.zeros(16, dtype=bool)
+        self.bases = numpy.zeros(16, dtype=numpy.int64)
+        self.spacings = numpy.zeros(16, dtype=numpy.int64)
+        for (identifier, ident) in system.idents.items():
+            self.known[identifier] = True
+            self.bases[identifier] = ident['base']
+            self.spacings[identifier] = ident['spacing']
+
+    def channel_to_freq(self, channel):
+        identifier = (channel & 0xf000) >> 12
+        channel = (channel & 0x0fff)
+        return numpy.where(self.known[identifier],
+            self.bases[identifier] + channel * self.spacings[identifier], 0)
+
+
+class batch_decoder_context():
+    # Stands in for the p25_scanner the compiled decoders are normally given
+    def __init__(self, system):
+        self.system = batch_trunked_system(system)
+
+
+def decode_tsbk_batch(tsbks, system=None):
+    # Decode an (N, 12) uint8 array of TSBKs in one go, e.g. to replay or
+    # analyse a capture offline. The compiled decoders are
+    # evaluated on columns of bytes rather than on one TSBK's bytes, so each
+    # parameter is worked out for all the TSBKs of an OSP with a few numpy
+    # operations. Returns a dictionary of columns of N values:
+    #   opcode, vendor, protected, and osp (the osp_index(), which indexes
+    #   tsbk_osp_table), then every parameter in tsbk_osp_decoders, holding
+    #   -1 for TSBKs whose OSP doesn't have that parameter (or is protected)
+    # Identifier updates in the batch are added to the given trunked_system
+    # in row order, so only later TSBKs' frequencies use them.
+    if numpy is None:
+        raise RuntimeError('p25_scanner: decoding TSBKs in batches needs numpy')
+    tsbks = numpy.asarray(tsbks, dtype=numpy.uint8)
+    if tsbks.ndim != 2 or tsbks.shape[1] != 12:
+        raise ValueError(f'p25_scanner: TSBK batch must have shape (N, 12), not {tsbks.shape}')
+    if system is None:
+        system = trunked_system()
+
+    # One row per byte offset, so data[offset] in a decoder is a column
+    data = tsbks.T.astype(numpy.int64)
+    opcode = data[0] & 0x3f
+    vendor = data[1]
+    index = (opcode << 8) | vendor
+    protected = (data[0] & 0x40) != 0
+    batch = {
+        'opcode': opcode,
+        'vendor': vendor,
+        'protected': protected,
+        'osp': index
+    }
+
+    # Identifier updates are applied in row order, as p25_scanner.OSP_IDENT_UPDATE()
+    # applies them: the batch is decoded in segments, each ending at an
+    # update that changes the identifier table, so each TSBK's frequencies
+    # are worked out with the identifiers known when it was sent
+    ident_indices = [osp_index(*osp.value) for osp in
+        [tsbk_osps.OSP_IDENT_UPDATE, tsbk_osps.OSP_IDENT_UPDATE_VHF_UHF_BANDS]]
+    ident_rows = numpy.flatnonzero(~protected & numpy.isin(index, ident_indices))
+    context = batch_decoder_context(system)
+    # Both OSPs have their identifier, base and spacing in the same bits
+    updates = tsbk_osp_compiled_decoders['OSP_IDENT_UPDATE'](context, data[:, ident_rows])
+    start = 0
+    for (row, identifier, base, spacing) in zip(ident_rows.tolist(), updates['identifier'].tolist(),
+            updates['base'].tolist(), updates['spacing'].tolist()):
+        if system.idents.get(identifier) == {'base': base * 5, 'spacing': spacing * 125}:
+            continue
+        decode_tsbk_batch_rows(batch, data, context, start, row + 1)
+        system.add_identifier(identifier, base * 5, spacing * 125)
+        context = batch_decoder_context(system)
+        start = row + 1
+    decode_tsbk_batch_rows(batch, data, context, start, len(tsbks))
+    return batch
+
+
+def decode_tsbk_batch_rows(batch, data, context, start, end):
+    # Decode rows start to end (exclusive) of a batch, OSP by OSP
+    index = batch['osp'][start:end]
+    decoded = ~batch['protected'][start:end]
+    for osp_value in numpy.unique(index[decoded]).tolist():
+        descriptor = tsbk_osp_table[osp_value]
+        if descriptor.decoder is None:
+            continue
+        rows = start + numpy.flatnonzero(decoded & (index == osp_value))
+        for (param_name, values) in descriptor.decoder(context, data[:, rows]).items():
+            if param_name not in batch:
+                batch[param_name] = numpy.full(data.shape[1], -1, dtype=numpy.int64)
+            batch[param_name][rows] = values
+
+
 class p25_scanner():
     class scanner_state(Enum):
         TUNE_RADIO = 0
@@ -270,91 +926,118 @@ class p25_scanner():
         duid = 0
         ok = False
         if is_du:
-            nac = int(du['p25_du'].get('nac', 0x0), 16)
-            duid = int(du['p25_du'].get('duid', 0x0), 16)
+            nac = pdu_codec.du_int(du['p25_du'].get('nac', 0x0))
+            duid = pdu_codec.du_int(du['p25_du'].get('duid', 0x0))
             ok = du['p25_du'].get('ok', 0) > 0
         return (is_du, nac, duid, ok)
 
-    # Decode the OSP and dispatch to a handler if one exists
-    # Note that if we get here, we know osp_name is in tsbk_osp_decoders
-    def dispatch_osp(self, osp_name, osp_data):
-        param_map = dict()
-        # For each parameter in the decoder...
-        for param_name in tsbk_osp_decoders[osp_name].keys():
-            # ...determine how to get its value from osp_data
-            param_value = tsbk_osp_decoders[osp_name][param_name]
-            # If it's a lambda, just invoke the callable
-            if callable(param_value):
-                param_map[param_name] = param_value(self, osp_data)
-            else:
-                # Otherwise, execute the secret decoder ring
-                value = 0
-                for (offset, mask, shift) in param_value:
-                    value <<= 8
-                    partial_value = (osp_data[offset] & mask)
-                    if shift > 0:
-                        partial_value >>= shift
-                    else:
-                        partial_value <<= -shift
-                    value |= partial_value
-                param_map[param_name] = value
-        # See if the function exists, or if OSP_GENERIC exists
-        # (prefer the specific function though)
+    def bind_osp_table(self, table):
+        # Copy an OSP table, binding each decoded OSP to the method of the
+        # same name if there is one, or else OSP_GENERIC if that exists;
+        # OSPs with neither are neither decoded nor dispatched
+        bound_table = list(table)
+        for osp in tsbk_osps:
+            index = osp_index(*osp.value)
+            descriptor = table[index]
+            if descriptor.message is None:
+                continue
+            handler = getattr(self, descriptor.name, getattr(self, 'OSP_GENERIC', None))
+            if handler is not None:
+                bound_table[index] = osp_descriptor(descriptor.osp, descriptor.decoder,
+                    descriptor.message, handler)
+        return bound_table
+
+    def bind_osp_handlers(self):
+        # OSPs arrive as TSBKs or as MBTs, and are handled the same way
+        self.osp_table = self.bind_osp_table(tsbk_osp_table)
+        self.mbt_osp_table = self.bind_osp_table(mbt_osp_table)
+
+    # Dispatch the OSP to its handler as a message, which decodes parameters
+    # as they are read
+    # Note that if we get here, we know the OSP has a handler
+    def dispatch_osp(self, descriptor, osp_data):
+        message = descriptor.message(self, osp_data)
         try:
-            if hasattr(self, osp_name):
-                getattr(self, osp_name)(**param_map)
-            elif hasattr(self, 'OSP_GENERIC'):
-                getattr(self, 'OSP_GENERIC')({osp_name: param_map})
+            descriptor.handler(message)
         except BaseException as e:
-            logging.warning(f'p25_scanner: failed to invoke {osp_name} with {param_map}: {e}')
+            logging.warning(f'p25_scanner: failed to invoke {descriptor.name} with {message}: {e}')
 
     def handle_tsbk(self, tsbk_buffer):
         if bool(tsbk_buffer[0] & 0x40):
             logging.info(f'p25_scanner: protected TSBK')
             return
+        if not self.first_tsbk_logged:
+            self.first_tsbk_logged = True
+            logging.info(f'p25_scanner: first TSBK {(time.monotonic() - self.start_time) * 1000:.0f} ms after instantiation')
 
         # Decode TSBK details and dispatch to subclass if possible
         opcode = tsbk_buffer[0] & 0x3f
         vendor = tsbk_buffer[1]
 
         # Identify and log the OSP if desired
-        osp_name = ''
-        known_osp = True
-        try:
-            osp = tsbk_osps((opcode, vendor))
-            osp_name = osp.name
-        except ValueError:
-            osp_name = f'OSP_OPCODE_{opcode:02X}_VENDOR_{vendor:02X}'
-            known_osp = False
-        if logging.getLogger().level <= logging.DEBUG:
-            osp_bytes = ' '.join([f'{byte:02x}' for byte in tsbk_buffer[2:10]])
-            logging.info(f'{osp_name:<50s} {osp_bytes}')
-        if not known_osp:
+        descriptor = self.osp_table[(opcode << 8) | vendor]
+        pdu_log.trace(TRACE_TSBK, opcode, vendor)
+        if self.log.is_enabled_for(logging.DEBUG):
+            osp_name = descriptor.name or f'OSP_OPCODE_{opcode:02X}_VENDOR_{vendor:02X}'
+            self.log.sampled(logging.DEBUG, osp_name, '%-50s %s', osp_name,
+                pdu_log.hex_bytes(tsbk_buffer[2:10]))
+
+        # Handle OSP, if something wants it
+        if descriptor.handler:
+            self.dispatch_osp(descriptor, tsbk_buffer)
+
+    def handle_mbt(self, mbt_buffer):
+        # Only the alternate MBT format is decoded; it carries the OSP's
+        # opcode in the header block, whereas the unconfirmed format carries
+        # OSPs in its data blocks with layouts of their own
+        if (mbt_buffer[0] & 0x1f) != 0x17:
             return
+        opcode = mbt_buffer[7] & 0x3f
+        vendor = mbt_buffer[2]
+
+        # Identify and log the OSP if desired
+        descriptor = self.mbt_osp_table[(opcode << 8) | vendor]
+        pdu_log.trace(TRACE_MBT, opcode, vendor)
+        if self.log.is_enabled_for(logging.DEBUG):
+            osp_name = descriptor.name or f'OSP_OPCODE_{opcode:02X}_VENDOR_{vendor:02X}'
+            self.log.sampled(logging.DEBUG, osp_name, 'MBT %-46s %s', osp_name,
+                pdu_log.hex_bytes(mbt_buffer))
 
-        # Handle OSP
-        # See if we know how to decode and dispatch it
-        if osp_name in tsbk_osp_decoders:
-            self.dispatch_osp(osp_name, tsbk_buffer)
-        elif osp == tsbk_osps.OSP_IDENT_UPDATE or osp == tsbk_osps.OSP_IDENT_UPDATE_VHF_UHF_BANDS:
-            identifier = (tsbk_buffer[2] & 0xf0) >> 4
-            spacing = ((tsbk_buffer[4] & 0x03) << 8) | tsbk_buffer[5]
-            base = (tsbk_buffer[6] << 24) | (tsbk_buffer[7] << 16) | \
-                (tsbk_buffer[8] << 8) | (tsbk_buffer[9])
-            self.system.add_identifier(identifier, base * 5, spacing * 125)
+        if descriptor.handler:
+            self.dispatch_osp(descriptor, mbt_buffer)
+
+    # Identifier updates keep the channel to frequency mapping current;
+    # subclasses handling these should call them
+    def OSP_IDENT_UPDATE(self, message):
+        self.system.add_identifier(message.identifier, message.base * 5, message.spacing * 125)
+
+    def OSP_IDENT_UPDATE_VHF_UHF_BANDS(self, message):
+        self.system.add_identifier(message.identifier, message.base * 5, message.spacing * 125)
 
     def handle_stats(self, port, data):
         pass
 
     def do_tune_radio(self, port, data):
         # Use the first received PDU to tune the radio to the desired center
-        # frequency, then go to the SEEK_CC state
+        # frequency and the control channel DDC to the site's first
+        # frequency, back to back so the flowgraph sees one retune, then go
+        # to the SEEK_CC state
         logging.info(f'p25_scanner: radio will tune to {self.radio_center_freq} Hz')
-        self.send_pdu('radio_freq', {'type': 'float', 'value': self.radio_center_freq})
         self.cc_index = 0
-        self.pdus_until_cc_index_change = 0
+        self.send_pdus([
+            ('radio_freq', {'type': 'float', 'value': self.radio_center_freq}),
+            self.cc_offset_pdu()
+        ])
+        self.pdus_until_cc_index_change = 50
+        self.good_pdus = 0
         self.state = self.scanner_state.SEEK_CC
 
+    def cc_offset_pdu(self):
+        cc_freq = self.site_info['frequencies'][self.cc_index]
+        cc_freq_offset = self.radio_center_freq - cc_freq
+        logging.info(f'p25_scanner: tuning CC to {cc_freq} Hz (offset {cc_freq_offset}, freq index {self.cc_index})')
+        return ('cc_offset', {'type': 'float', 'value': cc_freq_offset})
+
     def do_seek_cc(self, port, data):
         # Monitor PDUs on cc_pdus looking for TSBKs or PDUs on each frequency
         # for some number of seconds at a time; if an adequate number of good
@@ -367,10 +1050,7 @@ class p25_scanner():
         # First, set the CC channel offset to the desired frequency if it's
         # time to change frequencies
         if self.pdus_until_cc_index_change == 0:
-            cc_freq = self.site_info['frequencies'][self.cc_index]
-            cc_freq_offset = self.radio_center_freq - cc_freq
-            logging.info(f'p25_scanner: tuning CC to {cc_freq} Hz (offset {cc_freq_offset}, freq index {self.cc_index})')
-            self.send_pdu('cc_offset', {'type': 'float', 'value': cc_freq_offset})
+            self.send_pdu(*self.cc_offset_pdu())
             self.pdus_until_cc_index_change = 50
             self.good_pdus = 0
         else:
@@ -392,10 +1072,9 @@ class p25_scanner():
                 self.cc_index = (self.cc_index + 1) % len(self.site_info['frequencies'])
 
     def do_monitor_cc(self, port, data):
-        logging.debug(f'p25_scanner: {data}')
-
-        # Decode TSBKs
+        # Decode TSBKs and MBTs
         (is_du, _, duid, du_good) = self.get_du_info(data)
+        self.log.sampled(logging.DEBUG, duid, '%s', data)
         if is_du:
             # Accumulate DUID stats on control channel
             (duid_count, good_count) = self.p25_duid_stats[port].setdefault(duid, (0, 0))
@@ -403,13 +1082,20 @@ class p25_scanner():
             good_count += 1 if du_good else 0
             self.p25_duid_stats[port][duid] = (duid_count, good_count)
 
-            # TODO: Add PDU (MBT TSBK) decoding
             if duid == 0x7 and du_good:
-                tsbk_buffer = bytearray.fromhex(data['p25_du'].get('tsbk', ''))
+                tsbk_buffer = pdu_codec.du_bytes(data['p25_du'].get('tsbk', ''))
                 if len(tsbk_buffer) != 12:
                     logging.warning(f'p25_scanner: TSBK detected with weird/invalid payload')
                     return
                 self.handle_tsbk(tsbk_buffer)
+            elif duid == 0xc and du_good and 'pdu' in data['p25_du']:
+                # Multi-block trunking (MBT) PDU: header block plus at least
+                # one data block
+                mbt_buffer = pdu_codec.du_bytes(data['p25_du']['pdu'])
+                if len(mbt_buffer) < 24 or len(mbt_buffer) % 12 != 0:
+                    logging.warning('p25_scanner: MBT detected with weird/invalid payload')
+                    return
+                self.handle_mbt(mbt_buffer)
 
     def do_voice_pdu(self, port, data):
         (is_du, _, duid, du_good) = self.get_du_info(data)
@@ -422,7 +1108,7 @@ class p25_scanner():
             self.p25_duid_stats[port][duid] = (duid_count, good_count)
 
         if is_du and (duid == 0x5 or duid == 0xa):
-            imbe_frames = bytes.fromhex(data['p25_du'].get('imbe', ''))
+            imbe_frames = pdu_codec.du_bytes(data['p25_du'].get('imbe', ''))
             if self.imbe_decoder:
                 for frame in range(0, 9):
                     frame_start_index = 11 * frame
@@ -435,10 +1121,29 @@ class p25_scanner():
                 logging.info(f'p25_scanner: IMBE data received, not played')
 
 
-    def __init__(self, input_ports, output_ports, send_pdu_fn, params):
+    def __init__(self, input_ports, output_ports, send_pdu_fn, params, send_pdus_fn=None):
         logging.info('p25_scanner: instantiating')
 
+        # Time from instantiation to the first TSBK decoded, logged once
+        self.start_time = time.monotonic()
+        self.first_tsbk_logged = False
+
+        # With latency_probe=1, the hops taken by probed PDUs are recorded
+        # once they've been handled (see pdu_stats.LATENCY_PROBE_HOPS), and
+        # log_latency_report() logs them
+        self.latency_probe = pdu_stats.latency_probe() \
+            if params.get('latency_probe', '0') not in ['', '0'] else None
+
+        # send_pdus(pdus) sends a list of (port, pdu) tuples back to back (e.g.,
+        # to retune several things at once); fall back to sending them one at
+        # a time if the front end didn't provide a way to do so
         self.send_pdu = send_pdu_fn
+        self.send_pdus = send_pdus_fn if send_pdus_fn else self.send_pdus_individually
+
+        # Hot path debug messages (e.g. every OSP decoded) are logged for one
+        # in every log_sample_interval PDUs of each kind
+        self.log = pdu_log.pdu_logger('p25_scanner: ',
+            sample_interval=int(params.get('log_sample_interval', 1)))
 
         # Validate parameters
         for required_param in ['site_file', 'tg_file', 'site_id']:
@@ -488,8 +1193,15 @@ class p25_scanner():
             self.p25_duid_stats[input_port] = {}
 
         self.state = self.scanner_state.TUNE_RADIO
+        self.bind_osp_handlers()
 
     def receive_pdu(self, port, data):
+        if isinstance(data, bytes):
+            # Unparsed PDU, e.g. forwarded by the out of process proxy with
+            # oop_raw_pdus=1
+            data = pdu_codec.decode_pdu(data)
+            if self.latency_probe:
+                pdu_stats.stamp_probe(data, 'parse')
         if 'stats' in data:
             data['stats'].update({'duid': self.p25_duid_stats[port]})
             self.handle_stats(port, data)
@@ -497,18 +1209,391 @@ class p25_scanner():
             [self.do_tune_radio, self.do_seek_cc, self.do_monitor_cc][self.state.value](port, data)
         elif port == 'tc_pdus':
             self.do_voice_pdu(port, data)
+        if self.latency_probe:
+            pdu_stats.stamp_probe(data, 'dispatch')
+            if 'probe' in data:
+                self.latency_probe.record(data)
+
+    def stamp_delivered(self, data):
+        # Called by out of process subclasses as PDUs (or batches of them)
+        # arrive from the proxy
+        if self.latency_probe:
+            for pdu in (data if isinstance(data, list) else [data]):
+                pdu_stats.stamp_probe(pdu, 'ipc')
+
+    def log_latency_report(self):
+        if self.latency_probe:
+            logging.info(f'p25_scanner: PDU latency\n{self.latency_probe.report()}')
+
+    def send_pdus_individually(self, pdus):
+        for (port, pdu) in pdus:
+            self.send_pdu(port, pdu)
+
+    def receive_pdu_batch(self, port, pdus):
+        for data in pdus:
+            self.receive_pdu(port, data)
 
     def tune_traffic_channel(self, freq):
         tc_freq_offset = self.radio_center_freq - freq
         logging.info(f'p25_scanner: tuning TC to {freq} Hz (offset {tc_freq_offset})')
         self.send_pdu('tc_offset', {'type': 'float', 'value': tc_freq_offset})
 
+    def get_state_snapshot(self):
+        # State handed to a replacement instance when the front end reloads
+        # the back end (see front_end_interface.reload_back_end()), so that
+        # the new instance can carry on without retuning the radio. Subclasses
+        # may add to it; it must be picklable so it can cross the out of
+        # process proxy.
+        return {
+            'site_id': self.site_id,
+            'idents': dict(self.system.idents),
+            'cc_index': getattr(self, 'cc_index', 0),
+            'state': self.state.name
+        }
+
+    def restore_state_snapshot(self, snapshot):
+        if snapshot.get('site_id') != self.site_id:
+            logging.info(f'p25_scanner: site changed from {snapshot.get("site_id")}, not restoring state')
+            return
+        self.system.idents.update(snapshot['idents'])
+        self.cc_index = snapshot['cc_index'] % len(self.site_info['frequencies'])
+        state = self.scanner_state[snapshot['state']]
+        if state != self.scanner_state.TUNE_RADIO:
+            # The radio is already tuned to this site; if a CC was still being
+            # sought, pick the search up again at the same frequency
+            self.pdus_until_cc_index_change = 0
+            self.state = state
+        logging.info(f'p25_scanner: restored state {state.name}, CC index {self.cc_index}, {len(snapshot["idents"])} identifiers')
+
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
+    # Benchmark TSBK decoding and dispatch on a control channel capture: a
+    # file of PDUs as emitted by the P25 frame decoder (JSON, one per line),
+    # given on the command line. Without one, a busy Motorola control
+    # channel is approximated by a mix of grants, grant updates, status
+    # broadcasts and vendor-specific OSPs. The compiled decoders are checked
+    # against an interpretation of tsbk_osp_decoders as well.
+    import os
+    import random
+    import sys
+    import tempfile
+    logging.basicConfig(level=logging.WARNING)
     INPUT_PORTS = ['tc_pdus', 'cc_pdus']
     OUTPUT_PORTS = ['radio_freq', 'radio_gain', 'cc_offset', 'tc_offset']
-    scanner = p25_scanner(INPUT_PORTS, OUTPUT_PORTS, None,
-        {'site_file': '/tmp/trs_site_2_2022.csv',
-         'tg_file': '/tmp/trs_tg_2_enhanced_2022.csv',
-         'site_id': '1.7'})
+    TSBK_COUNT = 200000
+    # (TSBK hex, share of the control channel)
+    BUSY_CC_MIX = [
+        ('3d001000c8000c3533e84e7b', 1),    # OSP_IDENT_UPDATE
+        ('0200100a0a5e100b0e29a2e0', 40),   # OSP_GRP_V_CHANNEL_GRANT_UPDATE
+        ('0000001011271200be4ff2e0', 10),   # OSP_GRP_V_CHANNEL_GRANT
+        ('3a0001020107100c70f52ab7', 5),    # OSP_RFSS_STS_BROADCAST
+        ('3c0001020108100d70f5b2c1', 5),    # OSP_ADJACENT_STS_BROADCAST
+        ('39000107100e70100f7039e4', 5),    # OSP_SECONDARY_CONTROL_CHANNEL_BROADCAST
+        ('3b00010203040100c370f5aa', 4),    # OSP_NETWORK_STS_BROADCAST
+        ('029000100a5e1127120014b2', 10),   # OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT
+        ('03900a5e1011271210012233', 10),   # OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT_UPDATE
+        ('0b90ab2c4d0e1f0a1b2c3d4e', 5),    # OSP_MOTOROLA_BASE_STATION_ID
+        ('3090000000000000000057ab', 5),    # Motorola OSPs not in tsbk_osps
+        ('3490000000000000000012cd', 5),
+        ('0c90000000000000000034ef', 5),
+    ]
+
+    # TSBKs of the OSPs with parameters that don't sit on byte boundaries,
+    # assembled bit by bit from the TIA-102.AABC layouts (CRC left as zero,
+    # as it isn't checked here) with a distinct value in every field, and
+    # the values those parameters should decode to
+    TSBK_CHECKS = [
+        ('3500d0f0a91fa86daf000000', 'OSP_TIME_DATE_ANN',
+            {'vd': 1, 'vt': 1, 'vl': 0, 'local_time_offset': 0x10f0, 'month': 10, 'day': 18,
+            'year': 2026, 'hours': 13, 'minutes': 45, 'seconds': 30}),
+        ('300000076535526db0e10000', 'OSP_TDMA_SYNC_BROADCAST',
+            {'us': 0, 'ist': 1, 'mm': 1, 'mc': 2, 'vl': 1, 'local_time_offset': 0x25, 'year': 26,
+            'month': 10, 'day': 18, 'hours': 13, 'minutes': 45, 'micro_slots': 4321}),
+        ('3d001322d0640a2510a20000', 'OSP_IDENT_UPDATE',
+            {'identifier': 1, 'bandwidth': 0x64, 'tx_offset': 0xb4, 'spacing': 100, 'base': 170201250}),
+        ('340024805032055d4a800000', 'OSP_IDENT_UPDATE_VHF_UHF_BANDS',
+            {'identifier': 2, 'bandwidth': 4, 'tx_offset': 0x2014, 'spacing': 50, 'base': 90000000}),
+        ('33003302d0640a2510a20000', 'OSP_IDENT_UPDATE_TDMA',
+            {'identifier': 3, 'channel_type': 3, 'tx_offset': 0xb4, 'spacing': 100, 'base': 170201250}),
+        ('2e00bee001c5001234560000', 'OSP_AUTH_COMMAND',
+            {'wacn': 0xbee00, 'system_id': 0x1c5, 'target': 0x123456}),
+        ('2f0000bee001c51234560000', 'OSP_UNIT_DEREG_ACKNOWLEDGE',
+            {'wacn': 0xbee00, 'system_id': 0x1c5, 'source': 0x123456}),
+        ('360002bee001c500abcd0000', 'OSP_ROAMING_ADDRESS_COMMAND',
+            {'stack_operation': 2, 'wacn': 0xbee00, 'system_id': 0x1c5, 'target': 0xabcd}),
+        ('370083bee001c500abcd0000', 'OSP_ROAMING_ADDRESS_UPDATE',
+            {'last_message': 1, 'message_sequence': 3, 'wacn': 0xbee00, 'system_id': 0x1c5, 'source': 0xabcd}),
+        ('3b0001bee001c5100c700000', 'OSP_NETWORK_STS_BROADCAST',
+            {'lra': 1, 'wacn': 0xbee00, 'system_id': 0x1c5, 'service_class': 0x70})
+    ]
+
+    # MBTs as the P25 frame decoder emits them (header and data block CRCs
+    # included), after an identifier update for channels 0x1000 on, 12.5 kHz
+    # apart from 851.00625 MHz, with the parameters their handlers should
+    # be given; the unconfirmed format and vendor-specific MBTs are ignored.
+    # These aren't captures: like TSBK_CHECKS, they're assembled by hand
+    # from the TIA-102.AABC alternate MBT layouts, with the header CRC-16
+    # and packet CRC-32 worked out as lib/p25p1_fdma.cc checks them, so they
+    # only check the offsets against themselves. Captured MBTs of each OSP
+    # still need to be added; given a capture, the check below compares its
+    # MBTs with the TSBKs in it and prints them in this form.
+    MBT_IDENT_UPDATE = '3d00100000640a2510a20000'
+    MBT_CHECKS = [
+        ('173d000012ab01000000fc490000100a100b0a5e0f569796', 'OSP_GRP_V_CHANNEL_GRANT',
+            {'service_opts': 0, 'freq': 851131250, 'freq_rx': 851143750, 'group': 2654, 'source': 0x12ab}),
+        ('173d000111c5013a00005ed80107100c100d700015b8fe3e', 'OSP_RFSS_STS_BROADCAST',
+            {'lra': 1, 'active_network_connection': 1, 'system_id': 0x1c5, 'rfss_id': 1, 'site_id': 7,
+            'freq': 851156250, 'freq_rx': 851168750, 'service_class': 0x70}),
+        ('173d00010000023b0000bdffbee001c5100c100d7000000000000000000000001d6ac2e6',
+            'OSP_NETWORK_STS_BROADCAST',
+            {'lra': 1, 'wacn': 0xbee00, 'system_id': 0x1c5, 'freq': 851156250, 'freq_rx': 851168750,
+            'service_class': 0x70}),
+        ('173d000171c5013c01080159100e100f7000000046895321', 'OSP_ADJACENT_STS_BROADCAST',
+            {'lra': 1, 'cfva': 7, 'system_id': 0x1c5, 'rfss_id': 1, 'site_id': 8,
+            'freq': 851181250, 'freq_rx': 851193750, 'service_class': 0x70}),
+        ('153d00ffffff01000000defd0000100a0a5e0000be0a2b9d', None, None),
+        ('173d900012ab010000003c7c0000100a100b0a5e0f569796', None, None)
+    ]
+
+    def interpret_osp_decoder(scanner, osp_name, data, decoders=tsbk_osp_decoders):
+        # tsbk_osp_decoders interpreted for every TSBK, as dispatch_osp()
+        # used to
+        param_map = dict()
+        for (param_name, param_value) in decoders[osp_name].items():
+            if callable(param_value):
+                param_map[param_name] = param_value(scanner, data)
+            elif isinstance(param_value, tuple):
+                # The bits, one at a time
+                (first_bit, bit_count) = param_value
+                value = 0
+                for bit in range(first_bit, first_bit + bit_count):
+                    value = (value << 1) | ((data[bit // 8] >> (7 - bit % 8)) & 1)
+                param_map[param_name] = value
+            else:
+                value = 0
+                for (offset, mask, shift) in param_value:
+                    value <<= 8
+                    partial_value = (data[offset] & mask)
+                    if shift > 0:
+                        partial_value >>= shift
+                    else:
+                        partial_value <<= -shift
+                    value |= partial_value
+                param_map[param_name] = value
+        return param_map
+
+    def lookup_osp_enum(opcode, vendor):
+        try:
+            return tsbk_osps((opcode, vendor)).name
+        except ValueError:
+            return f'OSP_OPCODE_{opcode:02X}_VENDOR_{vendor:02X}'
+
+    class benchmark_scanner(p25_scanner):
+        def OSP_GENERIC(self, message):
+            self.dispatched += 1
+
+    class grant_scanner(p25_scanner):
+        # Reads the grants, and nothing else, as scanner_oop_ws does
+        def OSP_GRP_V_CHANNEL_GRANT(self, message):
+            self.dispatched += message.freq + message.group > 0
+
+        def OSP_GRP_V_CHANNEL_GRANT_UPDATE(self, message):
+            self.dispatched += message.freq0 + message.group0 + message.freq1 + message.group1 > 0
+
+    class eager_grant_scanner(grant_scanner):
+        # The same, but with every OSP decoded up front, as dispatch_osp()
+        # used to
+        def dispatch_osp(self, descriptor, osp_data):
+            message = descriptor.message(self, osp_data)
+            message.decode()
+            descriptor.handler(message)
+
+        def OSP_GENERIC(self, message):
+            pass
+
+    class mbt_scanner(p25_scanner):
+        # Records what it's given, through a named handler and OSP_GENERIC
+        def OSP_GRP_V_CHANNEL_GRANT(self, message):
+            self.messages.append((message.name, message.decode()))
+
+        def OSP_GENERIC(self, message):
+            self.messages.append((message.name, message.decode()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        site_file = os.path.join(directory, 'site.csv')
+        tg_file = os.path.join(directory, 'tg.csv')
+        with open(site_file, 'w') as f:
+            f.write('RFSS,Site Dec,Site Hex,Site NAC,Description,County Name,Lat,Lon,Range,Frequencies\n')
+            f.write('1,7,7,293,Site,County,0.0,0.0,10.0,851.0125,851.2625\n')
+        with open(tg_file, 'w') as f:
+            f.write('Decimal,Hex,Alpha Tag,Mode,Description,Tag,Category\n')
+            f.write('2654,a5e,TG,D,Talkgroup,Tag,Category\n')
+        (scanner, grants, eager_grants, mbts) = [scanner_class(INPUT_PORTS, OUTPUT_PORTS, lambda port, pdu: None,
+            {'site_file': site_file, 'tg_file': tg_file, 'site_id': '1.7'})
+            for scanner_class in [benchmark_scanner, grant_scanner, eager_grant_scanner, mbt_scanner]]
+    scanner.dispatched = 0
+
+    if len(sys.argv) > 1:
+        (tsbks, capture) = ([], [])
+        with open(sys.argv[1], 'rb') as f:
+            for line in f:
+                data = pdu_codec.decode_pdu(line)
+                capture.append(data)
+                du = data.get('p25_du', {})
+                if pdu_codec.du_int(du.get('duid', 0)) == 0x7 and du.get('ok'):
+                    tsbks.append(pdu_codec.du_bytes(du['tsbk']))
+        print(f'{len(tsbks)} TSBKs in {sys.argv[1]}')
+    else:
+        random.seed(1)
+        tsbks = [bytes.fromhex(tsbk) for (tsbk, share) in BUSY_CC_MIX for _ in range(share)]
+        tsbks = tsbks[:1] + random.sample(tsbks[1:], len(tsbks) - 1)
+    tsbks = (tsbks * (TSBK_COUNT // len(tsbks) + 1))[:TSBK_COUNT]
+
+    # Random TSBKs for every OSP, decoded every way
+    for osp_name in tsbk_osp_decoders:
+        for _ in range(1000):
+            data = bytes([random.randrange(256) for _ in range(12)])
+            param_map = interpret_osp_decoder(scanner, osp_name, data)
+            assert tsbk_osp_compiled_decoders[osp_name](scanner, data) == param_map, osp_name
+            assert tsbk_osp_messages[osp_name](scanner, data).decode() == param_map, osp_name
+    for osp_name in mbt_osp_decoders:
+        for _ in range(1000):
+            data = bytes([random.randrange(256) for _ in range(24)])
+            param_map = interpret_osp_decoder(scanner, osp_name, data, mbt_osp_decoders)
+            assert mbt_osp_compiled_decoders[osp_name](scanner, data) == param_map, osp_name
+            assert mbt_osp_messages[osp_name](scanner, data).decode() == param_map, osp_name
+
+    # Known values, as the random TSBKs only check the table against itself
+    for (tsbk, osp_name, expected) in TSBK_CHECKS:
+        data = bytes.fromhex(tsbk)
+        assert tsbk_osps((data[0] & 0x3f, data[1])).name == osp_name, osp_name
+        param_map = tsbk_osp_messages[osp_name](scanner, data).decode()
+        assert dict([(name, param_map[name]) for name in expected]) == expected, (osp_name, param_map)
+    print(f'{len(TSBK_CHECKS)} TSBKs decoded as expected')
+
+    # MBTs, in JSON and binary PDUs, on the control channel
+    mbts.state = mbts.scanner_state.MONITOR_CC
+    mbts.messages = []
+    mbts.receive_pdu('cc_pdus', {'p25_du': {'nac': 0x293, 'duid': 0x7, 'ok': 1, 'tsbk': MBT_IDENT_UPDATE}})
+    for (mbt, osp_name, param_map) in MBT_CHECKS:
+        for pdu in [{'p25_du': {'nac': '0x293', 'duid': '0xc', 'ok': 1, 'pdu': mbt}},
+                {'p25_du': {'nac': 0x293, 'duid': 0xc, 'ok': 1, 'pdu': bytes.fromhex(mbt)}}]:
+            mbts.receive_pdu('cc_pdus', pdu)
+            expected = [(osp_name, param_map)] if osp_name else []
+            assert mbts.messages == expected, (mbts.messages, expected)
+            mbts.messages = []
+    print(f'{len(MBT_CHECKS)} MBTs decoded as expected')
+
+    # MBTs in the capture, checked against the TSBK forms of their OSPs in
+    # it: a grant to the same group from the same source, or a status
+    # broadcast for the same system (and site), has to agree on the
+    # parameters both forms carry. Each OSP's first MBT is printed in the
+    # form of MBT_CHECKS, to be added there.
+    if len(sys.argv) > 1:
+        MBT_MATCH_KEYS = {
+            'OSP_GRP_V_CHANNEL_GRANT': ['group', 'source'],
+            'OSP_RFSS_STS_BROADCAST': ['system_id', 'rfss_id', 'site_id'],
+            'OSP_NETWORK_STS_BROADCAST': ['system_id'],
+            'OSP_ADJACENT_STS_BROADCAST': ['system_id', 'rfss_id', 'site_id']
+        }
+        mbts.system.idents = dict()
+        (tsbk_param_maps, mbt_param_maps) = ({}, [])
+        for data in capture:
+            mbts.messages = []
+            mbts.receive_pdu('cc_pdus', data)
+            du = data.get('p25_du', {})
+            duid = pdu_codec.du_int(du.get('duid', 0))
+            for (osp_name, param_map) in mbts.messages:
+                if osp_name not in MBT_MATCH_KEYS:
+                    continue
+                key = (osp_name, tuple([param_map[name] for name in MBT_MATCH_KEYS[osp_name]]))
+                if duid == 0x7:
+                    tsbk_param_maps[key] = param_map
+                elif duid == 0xc:
+                    mbt_param_maps.append((key, pdu_codec.du_bytes(du['pdu']), param_map))
+        (checked, printed) = (0, set())
+        for (key, mbt, param_map) in mbt_param_maps:
+            osp_name = key[0]
+            if key in tsbk_param_maps:
+                tsbk_param_map = tsbk_param_maps[key]
+                shared = [name for name in param_map if name in tsbk_param_map]
+                assert [param_map[name] for name in shared] == [tsbk_param_map[name] for name in shared], \
+                    (osp_name, mbt.hex(), param_map, tsbk_param_map)
+                checked += 1
+            if osp_name not in printed:
+                printed.add(osp_name)
+                print(f'    ({mbt.hex()!r}, {osp_name!r},\n        {param_map!r}),')
+        print(f'{len(mbt_param_maps)} MBTs in {sys.argv[1]}, {checked} agreeing with TSBKs')
+
+    decoded = [(tsbk_osps((tsbk[0] & 0x3f, tsbk[1])).name, tsbk) for tsbk in tsbks
+        if (tsbk[0] & 0x3f, tsbk[1]) in tsbk_osps._value2member_map_]
+    decoded = [(osp_name, tsbk) for (osp_name, tsbk) in decoded if osp_name in tsbk_osp_decoders]
+    for (name, decode) in [
+            ('interpreted', lambda osp_name, tsbk: interpret_osp_decoder(scanner, osp_name, tsbk)),
+            ('compiled', lambda osp_name, tsbk: tsbk_osp_compiled_decoders[osp_name](scanner, tsbk))]:
+        start = time.perf_counter()
+        for (osp_name, tsbk) in decoded:
+            decode(osp_name, tsbk)
+        elapsed = time.perf_counter() - start
+        print(f'decode only, {name:<11s}: {len(decoded) / elapsed:9.0f} TSBKs/s')
+
+    # Finding the OSP: the tsbk_osps lookup handle_tsbk() used to do (with an
+    # exception and a name formatted for unknown OSPs), and the table
+    for (name, lookup) in [('enum', lookup_osp_enum),
+            ('table', lambda opcode, vendor: scanner.osp_table[(opcode << 8) | vendor])]:
+        start = time.perf_counter()
+        for tsbk in tsbks:
+            lookup(tsbk[0] & 0x3f, tsbk[1])
+        elapsed = time.perf_counter() - start
+        print(f'OSP lookup, {name:<11s}: {len(tsbks) / elapsed:9.0f} TSBKs/s')
+
+    start = time.perf_counter()
+    for tsbk in tsbks:
+        scanner.handle_tsbk(tsbk)
+    elapsed = time.perf_counter() - start
+    print(f'handle_tsbk            : {len(tsbks) / elapsed:9.0f} TSBKs/s '
+        f'({scanner.dispatched} dispatched)')
+
+    # A back end reading only grants, with the parameters of every OSP it
+    # handles decoded up front, and as they're read
+    for (name, grant_scanner) in [('eager', eager_grants), ('lazy', grants)]:
+        grant_scanner.dispatched = 0
+        start = time.perf_counter()
+        for tsbk in tsbks:
+            grant_scanner.handle_tsbk(tsbk)
+        elapsed = time.perf_counter() - start
+        print(f'handle_tsbk, {name:<11s}: {len(tsbks) / elapsed:9.0f} TSBKs/s '
+            f'({grant_scanner.dispatched} grants)')
+
+    if numpy is None:
+        sys.exit()
+
+    # The batch decoder, checked against the compiled decoders on random
+    # TSBKs of every decoded OSP (and some protected ones), in random order,
+    # with identifier updates applied as they come
+    random_tsbks = []
+    for osp_name in tsbk_osp_decoders:
+        (opcode, vendor) = tsbk_osps[osp_name].value
+        for _ in range(1000):
+            random_tsbks.append(bytes([opcode | random.choice([0x00, 0x80, 0x40]), vendor] +
+                [random.randrange(256) for _ in range(10)]))
+    random.shuffle(random_tsbks)
+    idents = dict(scanner.system.idents)
+    batch = decode_tsbk_batch(numpy.frombuffer(b''.join(random_tsbks), dtype=numpy.uint8).reshape(-1, 12),
+        scanner.system)
+    (batch_idents, scanner.system.idents) = (scanner.system.idents, idents)
+    for (row, tsbk) in enumerate(random_tsbks):
+        descriptor = tsbk_osp_table[osp_index(tsbk[0] & 0x3f, tsbk[1])]
+        param_map = descriptor.decoder(scanner, tsbk)
+        for (param_name, value) in param_map.items():
+            assert batch[param_name][row] == (-1 if tsbk[0] & 0x40 else value), (descriptor.name, param_name)
+        if descriptor.name in ['OSP_IDENT_UPDATE', 'OSP_IDENT_UPDATE_VHF_UHF_BANDS'] and not tsbk[0] & 0x40:
+            scanner.system.add_identifier(param_map['identifier'], param_map['base'] * 5, param_map['spacing'] * 125)
+    assert scanner.system.idents == batch_idents
+
+    tsbk_array = numpy.frombuffer(b''.join(tsbks), dtype=numpy.uint8).reshape(-1, 12)
+    start = time.perf_counter()
+    decode_tsbk_batch(tsbk_array, scanner.system)
+    elapsed = time.perf_counter() - start
+    print(f'decode only, batch      : {len(tsbks) / elapsed:9.0f} TSBKs/s')
+
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import logging
+from scanner import out_of_process_proxy
+from scanner.p25_scanner import p25_scanner_back_end
+
+class scanner_oop_voice(p25_scanner_back_end.p25_scanner):
+    # Voice shard for the Websocket scanner (see the oop_shards parameter of
+    # out_of_process_proxy): decodes the IMBE voice on the traffic channel in
+    # a process of its own, so that it doesn't compete for the interpreter
+    # with control channel decoding and the UI. PCM data and traffic channel
+    # stats are sent to the other shards as peer messages:
+    #   ('pcm', (tc_freq, pcm_data)) for each LDU of voice decoded (9 frames)
+    #   ('tc_stats', data) for each framer stats PDU on the traffic channel
+    # and ('tc_freq', freq) from another shard announces a retune of the
+    # traffic channel, so that PCM data can be matched to the call.
+
+    def __init__(self, input_ports, output_ports, input_pdu_pipe, output_pdu_pipe, params):
+        p25_scanner_back_end.p25_scanner.__init__(self, input_ports, output_ports, self.oop_send_pdu, params,
+            self.oop_send_pdus)
+        logging.info(f'scanner_oop_voice: instantiating as shard {params.get("oop_shard")}')
+
+        # Save pipes for receiving/sending PDUs from OOP back end
+        self.input_pdu_pipe = input_pdu_pipe
+        self.output_pdu_pipe = output_pdu_pipe
+
+        # Shard to send PCM data and stats to (default all other shards)
+        self.peer_shard = params.get('voice_peer_shard') or None
+        self.tc_freq = 0
+
+    def main_loop(self):
+        logging.info('scanner_oop_voice: main loop starting')
+        running = True
+        while running:
+            try:
+                running = self.handle_proxy_message(*self.input_pdu_pipe.recv())
+            except EOFError:
+                break
+            except BaseException as e:
+                logging.error(f'scanner_oop_voice: caught exception in main loop ({e})')
+                break
+        logging.info('scanner_oop_voice: main loop exiting')
+
+    def oop_send_pdu(self, port_name, pdu):
+        self.output_pdu_pipe.send((port_name, pdu))
+
+    def oop_send_pdus(self, pdus):
+        self.output_pdu_pipe.send((None, list(pdus)))
+
+    def send_peer_message(self, message):
+        self.output_pdu_pipe.send((out_of_process_proxy.OOP_PEER, (self.peer_shard, message)))
+
+    def handle_proxy_message(self, port, data):
+        # Returns False if the main loop should exit
+        if port == out_of_process_proxy.OOP_CONTROL:
+            (command, argument) = data
+            if command == out_of_process_proxy.OOP_SNAPSHOT:
+                self.output_pdu_pipe.send((out_of_process_proxy.OOP_CONTROL,
+                    (out_of_process_proxy.OOP_SNAPSHOT, {'tc_freq': self.tc_freq})))
+            elif command == out_of_process_proxy.OOP_RESTORE:
+                self.tc_freq = argument.get('tc_freq', 0)
+            elif command == out_of_process_proxy.OOP_HEARTBEAT:
+                self.output_pdu_pipe.send((out_of_process_proxy.OOP_CONTROL,
+                    (out_of_process_proxy.OOP_HEARTBEAT, argument)))
+            elif command == out_of_process_proxy.OOP_STOP:
+                self.log_latency_report()
+                return False
+            return True
+        if port == out_of_process_proxy.OOP_PEER:
+            (source, (kind, value)) = data
+            if kind == 'tc_freq':
+                self.tc_freq = value
+            return True
+        self.stamp_delivered(data)
+        if isinstance(data, list):
+            self.receive_pdu_batch(port, data)
+        else:
+            self.receive_pdu(port, data)
+        return True
+
+    def handle_stats(self, port, data):
+        if port == 'tc_pdus':
+            self.send_peer_message(('tc_stats', data))
+
+    def do_voice_pdu(self, port, data):
+        # Collect the frames decoded from an LDU and send them in one message
+        self.ldu_pcm = []
+        p25_scanner_back_end.p25_scanner.do_voice_pdu(self, port, data)
+        (pcm, self.ldu_pcm) = (self.ldu_pcm, None)
+        if pcm:
+            self.send_peer_message(('pcm', (self.tc_freq, b''.join(pcm))))
+
+    def voice_pcm_data(self, pcm_data):
+        self.ldu_pcm.append(pcm_data)
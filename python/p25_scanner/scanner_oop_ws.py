@@ -23,6 +23,7 @@ import json
 import logging
 from multiprocessing import Process, Pipe
 from readline import get_completion_type
+from scanner import out_of_process_proxy
 from scanner.p25_scanner import p25_scanner_back_end
 import select
 import socket
@@ -153,8 +154,10 @@ class scanner_oop_ws(p25_scanner_back_end.p25_scanner):
                 output_data = ws_server.send(BytesMessage(data=bytes_message))
                 client_socket.send(output_data)
 
-    def __init__(self, input_ports, output_ports, input_pdu_pipe, output_pdu_pipe, params):
-        p25_scanner_back_end.p25_scanner.__init__(self, input_ports, output_ports, self.oop_send_pdu, params)
+    def __init__(self, input_ports, output_ports, input_pdu_pipe, output_pdu_pipe, params,
+        get_lane_stats_fn=None):
+        p25_scanner_back_end.p25_scanner.__init__(self, input_ports, output_ports, self.oop_send_pdu, params,
+            self.oop_send_pdus)
         logging.info('scanner_oop_ws: instantiating')
 
         # Map from client's fileno to the client socket and server handling it
@@ -173,6 +176,21 @@ class scanner_oop_ws(p25_scanner_back_end.p25_scanner):
         self.input_pdu_pipe = input_pdu_pipe
         self.output_pdu_pipe = output_pdu_pipe
 
+        # Callback to query the proxy's input lane statistics, and the PDU
+        # drop counts last seen per input port
+        self.get_lane_stats_fn = get_lane_stats_fn
+        self.lane_dropped = {}
+
+        # When sharded (see the oop_shards parameter of out_of_process_proxy),
+        # traffic channel retunes are announced to the other shards, e.g.
+        # scanner_oop_voice decoding the voice in a process of its own
+        self.sharded = 'oop_shards' in params
+
+        # With the latency probe on, its report is logged every
+        # latency_report_s seconds (default 60) and when stopping
+        self.latency_report_interval = float(params.get('latency_report_s', 60))
+        self.next_latency_report_time = time.monotonic() + self.latency_report_interval
+
         # Application-specific data
         self.system_activity = {}
         self.dwell_time = 2000 # milliseconds to 'hold' channel activity
@@ -211,9 +229,14 @@ class scanner_oop_ws(p25_scanner_back_end.p25_scanner):
                 if self.input_pdu_pipe.fileno() in rready_list:
                     # Data available on input PDU pipe; pass it to p25_scanner
                     # superclass, which will decode it and send it down to us
-                    # in some manner
-                    (port, data) = self.input_pdu_pipe.recv()
-                    self.receive_pdu(port, data)
+                    # in some manner. Several messages may be waiting (the
+                    # shared memory transport signals once per burst), so
+                    # handle all of them.
+                    running = True
+                    while running and self.input_pdu_pipe.poll():
+                        running = self.handle_proxy_message(*self.input_pdu_pipe.recv())
+                    if not running:
+                        break
                 if self.ws_server_socket.fileno() in rready_list:
                     # The websocket server socket signals when there's a
                     # client connecting
@@ -244,6 +267,73 @@ class scanner_oop_ws(p25_scanner_back_end.p25_scanner):
         # will send it across the pipe to the back end
         self.output_pdu_pipe.send((port_name, pdu))
 
+    def oop_send_pdus(self, pdus):
+        # A batch of PDUs is sent across the pipe as one message with no port
+        # name; the proxy hands it to the front end's send_pdus
+        self.output_pdu_pipe.send((None, list(pdus)))
+
+    def handle_proxy_message(self, port, data):
+        # Returns False if the main loop should exit
+        if port == out_of_process_proxy.OOP_CONTROL:
+            return self.handle_oop_control(*data)
+        if port == out_of_process_proxy.OOP_PEER:
+            self.handle_peer_message(*data)
+            return True
+        self.stamp_delivered(data)
+        if isinstance(data, list):
+            # Batch of PDUs from the out of process proxy
+            self.receive_pdu_batch(port, data)
+        else:
+            self.receive_pdu(port, data)
+        return True
+
+    def handle_oop_control(self, command, argument):
+        # Handle a control message from the out of process proxy; returns
+        # False if the main loop should exit
+        if command == out_of_process_proxy.OOP_SNAPSHOT:
+            self.output_pdu_pipe.send((out_of_process_proxy.OOP_CONTROL,
+                (out_of_process_proxy.OOP_SNAPSHOT, self.get_state_snapshot())))
+        elif command == out_of_process_proxy.OOP_RESTORE:
+            self.restore_state_snapshot(argument)
+        elif command == out_of_process_proxy.OOP_HEARTBEAT:
+            self.output_pdu_pipe.send((out_of_process_proxy.OOP_CONTROL,
+                (out_of_process_proxy.OOP_HEARTBEAT, argument)))
+        elif command == out_of_process_proxy.OOP_STOP:
+            self.log_latency_report()
+            return False
+        return True
+
+    def handle_peer_message(self, source, message):
+        # Messages from a scanner_oop_voice shard
+        (kind, value) = message
+        if kind == 'pcm':
+            # Only play voice from the call on the current traffic channel
+            (freq, pcm_data) = value
+            if freq == self.tc_freq:
+                self.voice_pcm_data(pcm_data)
+        elif kind == 'tc_stats':
+            self.handle_stats('tc_pdus', value)
+
+    def tune_traffic_channel(self, freq):
+        p25_scanner_back_end.p25_scanner.tune_traffic_channel(self, freq)
+        if self.sharded:
+            self.output_pdu_pipe.send((out_of_process_proxy.OOP_PEER, (None, ('tc_freq', freq))))
+
+    def get_state_snapshot(self):
+        snapshot = p25_scanner_back_end.p25_scanner.get_state_snapshot(self)
+        snapshot.update([
+            ('tc_freq', self.tc_freq),
+            ('lo_list', list(self.lo_list)),
+            ('prio_list', list(self.prio_list))
+        ])
+        return snapshot
+
+    def restore_state_snapshot(self, snapshot):
+        p25_scanner_back_end.p25_scanner.restore_state_snapshot(self, snapshot)
+        self.tc_freq = snapshot.get('tc_freq', self.tc_freq)
+        self.lo_list = list(snapshot.get('lo_list', []))
+        self.prio_list = list(snapshot.get('prio_list', []))
+
     #--------------------------------------------------------------------------
     # Scanner behaviors begin here
     #--------------------------------------------------------------------------
@@ -278,6 +368,18 @@ class scanner_oop_ws(p25_scanner_back_end.p25_scanner):
             if expiration > 0 and time.monotonic_ns() > expiration:
                 self.expire_frequency(freq)
 
+        # Warn when the proxy has had to drop PDUs because we fell behind
+        if self.get_lane_stats_fn:
+            for (port, stats) in self.get_lane_stats_fn().items():
+                if stats['dropped'] > self.lane_dropped.get(port, 0):
+                    logging.warning(f'scanner_oop_ws: {stats["dropped"] - self.lane_dropped.get(port, 0)} '
+                        f'PDUs dropped on {port} (max depth {stats["max_depth"]})')
+                    self.lane_dropped[port] = stats['dropped']
+
+        if self.latency_probe and time.monotonic() >= self.next_latency_report_time:
+            self.next_latency_report_time = time.monotonic() + self.latency_report_interval
+            self.log_latency_report()
+
     def do_ui_lo_group(self, freq):
         tg = self.system_activity[freq].get('tg')
         if tg != None:
@@ -550,25 +652,22 @@ class scanner_oop_ws(p25_scanner_back_end.p25_scanner):
         self.scan()
 
     # Trunked system TSBK callbacks
-    def OSP_GENERIC(self, osp):
-        pass
-
-    def OSP_RFSS_STS_BROADCAST(self, lra, active_network_connection, system_id, rfss_id, site_id, freq, service_class):
-        self.mark_activity(freq, 0, 0)
+    def OSP_RFSS_STS_BROADCAST(self, message):
+        self.mark_activity(message.freq, 0, 0)
 
-    def OSP_GRP_V_CHANNEL_GRANT(self, service_opts, freq, group, source):
-        self.mark_activity(freq, group, source)
+    def OSP_GRP_V_CHANNEL_GRANT(self, message):
+        self.mark_activity(message.freq, message.group, message.source)
 
-    def OSP_GRP_V_CHANNEL_GRANT_UPDATE(self, freq0, group0, freq1, group1):
-        self.update_activity(freq0, group0)
-        self.update_activity(freq1, group1)
+    def OSP_GRP_V_CHANNEL_GRANT_UPDATE(self, message):
+        self.update_activity(message.freq0, message.group0)
+        self.update_activity(message.freq1, message.group1)
 
-    def OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT(self, service_opts, freq, group, source):
-        self.mark_activity(freq, group, source)
+    def OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT(self, message):
+        self.mark_activity(message.freq, message.group, message.source)
 
-    def OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT_UPDATE(self, freq0, group0, freq1, group1):
-        self.update_activity(freq0, group0)
-        self.update_activity(freq1, group1)
+    def OSP_MOTOROLA_PATCH_GRP_CHANNEL_GRANT_UPDATE(self, message):
+        self.update_activity(message.freq0, message.group0)
+        self.update_activity(message.freq1, message.group1)
 
     def handle_stats(self, port, data):
         if port == 'cc_pdus':
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import json
+import struct
+import time
+
+# Use the fastest JSON decoder that is installed. All of them accept the
+# PDU bytes directly, so no intermediate string has to be built.
+try:
+    import orjson
+    json_backend = 'orjson'
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_backend = 'ujson'
+        json_loads = ujson.loads
+    except ImportError:
+        json_backend = 'json'
+        json_loads = json.loads
+
+
+# p25p1_fdma::send_p25_pdu() always starts a data unit PDU with the NAC and
+# DUID in a fixed layout ('{"p25_du": {"nac": "0x293", "duid": "0x7", ...'),
+# so both can be read from fixed offsets without parsing the PDU
+P25_DU_PREFIX = b'{"p25_du": {"nac": "0x'
+P25_DU_NAC_SLICE = slice(22, 25)
+P25_DU_DUID_SLICE = slice(39, 40)
+P25_DU_DUID_PREFIX = b'", "duid": "0x'
+P25_DU_DUID_PREFIX_SLICE = slice(25, 39)
+STATS_PREFIX = b'{"stats"'
+
+PDU_KIND_UNKNOWN = 0
+PDU_KIND_P25_DU = 1
+PDU_KIND_STATS = 2
+
+# The P25 frame decoder can alternatively emit PDUs in a compact binary format
+# (see lib/p25p1_fdma.h for the layout). The field IDs here must be kept in
+# sync with the ones in lib/p25p1_fdma.h.
+BINARY_PDU_MAGIC = b'\xb5'
+BINARY_PDU_HEADER = struct.Struct('>BBHBB')
+BINARY_PDU_FIELD_HEADER = struct.Struct('>BH')
+BINARY_PDU_TYPE_P25_DU = 1
+BINARY_PDU_TYPE_STATS = 2
+
+# Key is the field ID, value is the field name and whether the field is a
+# buffer (bytes) rather than an integer
+binary_pdu_fields = {
+    1: ('tsbk', True),
+    2: ('imbe', True),
+    3: ('lcw', True),
+    4: ('pdu', True),
+    5: ('mi', True),
+    6: ('mfid', False),
+    7: ('tgid', False),
+    8: ('algid', False),
+    9: ('keyid', False),
+    10: ('fmt', False),
+    11: ('sap', False),
+    12: ('blks', False),
+    16: ('symbols', False),
+    17: ('syncs', False),
+    18: ('good_nids', False),
+    19: ('bad_nids', False),
+    20: ('t_ns', False),
+}
+
+
+def decode_binary_pdu(pdu_bytes):
+    # Decode a binary format PDU into a dictionary shaped like its JSON
+    # counterpart. Buffers are returned as bytes (no hex round trip) and
+    # integers (including the NAC and DUID) as ints.
+    (_, pdu_type, nac, duid, ok) = BINARY_PDU_HEADER.unpack_from(pdu_bytes)
+    fields = dict()
+    offset = BINARY_PDU_HEADER.size
+    end = len(pdu_bytes) - 3
+    while offset <= end:
+        (field_id, length) = BINARY_PDU_FIELD_HEADER.unpack_from(pdu_bytes, offset)
+        offset += 3
+        field = binary_pdu_fields.get(field_id)
+        if field:
+            value = pdu_bytes[offset:offset + length]
+            fields[field[0]] = value if field[1] else int.from_bytes(value, 'big')
+        offset += length
+
+    if pdu_type == BINARY_PDU_TYPE_STATS:
+        return {'stats': fields}
+    fields.update([('nac', nac), ('duid', duid), ('ok', ok)])
+    return {'p25_du': fields}
+
+
+def decode_pdu(pdu_bytes):
+    # Decode the contents of a PDU received from the P25 frame decoder (in
+    # either format) into a dictionary
+    if pdu_bytes[:1] == BINARY_PDU_MAGIC:
+        return decode_binary_pdu(pdu_bytes)
+    return json_loads(pdu_bytes)
+
+
+def du_int(value):
+    # Integer values in a P25 DU are hex strings in JSON PDUs, but ints in
+    # binary PDUs
+    if isinstance(value, int):
+        return value
+    return int(value, 16)
+
+
+def du_bytes(value):
+    # Buffers in a P25 DU are hex strings in JSON PDUs, but bytes in binary
+    # PDUs
+    if isinstance(value, str):
+        return bytes.fromhex(value)
+    return value
+
+
+def peek_pdu(pdu_bytes):
+    # Identify a PDU from its fixed prefix only, returning a tuple of
+    # (kind, nac, duid); nac and duid are None unless the PDU is a P25 DU
+    if pdu_bytes[:1] == BINARY_PDU_MAGIC:
+        (_, pdu_type, nac, duid, _) = BINARY_PDU_HEADER.unpack_from(pdu_bytes)
+        if pdu_type == BINARY_PDU_TYPE_P25_DU:
+            return (PDU_KIND_P25_DU, nac, duid)
+        if pdu_type == BINARY_PDU_TYPE_STATS:
+            return (PDU_KIND_STATS, None, None)
+        return (PDU_KIND_UNKNOWN, None, None)
+    if pdu_bytes.startswith(P25_DU_PREFIX) and \
+        pdu_bytes[P25_DU_DUID_PREFIX_SLICE] == P25_DU_DUID_PREFIX:
+        return (PDU_KIND_P25_DU,
+            int(pdu_bytes[P25_DU_NAC_SLICE], 16),
+            int(pdu_bytes[P25_DU_DUID_SLICE], 16))
+    if pdu_bytes.startswith(STATS_PREFIX):
+        return (PDU_KIND_STATS, None, None)
+    return (PDU_KIND_UNKNOWN, None, None)
+
+
+def pdu_wanted(interest, pdu_bytes):
+    # Check a PDU against a back end's declared interest for a port, which is
+    # a dictionary with the following (optional) keys:
+    #   'duids': collection of DUIDs wanted (None or absent means all)
+    #   'nacs': collection of NACs wanted (None or absent means all)
+    #   'stats': whether stats PDUs are wanted (absent means True)
+    # PDUs that can't be identified from their prefix are always wanted.
+    (kind, nac, duid) = peek_pdu(pdu_bytes)
+    if kind == PDU_KIND_P25_DU:
+        duids = interest.get('duids')
+        if duids is not None and duid not in duids:
+            return False
+        nacs = interest.get('nacs')
+        if nacs is not None and nac not in nacs:
+            return False
+    elif kind == PDU_KIND_STATS:
+        return interest.get('stats', True)
+    return True
+
+
+if __name__ == "__main__":
+    # Microbenchmark comparing the legacy per-byte ingest path with the
+    # contiguous buffer path. pmt.u8vector_elements() hands Python a tuple of
+    # ints, so that's what is used as the starting point for both paths.
+    SAMPLE_PDUS = {
+        'tsbk': b'{"p25_du": {"nac": "0x293", "duid": "0x7", '
+            b'"tsbk": "3d00150640320a18a2e04e7b", "ok": 1}}\n',
+        'ldu1': b'{"p25_du": {"nac": "0x293", "duid": "0x5", '
+            b'"lcw": "000000009c50011f2e", '
+            b'"imbe": "1a2fc3884e0b5d71a6090018b3d4c21760a8ff04d0e92b1c7c00'
+            b'0f7e86b42d9a13c05f30be79d400a1b45d6e2c0891f3b0076e2840c2d59'
+            b'a7a1101d35e06ffb12430a17e9c3d4b62e057a28d4c1f5a00e3b8117b6'
+            b'0ed9a2c4339f0b6e1c8d2a57f00c4e9", "ok": 1}}\n',
+        'stats': b'{"stats": {"symbols": 4804800, "syncs": 26122, '
+            b'"good_nids": 25874, "bad_nids": 248}}',
+    }
+    ITERATIONS = 100000
+
+    def to_binary(pdu):
+        # Re-encode a JSON sample the way p25p1_fdma does in binary mode
+        field_ids = dict([(name, (field_id, is_buffer))
+            for (field_id, (name, is_buffer)) in binary_pdu_fields.items()])
+        widths = {'symbols': 4, 'syncs': 4, 'good_nids': 4, 'bad_nids': 4}
+        decoded = json.loads(pdu)
+        if 'stats' in decoded:
+            (pdu_type, nac, duid, ok, fields) = (BINARY_PDU_TYPE_STATS,
+                0, 0, 1, decoded['stats'])
+        else:
+            fields = dict(decoded['p25_du'])
+            (pdu_type, nac, duid, ok) = (BINARY_PDU_TYPE_P25_DU,
+                du_int(fields.pop('nac')), du_int(fields.pop('duid')),
+                fields.pop('ok'))
+        result = BINARY_PDU_HEADER.pack(BINARY_PDU_MAGIC[0], pdu_type, nac, duid, ok)
+        for (name, value) in fields.items():
+            (field_id, is_buffer) = field_ids[name]
+            value = du_bytes(value) if is_buffer else \
+                du_int(value).to_bytes(widths.get(name, 1), 'big')
+            result += struct.pack('>BH', field_id, len(value)) + value
+        return result
+
+    def legacy_path(elements):
+        return json.loads(''.join([chr(x) for x in elements]))
+
+    def buffer_path(elements):
+        return decode_pdu(bytes(elements))
+
+    print(f'JSON backend: {json_backend}')
+    for (name, pdu) in SAMPLE_PDUS.items():
+        binary_pdu = to_binary(pdu)
+        assert legacy_path(tuple(pdu)) == buffer_path(tuple(pdu))
+        results = []
+        for (path, elements) in [(legacy_path, tuple(pdu)),
+                (buffer_path, tuple(pdu)), (buffer_path, tuple(binary_pdu))]:
+            start = time.perf_counter()
+            for _ in range(ITERATIONS):
+                path(elements)
+            results.append(ITERATIONS / (time.perf_counter() - start))
+        print(f'{name:<6s} ({len(pdu):3d} bytes): legacy {results[0]:9.0f} PDUs/s, '
+            f'buffer {results[1]:9.0f} PDUs/s ({results[1] / results[0]:.1f}x), '
+            f'binary ({len(binary_pdu):3d} bytes) {results[2]:9.0f} PDUs/s '
+            f'({results[2] / results[0]:.1f}x)')
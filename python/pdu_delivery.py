@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import collections
+import logging
+import threading
+import time
+
+# Overflow policies for pdu_queue lanes
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_POLICIES = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST]
+
+
+class pdu_batcher():
+    # Gathers PDUs per port and hands them to deliver_fn(port, pdus) once
+    # batch_size PDUs have been gathered on a port, or once the oldest PDU in
+    # a port's batch has waited for latency seconds, whichever comes first
+    def __init__(self, ports, deliver_fn, batch_size=32, latency=0.02):
+        self.deliver_fn = deliver_fn
+        self.batch_size = batch_size
+        self.latency = latency
+        self.batches = dict([(port, []) for port in ports])
+        self.batch_deadlines = dict([(port, 0) for port in ports])
+
+        # Deliveries happen with the lock held so that the back end sees the
+        # batches for a port in order, and never from two threads at once
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def add(self, port, pdu):
+        with self.lock:
+            batch = self.batches[port]
+            if len(batch) == 0:
+                self.batch_deadlines[port] = time.monotonic() + self.latency
+            batch.append(pdu)
+            if len(batch) >= self.batch_size:
+                self.deliver(port)
+
+    def deliver(self, port):
+        # NOTE: Must be called with the lock held
+        batch = self.batches[port]
+        if len(batch) == 0:
+            return
+        self.batches[port] = []
+        try:
+            self.deliver_fn(port, batch)
+        except BaseException as e:
+            logging.warning(f'pdu_batcher: failed to deliver {len(batch)} PDUs on port {port}: {e}')
+
+    def flush(self, expired_only=False):
+        with self.lock:
+            now = time.monotonic()
+            for port in self.batches:
+                if not expired_only or now >= self.batch_deadlines[port]:
+                    self.deliver(port)
+
+    def flush_loop(self):
+        # Wake up often enough that no PDU waits much longer than the latency
+        # bound for its batch to fill
+        while not self.stop_event.wait(self.latency / 2):
+            self.flush(expired_only=True)
+
+    def stop(self):
+        self.stop_event.set()
+        self.flush_thread.join()
+        self.flush()
+
+
+class pdu_queue():
+    # Bounded queue with one lane per port. Each lane holds at most depth
+    # items; when a lane is full, the overflow policy decides whether put()
+    # blocks until there's room, discards the oldest item in the lane or
+    # discards the item being put. get() always serves the lanes in the order
+    # of the ports list, so earlier ports have priority over later ones.
+    # lane_depths and lane_overflows optionally override the depth and
+    # overflow policy for individual ports. Items in the lanes of
+    # barrier_ports are instead served in the order they were put relative
+    # to the other lanes: after every item put before them, and before any
+    # put after them (e.g. a request that has to follow what's already
+    # queued, but mustn't wait behind everything that arrives later).
+    def __init__(self, ports, depth=256, overflow=OVERFLOW_BLOCK,
+        lane_depths={}, lane_overflows={}, barrier_ports=[]):
+        self.ports = list(ports)
+        self.barrier_ports = list(barrier_ports)
+        self.sequence = 0
+        self.depths = dict([(port, lane_depths.get(port, depth)) for port in self.ports])
+        self.overflows = dict([(port, lane_overflows.get(port, overflow)) for port in self.ports])
+        if any([policy not in OVERFLOW_POLICIES for policy in self.overflows.values()]):
+            raise ValueError(f'pdu_queue: overflow policy must be one of {OVERFLOW_POLICIES}')
+        if any([lane_depth < 1 for lane_depth in self.depths.values()]):
+            raise ValueError('pdu_queue: depth must be at least 1')
+        self.lanes = dict([(port, collections.deque()) for port in self.ports])
+        self.lane_stats = dict([(port, {'queued': 0, 'dropped': 0, 'max_depth': 0})
+            for port in self.ports])
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, port, item):
+        # Returns False if the item was dropped
+        with self.cond:
+            lane = self.lanes[port]
+            stats = self.lane_stats[port]
+            depth = self.depths[port]
+            if len(lane) >= depth:
+                overflow = self.overflows[port]
+                if overflow == OVERFLOW_DROP_NEWEST:
+                    stats['dropped'] += 1
+                    return False
+                elif overflow == OVERFLOW_DROP_OLDEST:
+                    lane.popleft()
+                    stats['dropped'] += 1
+                else:
+                    while len(lane) >= depth and not self.closed:
+                        self.cond.wait()
+            if self.closed:
+                stats['dropped'] += 1
+                return False
+            # Items are numbered in the order they're put, for barrier lanes
+            self.sequence += 1
+            lane.append((self.sequence, item))
+            stats['queued'] += 1
+            stats['max_depth'] = max(stats['max_depth'], len(lane))
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        # Returns a (port, item) tuple from the highest priority lane with
+        # anything in it, or None if the timeout expires or the queue has been
+        # closed and is empty
+        with self.cond:
+            while True:
+                # The oldest item in the barrier lanes holds back everything
+                # put after it
+                barrier_port = None
+                barrier = None
+                for port in self.barrier_ports:
+                    lane = self.lanes[port]
+                    if len(lane) > 0 and (barrier is None or lane[0][0] < barrier):
+                        (barrier_port, barrier) = (port, lane[0][0])
+                for port in self.ports:
+                    lane = self.lanes[port]
+                    if len(lane) > 0 and (barrier is None or lane[0][0] < barrier):
+                        return self.pop(port)
+                if barrier_port is not None:
+                    return self.pop(barrier_port)
+                if self.closed:
+                    return None
+                if not self.cond.wait(timeout):
+                    return None
+
+    def pop(self, port):
+        # NOTE: Must be called with the lock held
+        (_, item) = self.lanes[port].popleft()
+        if self.overflows[port] == OVERFLOW_BLOCK:
+            self.cond.notify_all()
+        return (port, item)
+
+    def close(self):
+        # Wake up anybody waiting; get() still drains what's left
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get_lane_stats(self, port):
+        # Returns a (queued, dropped, max_depth, depth) tuple for one lane
+        with self.cond:
+            stats = self.lane_stats[port]
+            return (stats['queued'], stats['dropped'], stats['max_depth'], len(self.lanes[port]))
+
+    def get_stats(self):
+        with self.cond:
+            return dict([(port, dict(stats, depth=len(self.lanes[port])))
+                for (port, stats) in self.lane_stats.items()])
+
+
+class pdu_worker():
+    # Runs deliver_fn(port, item) on its own thread for every item taken from
+    # a pdu_queue, until the queue is closed and drained
+    def __init__(self, queue, deliver_fn, name='pdu_worker'):
+        self.queue = queue
+        self.deliver_fn = deliver_fn
+        self.name = name
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+            (port, item) = entry
+            try:
+                self.deliver_fn(port, item)
+            except BaseException as e:
+                logging.warning(f'{self.name}: failed to deliver PDU on port {port}: {e}')
+
+    def stop(self):
+        self.queue.close()
+        self.thread.join()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import logging
+import signal
+import struct
+import time
+
+# Logging for PDU hot paths. Nothing is formatted unless the message is going
+# to be logged: messages are %-style format strings, formatted by the logging
+# module only after the level check, and long arguments (e.g. PDU contents)
+# are shortened at that point too. Sampled messages are logged for only one in
+# every sample_interval calls per key (e.g. per DUID or OSP).
+#
+# Separately, a binary trace of hot path events can be kept in a fixed size
+# ring buffer (see enable_trace()), and dumped on demand with dump_trace() or,
+# if enabled from the main thread, by sending the process SIGUSR1.
+
+
+def shorten(value, length=30):
+    # Shorten a string (or bytes) to at most length characters, keeping its
+    # start and end
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode(errors='replace')
+    s = str(value).strip()
+    if len(s) <= length:
+        return s
+    start_len = (length - 5) // 2
+    end_len = (length - 5) - start_len
+    return s[:start_len] + ' ... ' + s[-end_len:]
+
+
+class shortened():
+    # Argument wrapper that defers shorten() until the message is formatted
+    __slots__ = ['value', 'length']
+
+    def __init__(self, value, length):
+        self.value = value
+        self.length = length
+
+    def __str__(self):
+        return shorten(self.value, self.length)
+
+
+class hex_bytes():
+    # Argument wrapper that defers formatting a buffer as hex bytes until the
+    # message is formatted
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return ' '.join([f'{byte:02x}' for byte in self.value])
+
+
+class pdu_logger():
+    def __init__(self, prefix, sample_interval=1, max_arg_length=None):
+        # prefix is prepended to every message (e.g. 'p25_scanner: '); if
+        # max_arg_length is given, str, bytes and dict arguments are shortened
+        # to that length when formatted
+        self.prefix = prefix
+        self.sample_interval = max(1, int(sample_interval))
+        self.max_arg_length = max_arg_length
+        self.sample_counts = dict()
+
+    def is_enabled_for(self, level):
+        # Level check (cached by the logging module); use it to guard any work
+        # needed just to build a message's arguments
+        return logging.root.isEnabledFor(level)
+
+    def emit(self, level, message, args):
+        if self.max_arg_length:
+            args = tuple([shortened(arg, self.max_arg_length)
+                if isinstance(arg, (str, bytes, bytearray, dict)) else arg for arg in args])
+        logging.root.log(level, self.prefix + message, *args)
+
+    def log(self, level, message, *args):
+        if logging.root.isEnabledFor(level):
+            self.emit(level, message, args)
+
+    def debug(self, message, *args):
+        if logging.root.isEnabledFor(logging.DEBUG):
+            self.emit(logging.DEBUG, message, args)
+
+    def info(self, message, *args):
+        if logging.root.isEnabledFor(logging.INFO):
+            self.emit(logging.INFO, message, args)
+
+    def sampled(self, level, key, message, *args):
+        # Log one in every sample_interval messages for the given key, the
+        # first one included; the sample count is appended to the message
+        if not logging.root.isEnabledFor(level):
+            return
+        count = self.sample_counts.get(key, 0) + 1
+        self.sample_counts[key] = count
+        if self.sample_interval == 1:
+            self.emit(level, message, args)
+        elif count % self.sample_interval == 1:
+            self.emit(level, message + ' [%d]', args + (count,))
+
+
+# Trace records are fixed size: a perf_counter_ns() timestamp, an event ID
+# and two integer arguments whose meaning depends on the event
+TRACE_RECORD = struct.Struct('<QHxxqq')
+
+trace_event_names = []
+trace_buffer = None
+trace_depth = 0
+trace_index = 0
+
+
+def register_trace_event(name):
+    # Returns the ID to pass to trace() for the named event; call at import
+    # time so IDs don't depend on whether tracing is enabled
+    if name in trace_event_names:
+        return trace_event_names.index(name)
+    trace_event_names.append(name)
+    return len(trace_event_names) - 1
+
+
+def enable_trace(depth, dump_on_signal=True):
+    # Start keeping the most recent depth trace records (0 stops tracing)
+    global trace_buffer, trace_depth, trace_index
+    trace_index = 0
+    trace_depth = depth
+    trace_buffer = bytearray(TRACE_RECORD.size * depth) if depth > 0 else None
+    if trace_buffer is not None and dump_on_signal and hasattr(signal, 'SIGUSR1'):
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: dump_trace())
+        except ValueError:
+            # Not on the main thread
+            logging.info('pdu_log: trace can only be dumped with dump_trace()')
+
+
+def trace(event_id, arg0=0, arg1=0):
+    # Record an event; this is a no-op unless tracing is enabled. Records are
+    # written without a lock, so concurrent writers may occasionally
+    # overwrite each other's record.
+    global trace_index
+    if trace_buffer is None:
+        return
+    TRACE_RECORD.pack_into(trace_buffer, (trace_index % trace_depth) * TRACE_RECORD.size,
+        time.perf_counter_ns(), event_id, arg0, arg1)
+    trace_index += 1
+
+
+def get_trace():
+    # The trace records, oldest first, as (timestamp_ns, event name, arg0,
+    # arg1) tuples
+    if trace_buffer is None:
+        return []
+    count = min(trace_index, trace_depth)
+    first = trace_index - count
+    records = []
+    for index in range(first, first + count):
+        (timestamp, event_id, arg0, arg1) = TRACE_RECORD.unpack_from(trace_buffer,
+            (index % trace_depth) * TRACE_RECORD.size)
+        records.append((timestamp, trace_event_names[event_id], arg0, arg1))
+    return records
+
+
+def dump_trace(file_name=None):
+    # Write the trace, with timestamps relative to the last record, to the
+    # given file, or to the log
+    records = get_trace()
+    last_timestamp = records[-1][0] if len(records) > 0 else 0
+    lines = [f'{(timestamp - last_timestamp) / 1000.0:12.1f} us {name:<16s} {arg0} {arg1}'
+        for (timestamp, name, arg0, arg1) in records]
+    if file_name:
+        with open(file_name, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    else:
+        logging.warning(f'pdu_log: trace of {len(lines)} records follows\n' + '\n'.join(lines))
+
+
+if __name__ == "__main__":
+    # Compare the cost of a disabled debug message built with an f-string
+    # (formatted regardless of level) with a gated one, and of a trace record
+    ITERATIONS = 200000
+    logging.basicConfig(level=logging.WARNING)
+    log = pdu_logger('bench: ', max_arg_length=30)
+    data = {'p25_du': {'nac': '0x293', 'duid': '0x7',
+        'tsbk': '3d00150640320a18a2e04e7b', 'ok': 1}}
+    event = register_trace_event('bench')
+
+    def f_string():
+        for _ in range(ITERATIONS):
+            logging.debug(f'bench: {shorten(str(data))}')
+
+    def gated():
+        for _ in range(ITERATIONS):
+            log.debug('%s', data)
+
+    def sampled():
+        for _ in range(ITERATIONS):
+            log.sampled(logging.DEBUG, 7, '%s', data)
+
+    def traced():
+        for _ in range(ITERATIONS):
+            trace(event, 7, 12)
+
+    enable_trace(4096, dump_on_signal=False)
+    for (name, fn) in [('f-string', f_string), ('gated', gated),
+        ('sampled', sampled), ('trace', traced)]:
+        start = time.perf_counter()
+        fn()
+        print(f'{name:<10s} {(time.perf_counter() - start) / ITERATIONS * 1e9:6.0f} ns/call')
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Aaron Rossetto <aaron.rossetto@gmail.com>.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import time
+
+# NOTE: These counters are updated without locks from whichever thread
+# handles the PDU. They're meant to be cheap enough to leave on all the time,
+# so an occasional lost increment when two threads collide is tolerated.
+
+class latency_histogram():
+    # Histogram of durations in nanoseconds using power-of-two buckets:
+    # bucket n counts durations d where d.bit_length() == n, i.e.
+    # 2^(n-1) <= d < 2^n (bucket 0 counts zero durations). There are enough
+    # buckets for any perf_counter_ns() difference, so record() needn't clamp,
+    # and the count is only worked out when it's asked for.
+    NUM_BUCKETS = 64
+
+    def __init__(self):
+        self.buckets = [0] * self.NUM_BUCKETS
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, duration_ns):
+        self.buckets[duration_ns.bit_length()] += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def merge(self, other):
+        self.buckets = [a + b for (a, b) in zip(self.buckets, other.buckets)]
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def percentile(self, fraction, count=None):
+        # Upper bound (in ns) of the bucket holding the given fraction of the
+        # recorded durations, so the result is within 2x of the true value
+        target = fraction * (self.count if count is None else count)
+        running_count = 0
+        for (bucket, bucket_count) in enumerate(self.buckets):
+            running_count += bucket_count
+            if running_count >= target and running_count > 0:
+                return min((1 << bucket) - 1, self.max_ns)
+        return 0
+
+    def summary(self):
+        # Summary in microseconds
+        count = self.count
+        if count == 0:
+            return {'count': 0}
+        return {
+            'count': count,
+            'mean_us': self.total_ns / count / 1000.0,
+            'p50_us': self.percentile(0.5, count) / 1000.0,
+            'p90_us': self.percentile(0.9, count) / 1000.0,
+            'p99_us': self.percentile(0.99, count) / 1000.0,
+            'max_us': self.max_ns / 1000.0
+        }
+
+
+class port_ingest_stats():
+    # Ingest counters and latency histograms for one input port
+    def __init__(self):
+        self.pdus = 0
+        self.bytes = 0
+        self.parse_time = latency_histogram()
+        self.handler_time = latency_histogram()
+
+    def summary(self):
+        return {
+            'pdus': self.pdus,
+            'bytes': self.bytes,
+            'parse': self.parse_time.summary(),
+            'handler': self.handler_time.summary()
+        }
+
+
+# Hops of the latency probe. A frame decoder with latency_probe set stamps
+# each P25 DU PDU with the time it was emitted ('t_ns' in the p25_du
+# dictionary, in time.monotonic_ns() terms), and with the latency_probe
+# parameter set, the front end interface, out of process proxy and P25
+# scanner back end note the time each probed PDU finishes a hop in its
+# 'probe' dictionary:
+#   dsp: emitted by the frame decoder to picked up for parsing by the front
+#       end interface (after its worker queue, if it has one)
+#   parse: parsed by the front end interface (or the back end, if PDUs are
+#       passed on unparsed)
+#   queue: waiting in the front end's batcher and the proxy's lanes, up to
+#       being sent to the child process
+#   ipc: sent to the child process to received by it
+#   dispatch: handled by the back end
+# A hop that isn't stamped (e.g. no proxy) is counted in the next one.
+LATENCY_PROBE_HOPS = ['dsp', 'parse', 'queue', 'ipc', 'dispatch']
+
+
+def stamp_probe(pdu, hop, time_ns=None):
+    # Note the time a probed PDU finished the given hop (now, unless given);
+    # other PDUs are left alone
+    if type(pdu) is dict:
+        du = pdu.get('p25_du')
+        if du is not None and 't_ns' in du:
+            pdu.setdefault('probe', dict())[hop] = time.monotonic_ns() if time_ns is None else time_ns
+
+
+class latency_probe():
+    # Per hop latency histograms of probed PDUs (see LATENCY_PROBE_HOPS), plus
+    # their total latency from emission to the end of the last hop stamped
+    def __init__(self):
+        self.hops = dict([(hop, latency_histogram()) for hop in LATENCY_PROBE_HOPS])
+        self.total = latency_histogram()
+
+    def record(self, pdu):
+        # Record the hops of a probed PDU; hops are taken in time order,
+        # which puts the parse in the right place when it happens last
+        previous_ns = emitted_ns = pdu['p25_du']['t_ns']
+        for (hop, end_ns) in sorted(pdu.get('probe', dict()).items(), key=lambda item: item[1]):
+            self.hops[hop].record(max(0, end_ns - previous_ns))
+            previous_ns = end_ns
+        self.total.record(max(0, previous_ns - emitted_ns))
+
+    def summary(self):
+        return dict([(hop, histogram.summary()) for (hop, histogram) in self.hops.items()],
+            total=self.total.summary())
+
+    def report(self):
+        # Table of the summary, for logging
+        lines = [f'{"hop":<10s} {"count":>8s} {"p50 us":>10s} {"p90 us":>10s} {"p99 us":>10s} {"max us":>10s}']
+        for (hop, summary) in self.summary().items():
+            if summary['count'] > 0:
+                lines.append(f'{hop:<10s} {summary["count"]:>8d} {summary["p50_us"]:>10.0f} '
+                    f'{summary["p90_us"]:>10.0f} {summary["p99_us"]:>10.0f} {summary["max_us"]:>10.0f}')
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    # Measure the per-PDU cost of the instrumentation (the same counter
+    # updates, clock reads and histogram records the front end does) against
+    # the cost of decoding a TSBK PDU, timing every PDU and every 8th PDU
+    from scanner import pdu_codec
+
+    ITERATIONS = 200000
+    TSBK_PDU = b'{"p25_du": {"nac": "0x293", "duid": "0x7", ' \
+        b'"tsbk": "3d00150640320a18a2e04e7b", "ok": 1}}\n'
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        pdu_codec.decode_pdu(TSBK_PDU)
+    decode_time = time.perf_counter() - start
+    print(f'TSBK decode: {decode_time / ITERATIONS * 1e9:.0f} ns/PDU')
+
+    for timing_interval in [1, 8]:
+        stats = port_ingest_stats()
+        timing_countdown = timing_interval
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            stats.pdus += 1
+            stats.bytes += len(TSBK_PDU)
+            timed = timing_countdown == 1
+            timing_countdown = timing_interval if timed else timing_countdown - 1
+            if timed:
+                start_ns = time.perf_counter_ns()
+                parsed_ns = time.perf_counter_ns()
+                stats.parse_time.record(parsed_ns - start_ns)
+                stats.handler_time.record(time.perf_counter_ns() - parsed_ns)
+        stats_time = time.perf_counter() - start
+        print(f'instrumentation, timing every {timing_interval} PDUs: '
+            f'{stats_time / ITERATIONS * 1e9:.0f} ns/PDU '
+            f'({stats_time / decode_time * 100:.0f}% of decode)')